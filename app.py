@@ -7,10 +7,17 @@ from pathlib import Path
 # Добавляем папку cyber-vis в путь Python
 sys.path.insert(0, str(Path(__file__).parent / "cyber-vis"))
 
-# Импортируем FastAPI приложение
-from server import app
 
-# Теперь uvicorn может найти "app:app"
+def __getattr__(name):
+    # FastAPI приложение импортируется при обращении (uvicorn находит "app:app"),
+    # а не при импорте модуля: процессы пула scrypt (spawn) импортируют
+    # запускаемый файл заново, им сервер не нужен
+    if name == "app":
+        from server import app
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    uvicorn.run("app:app", host="0.0.0.0", port=8000)
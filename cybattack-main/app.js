@@ -279,10 +279,47 @@
             loadChartData();
             return;
         }
+        if (message.type === 'login_attempts_batch' && message.data) {
+            // Пачка попыток одним событием: в data.attempts - последние из неё
+            (message.data.attempts || []).forEach((attempt) => {
+                liveAttempts.unshift(attempt);
+                recentAttempts.unshift(attempt);
+            });
+            liveAttempts = liveAttempts.slice(0, maxLiveAttempts);
+            recentAttempts = recentAttempts.slice(0, maxRecentAttempts);
+            renderAttemptsList(liveAttempts, 'liveAttemptsList', 'liveAttemptsCount');
+            renderAttemptsList(recentAttempts, 'recentAttemptsList', 'recentAttemptsCount');
+            if ((message.data.blocked || []).length > 0) {
+                loadBlockedIps();
+            }
+            loadStats();
+            loadChartData();
+            return;
+        }
+        if (message.type === 'login_attempt_enriched' && message.data) {
+            // Геолокация попыток с одного IP определилась после их записи
+            const { ids, ...geo } = message.data;
+            const enrichedIds = new Set(ids || []);
+            [liveAttempts, recentAttempts].forEach((list) => {
+                list.forEach((attempt) => {
+                    if (enrichedIds.has(attempt.id)) {
+                        Object.assign(attempt, geo, { geo_pending: false });
+                    }
+                });
+            });
+            renderAttemptsList(liveAttempts, 'liveAttemptsList', 'liveAttemptsCount');
+            renderAttemptsList(recentAttempts, 'recentAttemptsList', 'recentAttemptsCount');
+            return;
+        }
         if (message.type === 'ip_blocked') {
             loadBlockedIps();
             return;
         }
+        if (message.type === 'rule_alert' && message.data) {
+            // Сработало правило обнаружения с действием alert
+            console.warn(`Правило ${message.data.rule}: ${message.data.key} - ${message.data.reason}`);
+            return;
+        }
         if (message.type === 'stats_update') {
             updateStats(message.data);
             updateLastUpdateTime();
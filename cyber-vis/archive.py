@@ -0,0 +1,157 @@
+"""
+Архив старых попыток входа: по одному gzip-файлу NDJSON на день
+"""
+import gzip
+import json
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime
+
+from records import to_epoch_us
+
+
+def attempt_key(attempt: dict) -> tuple:
+    """Ключ сортировки архивной попытки (attempt_ts, id).
+
+    В архивах до появления attempt_ts время восстанавливается из attempt_time
+    (в час перевода часов назад - неоднозначно)
+    """
+    ts = attempt.get("attempt_ts")
+    if ts is None:
+        ts = to_epoch_us(attempt["attempt_time"]) if attempt.get("attempt_time") else 0
+    return ts, attempt.get("id") or 0
+
+
+class AttemptArchive:
+    """Посуточные файлы attempts-YYYY-MM-DD.ndjson.gz.
+
+    Каждая порция дописывается отдельным gzip-членом, поэтому файл можно
+    пополнять кусками, не перепаковывая уже записанное. Последние
+    cache_days прочитанных дней держатся в памяти (пока файл не изменился):
+    страницы ленты с include_archive не распаковывают день заново.
+    """
+
+    PREFIX = "attempts-"
+    SUFFIX = ".ndjson.gz"
+
+    def __init__(self, directory, cache_days=1):
+        self.directory = directory
+        self.cache_days = cache_days
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+
+    def _path(self, day: str) -> str:
+        return os.path.join(self.directory, f"{self.PREFIX}{day}{self.SUFFIX}")
+
+    @staticmethod
+    def _day(attempt_time: str) -> str:
+        return (attempt_time or "unknown")[:10]
+
+    def append(self, attempts: list):
+        """Дописать попытки в файлы своих дней и сбросить их на диск"""
+        if not attempts:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        by_day = {}
+        for attempt in attempts:
+            by_day.setdefault(self._day(attempt.get("attempt_time")), []).append(attempt)
+        for day, day_attempts in by_day.items():
+            payload = "".join(
+                json.dumps(attempt, ensure_ascii=False, default=str) + "\n"
+                for attempt in day_attempts
+            ).encode("utf-8")
+            with open(self._path(day), "ab") as f:
+                f.write(gzip.compress(payload))
+                f.flush()
+                os.fsync(f.fileno())
+
+    def days(self) -> list:
+        """Дни, за которые есть архив (по возрастанию)"""
+        if not self.directory or not os.path.isdir(self.directory):
+            return []
+        return sorted(
+            name[len(self.PREFIX):-len(self.SUFFIX)]
+            for name in os.listdir(self.directory)
+            if name.startswith(self.PREFIX) and name.endswith(self.SUFFIX)
+        )
+
+    def read_day(self, day: str) -> list:
+        """Все попытки за день, по возрастанию (attempt_ts, id) (список не изменять)"""
+        path = self._path(day)
+        stat = os.stat(path)
+        signature = (stat.st_mtime_ns, stat.st_size)
+        with self._cache_lock:
+            cached = self._cache.get(day)
+            if cached is not None and cached[0] == signature:
+                self._cache.move_to_end(day)
+                return cached[1]
+        attempts = self._load_day(path)
+        if self.cache_days > 0:
+            with self._cache_lock:
+                self._cache[day] = (signature, attempts)
+                self._cache.move_to_end(day)
+                while len(self._cache) > self.cache_days:
+                    self._cache.popitem(last=False)
+        return attempts
+
+    def _load_day(self, path: str) -> list:
+        seen = set()
+        attempts = []
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                attempt = json.loads(line)
+                # После сбоя между записью архива и DELETE порция могла попасть дважды
+                if attempt.get("id") in seen:
+                    continue
+                seen.add(attempt.get("id"))
+                attempts.append(attempt)
+        attempts.sort(key=attempt_key)
+        return attempts
+
+    def iter_attempts(self, start: datetime = None, end: datetime = None, newest_first=True,
+                      last_day: str = None):
+        """Итерировать архивные попытки в диапазоне [start, end).
+
+        last_day - не читать дни позже него (страница после курсора)
+        """
+        start_text = start.isoformat() if start else None
+        end_text = end.isoformat() if end else None
+        start_ts = to_epoch_us(start) if start else None
+        end_ts = to_epoch_us(end) if end else None
+        days = self.days()
+        if newest_first:
+            days.reverse()
+        for day in days:
+            if start_text and day < start_text[:10]:
+                continue
+            if end_text and day > end_text[:10]:
+                continue
+            if last_day and day > last_day:
+                continue
+            attempts = self.read_day(day)
+            for attempt in (reversed(attempts) if newest_first else attempts):
+                ts = attempt_key(attempt)[0]
+                if start_ts is not None and ts < start_ts:
+                    continue
+                if end_ts is not None and ts >= end_ts:
+                    continue
+                yield attempt
+
+    def totals(self) -> dict:
+        """Итоги архива для точной сверки и первичного заполнения статистики:
+        попытки, успешные, множества логинов и IP (полный проход по файлам,
+        в кэш не попадает)"""
+        total = successful = 0
+        usernames = set()
+        ips = set()
+        for day in self.days():
+            for attempt in self._load_day(self._path(day)):
+                total += 1
+                successful += bool(attempt.get("success"))
+                usernames.add(attempt.get("username"))
+                if attempt.get("ip_address") is not None:
+                    ips.add(attempt["ip_address"])
+        return {"total": total, "successful": successful, "usernames": usernames, "ips": ips}
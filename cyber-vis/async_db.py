@@ -0,0 +1,83 @@
+"""
+Асинхронный доступ к LoginDatabase для обработчиков FastAPI
+"""
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from database import db, env_int
+
+
+class DatabaseTimeout(TimeoutError):
+    """Запрос к БД не уложился в отведённое время"""
+
+
+class AsyncLoginDatabase:
+    """Выполняет методы LoginDatabase в отдельном пуле потоков.
+
+    Event loop не ждёт SQLite: каждый вызов уходит в пул из max_workers
+    потоков, одновременно в работе и в очереди не больше max_pending
+    вызовов, на каждый вызов действует таймаут. Методы доступны под теми
+    же именами, что и у LoginDatabase, но возвращают корутины:
+
+        attempts = await adb.get_recent_attempts(20)
+    """
+
+    def __init__(self, database, max_workers=None, max_pending=None, timeout=None):
+        self.db = database
+        self.max_workers = max_workers or env_int("CYBER_VIS_DB_WORKERS", database.reader_count + 1)
+        self.max_pending = max_pending or env_int("CYBER_VIS_DB_MAX_PENDING", 256)
+        self.timeout = timeout if timeout is not None else (
+            env_int("CYBER_VIS_DB_TIMEOUT_MS", 5000) / 1000
+        )
+        # Пул и семафор создаются при первом вызове и сбрасываются в close():
+        # после остановки сервера его можно запустить снова в том же процессе
+        self._executor = None
+        self._slots = None
+
+    async def run(self, func, *args, timeout=None, **kwargs):
+        """Выполнить func(*args, **kwargs) в пуле БД с таймаутом"""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.max_workers,
+                thread_name_prefix="cyber-vis-db",
+            )
+            self._slots = asyncio.Semaphore(self.max_pending)
+        await self._slots.acquire()
+        try:
+            future = self._executor.submit(functools.partial(func, *args, **kwargs))
+        except BaseException:
+            self._slots.release()
+            raise
+        # Слот освобождается, когда поток действительно закончил работу,
+        # даже если ожидающий обработчик уже ушёл по таймауту
+        loop = asyncio.get_running_loop()
+        future.add_done_callback(lambda _: loop.call_soon_threadsafe(self._slots.release))
+
+        limit = self.timeout if timeout is None else timeout
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), limit or None)
+        except asyncio.TimeoutError:
+            name = getattr(func, "__name__", repr(func))
+            raise DatabaseTimeout(f"Запрос {name} к БД превысил {limit:.1f} с") from None
+
+    def __getattr__(self, name):
+        method = getattr(self.db, name)
+        if not callable(method):
+            return method
+
+        async def call(*args, timeout=None, **kwargs):
+            return await self.run(method, *args, timeout=timeout, **kwargs)
+
+        call.__name__ = name
+        return call
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+            self._slots = None
+
+
+# Глобальный асинхронный доступ к БД
+adb = AsyncLoginDatabase(db)
@@ -0,0 +1,386 @@
+"""
+Реестр блокировок IP и подсетей в памяти
+"""
+import csv
+import heapq
+import ipaddress
+import threading
+from datetime import datetime
+
+
+def block_key(value: str) -> str:
+    """Ключ блокировки: IP как есть, подсеть - в каноническом виде CIDR.
+
+    Сеть из одного адреса (/32, /128) сводится к обычному IP.
+    ValueError - если подсеть некорректна.
+    """
+    if "/" not in value:
+        return value
+    network = ipaddress.ip_network(value.strip(), strict=False)
+    if network.prefixlen == network.max_prefixlen:
+        return str(network.network_address)
+    return str(network)
+
+
+def parse_block_target(value: str) -> str:
+    """Строгая проверка адреса или подсети (для импорта списков): канонический ключ.
+
+    ValueError - если значение не IP и не CIDR.
+    """
+    value = value.strip()
+    if "/" in value:
+        return block_key(value)
+    return str(ipaddress.ip_address(value))
+
+
+def subnet_of(ip_address):
+    """IPv4 -> /24, IPv6 -> /48; None для некорректного адреса"""
+    try:
+        ip = ipaddress.ip_address(ip_address)
+    except (TypeError, ValueError):
+        return None
+    prefix = 24 if ip.version == 4 else 48
+    return str(ipaddress.ip_network(f"{ip}/{prefix}", strict=False))
+
+
+# Колонки списка блокировок в CSV (импорт и выгрузка)
+BLOCKLIST_COLUMNS = ("ip_address", "reason", "blocked_until", "is_permanent", "created_at")
+
+
+class BlocklistParser:
+    """Построчный разбор списка блокировок.
+
+    Текст: адрес или CIDR в начале строки, '#' - комментарий. CSV: первая
+    строка - заголовок с колонкой ip_address (остальные из BLOCKLIST_COLUMNS
+    необязательны). Повторы схлопываются (побеждает последняя строка),
+    ошибки копятся с номерами строк.
+    """
+
+    MAX_ERRORS = 100
+
+    def __init__(self, fmt="text", reason=None, blocked_until=None, is_permanent=False):
+        self.fmt = fmt
+        self.defaults = {
+            "reason": reason,
+            "blocked_until": blocked_until,
+            "is_permanent": int(bool(is_permanent)),
+        }
+        self.entries = {}
+        self.errors = []
+        self.invalid = 0
+        self.line_no = 0
+        self._header = None
+
+    def _error(self, value, message):
+        self.invalid += 1
+        if len(self.errors) < self.MAX_ERRORS:
+            self.errors.append({"line": self.line_no, "value": value[:100], "error": message})
+
+    def feed(self, line: str):
+        self.line_no += 1
+        if self.fmt == "csv":
+            self._feed_csv(line)
+            return
+        value = line.split("#", 1)[0].strip()
+        if value:
+            self._add(value.split()[0], {})
+
+    def _feed_csv(self, line):
+        if not line.strip():
+            return
+        row = next(csv.reader([line]))
+        if self._header is None:
+            header = [column.strip().lower() for column in row]
+            if "ip_address" not in header:
+                raise ValueError("В заголовке CSV нет колонки ip_address")
+            self._header = header
+            return
+        fields = dict(zip(self._header, row))
+        overrides = {}
+        if fields.get("reason"):
+            overrides["reason"] = fields["reason"]
+        if fields.get("blocked_until"):
+            try:
+                overrides["blocked_until"] = datetime.fromisoformat(fields["blocked_until"]).isoformat()
+            except ValueError:
+                self._error(line.strip(), "некорректный blocked_until")
+                return
+        if fields.get("is_permanent"):
+            overrides["is_permanent"] = int(fields["is_permanent"].strip().lower() in ("1", "true", "yes"))
+        self._add(fields.get("ip_address", ""), overrides)
+
+    def _add(self, value, overrides):
+        try:
+            key = parse_block_target(value)
+        except ValueError:
+            self._error(value, "не IP-адрес и не подсеть")
+            return
+        block = {**self.defaults, **overrides, "ip_address": key}
+        if block["is_permanent"]:
+            block["blocked_until"] = None
+        elif block["blocked_until"] is None:
+            self._error(value, "не задан срок блокировки")
+            return
+        self.entries[key] = block
+
+
+class _TrieNode:
+    __slots__ = ("prefix", "length", "children", "key")
+
+    def __init__(self, prefix, length, key=None):
+        self.prefix = prefix
+        self.length = length
+        self.children = [None, None]
+        self.key = key
+
+
+class PrefixTrie:
+    """Сжатое двоичное префиксное дерево (Patricia) для адресов width бит.
+
+    Узлы есть только в точках ветвления и у сохранённых префиксов, поэтому
+    поиск проходит не больше узлов, чем префиксов на пути к адресу
+    (не больше width), независимо от общего числа подсетей.
+    """
+
+    def __init__(self, width):
+        self.width = width
+        self.size = 0
+        self._root = _TrieNode(0, 0)
+
+    def _mask(self, length):
+        return ((1 << length) - 1) << (self.width - length)
+
+    def _bit(self, value, position):
+        return (value >> (self.width - position - 1)) & 1
+
+    def _common(self, a, b, limit):
+        diff = a ^ b
+        common = self.width - diff.bit_length() if diff else self.width
+        return min(common, limit)
+
+    def insert(self, prefix, length, key):
+        prefix &= self._mask(length)
+        node = self._root
+        while True:
+            if node.length == length:
+                if node.key is None:
+                    self.size += 1
+                node.key = key
+                return
+            bit = self._bit(prefix, node.length)
+            child = node.children[bit]
+            if child is None:
+                node.children[bit] = _TrieNode(prefix, length, key)
+                self.size += 1
+                return
+            common = self._common(child.prefix, prefix, min(child.length, length))
+            if common == child.length:
+                node = child
+                continue
+            # Разветвление внутри ребра: новый промежуточный узел собирается
+            # целиком и подвешивается одним присваиванием
+            middle = _TrieNode(prefix & self._mask(common), common)
+            middle.children[self._bit(child.prefix, common)] = child
+            if common == length:
+                middle.key = key
+            else:
+                middle.children[self._bit(prefix, common)] = _TrieNode(prefix, length, key)
+            node.children[bit] = middle
+            self.size += 1
+            return
+
+    def remove(self, prefix, length):
+        prefix &= self._mask(length)
+        parent, node = None, self._root
+        while node is not None and node.length < length:
+            if (prefix & self._mask(node.length)) != node.prefix:
+                return
+            parent, node = node, node.children[self._bit(prefix, node.length)]
+        if node is None or node.length != length or node.prefix != prefix or node.key is None:
+            return
+        node.key = None
+        self.size -= 1
+        if parent is None:
+            return
+        # Узел без ключа нужен, только пока у него два потомка
+        children = [child for child in node.children if child is not None]
+        if len(children) < 2:
+            parent.children[self._bit(prefix, parent.length)] = children[0] if children else None
+
+    def lookup(self, address) -> list:
+        """Ключи всех префиксов, содержащих адрес, от самого длинного"""
+        keys = []
+        node = self._root
+        while node is not None and (address & self._mask(node.length)) == node.prefix:
+            if node.key is not None:
+                keys.append(node.key)
+            if node.length == self.width:
+                break
+            node = node.children[self._bit(address, node.length)]
+        keys.reverse()
+        return keys
+
+
+class BlockRegistry:
+    """Активные блокировки: словарь для проверки IP за O(1), префиксные
+    деревья для подсетей (ключ в ip_blocks.ip_address в виде CIDR) и
+    min-куча сроков.
+
+    Истёкшие записи перестают блокировать сразу, а из словаря и из БД их
+    убирает фоновый обход (pop_expired) - запросы на чтение ничего не пишут.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._blocks = {}
+        self._heap = []
+        self._networks = {4: PrefixTrie(32), 6: PrefixTrie(128)}
+        # Заблокированные по отдельности IP, сгруппированные по подсети /24 (/48)
+        self._by_subnet = {}
+
+    def load(self, rows):
+        """Заполнить реестр строками ip_blocks.
+
+        Новое состояние собирается в стороне и подменяется целиком: проверки
+        во время загрузки видят либо старый, либо новый список.
+        """
+        fresh = BlockRegistry()
+        for row in rows:
+            fresh._put(dict(row))
+        with self._lock:
+            self._blocks = fresh._blocks
+            self._heap = fresh._heap
+            self._networks = fresh._networks
+            self._by_subnet = fresh._by_subnet
+
+    @staticmethod
+    def _network(key):
+        if "/" not in key:
+            return None
+        try:
+            return ipaddress.ip_network(key, strict=False)
+        except ValueError:
+            return None
+
+    def _index(self, key, add):
+        """Добавить ключ в деревья подсетей / группы по подсети или убрать из них"""
+        network = self._network(key)
+        if network is not None:
+            trie = self._networks[network.version]
+            if add:
+                trie.insert(int(network.network_address), network.prefixlen, key)
+            else:
+                trie.remove(int(network.network_address), network.prefixlen)
+            return
+        subnet = subnet_of(key)
+        if subnet is None:
+            return
+        members = self._by_subnet.setdefault(subnet, set())
+        if add:
+            members.add(key)
+        else:
+            members.discard(key)
+            if not members:
+                del self._by_subnet[subnet]
+
+    def _put(self, block):
+        blocked_until = block.get("blocked_until")
+        if isinstance(blocked_until, str):
+            blocked_until = datetime.fromisoformat(blocked_until)
+        block["_until"] = None if block.get("is_permanent") else blocked_until
+        self._blocks[block["ip_address"]] = block
+        self._index(block["ip_address"], add=True)
+        if block["_until"] is not None:
+            heapq.heappush(self._heap, (block["_until"], block["ip_address"]))
+
+    def add(self, block: dict):
+        """Добавить или заменить блокировку (после записи в ip_blocks)"""
+        with self._lock:
+            self._put(dict(block))
+
+    def check(self, ip_address: str, now=None) -> tuple:
+        """(is_blocked, reason) без обращения к БД: сначала точный IP, потом подсети"""
+        now = now or datetime.now()
+        block = self._blocks.get(ip_address)
+        if block is not None and self._active(block, now):
+            return True, self._describe(block, now)
+        for block in self._covering(ip_address):
+            if self._active(block, now):
+                return True, self._describe(block, now)
+        return False, None
+
+    @staticmethod
+    def _active(block, now) -> bool:
+        until = block["_until"]
+        return bool(block.get("is_permanent")) or (until is not None and now < until)
+
+    @staticmethod
+    def _describe(block, now) -> str:
+        key, reason = block["ip_address"], block["reason"]
+        if block.get("is_permanent"):
+            if "/" in key:
+                return f"🚫 Постоянная блокировка подсети {key}: {reason}"
+            return f"🚫 Постоянная блокировка: {reason}"
+        minutes = int((block["_until"] - now).total_seconds() / 60)
+        if "/" in key:
+            return f"⏱️ Подсеть {key} заблокирована на {minutes} мин: {reason}"
+        return f"⏱️ IP заблокирован на {minutes} мин: {reason}"
+
+    def _covering(self, ip_address) -> list:
+        """Блокировки подсетей, содержащих адрес, от самой узкой"""
+        if not (self._networks[4].size or self._networks[6].size):
+            return []
+        try:
+            ip = ipaddress.ip_address(ip_address)
+        except (TypeError, ValueError):
+            return []
+        with self._lock:
+            keys = self._networks[ip.version].lookup(int(ip))
+            return [self._blocks[key] for key in keys if key in self._blocks]
+
+    def blocked_in_subnet(self, ip_address, now=None) -> int:
+        """Сколько IP из подсети /24 (/48) адреса сейчас заблокировано по отдельности"""
+        subnet = subnet_of(ip_address)
+        now = now or datetime.now()
+        with self._lock:
+            members = list(self._by_subnet.get(subnet, ()))
+            return sum(
+                1 for member in members
+                if member in self._blocks and self._active(self._blocks[member], now)
+            )
+
+    def next_expiry(self):
+        """Ближайший срок окончания временной блокировки (или None)"""
+        with self._lock:
+            return self._heap[0][0] if self._heap else None
+
+    def pop_expired(self, now=None) -> list:
+        """Убрать из реестра истёкшие блокировки, вернуть [(ip, blocked_until)]"""
+        now = now or datetime.now()
+        expired = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                until, ip_address = heapq.heappop(self._heap)
+                block = self._blocks.get(ip_address)
+                # Запись в куче могла устареть: блокировку продлили или сняли
+                if block is None or block["_until"] != until:
+                    continue
+                del self._blocks[ip_address]
+                self._index(ip_address, add=False)
+                expired.append((ip_address, until))
+        return expired
+
+    def snapshot(self, now=None) -> list:
+        """Активные блокировки в формате строк ip_blocks, новые первыми"""
+        now = now or datetime.now()
+        with self._lock:
+            blocks = [
+                {key: value for key, value in block.items() if key != "_until"}
+                for block in self._blocks.values()
+                if block["_until"] is None or block["_until"] > now
+            ]
+        blocks.sort(key=lambda block: block.get("created_at") or "", reverse=True)
+        return blocks
@@ -0,0 +1,61 @@
+"""
+Периодическое сохранение состояния из памяти в БД (скетчи статистики, кэши)
+"""
+import asyncio
+import logging
+
+from database import db, env_int
+from logs import log_event
+
+logger = logging.getLogger("cyber_vis.checkpoint")
+
+
+class StatsCheckpoint:
+    """Раз в interval секунд сохраняет HyperLogLog-скетчи в БД.
+
+    После перезапуска статистика восстанавливается из сохранённых скетчей
+    и попыток, добавленных после них, без прохода по всей таблице.
+    Другие модули добавляют свои сохранения через register(). Последнее
+    сохранение - при остановке.
+    """
+
+    def __init__(self, database, interval=None):
+        self.db = database
+        self.interval = interval or env_int("CYBER_VIS_STATS_CHECKPOINT_S", 60)
+        self.savers = [database.save_stats_sketches]
+        self._task = None
+
+    def register(self, saver):
+        """Добавить синхронную функцию сохранения (вызывается в отдельном потоке)"""
+        self.savers.append(saver)
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="stats-checkpoint")
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        await self.save()
+
+    async def save(self):
+        for saver in self.savers:
+            try:
+                await asyncio.to_thread(saver)
+            except Exception as e:
+                log_event(logger, logging.ERROR, "checkpoint_failed", saver=saver.__name__, error=e)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.save()
+
+
+# Глобальный обработчик сохранения скетчей
+stats_checkpoint = StatsCheckpoint(db)
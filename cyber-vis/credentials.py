@@ -0,0 +1,216 @@
+"""
+Проверка паролей: scrypt в ограниченном пуле процессов
+"""
+import asyncio
+import base64
+import hashlib
+import hmac
+import multiprocessing
+import os
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import asynccontextmanager
+
+# Параметры scrypt для новых хешей (~16 МБ памяти на проверку);
+# у сохранённых хешей параметры записаны в самом хеше
+SCRYPT_N = 2 ** 14
+SCRYPT_R = 8
+SCRYPT_P = 1
+SCRYPT_DKLEN = 32
+SALT_BYTES = 16
+
+
+def _b64(data: bytes) -> str:
+    return base64.b64encode(data).decode("ascii")
+
+
+def hash_password(password: str, salt: bytes = None) -> str:
+    """Хеш пароля: scrypt$n$r$p$соль$ключ (соль и ключ - base64)"""
+    salt = os.urandom(SALT_BYTES) if salt is None else salt
+    key = hashlib.scrypt(password.encode(), salt=salt, n=SCRYPT_N, r=SCRYPT_R, p=SCRYPT_P,
+                         dklen=SCRYPT_DKLEN)
+    return f"scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}${_b64(salt)}${_b64(key)}"
+
+
+def verify_password(password: str, encoded: str) -> bool:
+    """Сравнить пароль с хешем (выполняется в процессе пула)"""
+    try:
+        scheme, n, r, p, salt, key = encoded.split("$")
+        if scheme != "scrypt":
+            return False
+        expected = base64.b64decode(salt), base64.b64decode(key)
+        actual = hashlib.scrypt(password.encode(), salt=expected[0], n=int(n), r=int(r), p=int(p),
+                                dklen=len(expected[1]), maxmem=128 * int(r) * (int(n) + int(p) + 2))
+    except (ValueError, TypeError):
+        return False
+    return hmac.compare_digest(actual, expected[1])
+
+
+def _warm_up():
+    return os.getpid()
+
+
+class VerifierBusy(Exception):
+    """Очередь проверок паролей заполнена"""
+
+
+class CredentialVerifier:
+    """Проверка логина и пароля без нагрузки на event loop.
+
+    scrypt считается в пуле из workers процессов; ожидающих и выполняемых
+    проверок не больше max_pending - сверх этого verify() сразу бросает
+    VerifierBusy. Одинаковые одновременные попытки (логин + пароль) делят
+    одну проверку. Неверная пара запоминается на negative_ttl секунд:
+    повтор перебора не стоит нам ни одного вызова scrypt. В кэше хранится
+    не пароль, а HMAC от него с ключом, живущим только в памяти процесса.
+    Пароль неизвестного пользователя сверяется со случайным хешем - по
+    времени ответа не узнать, существует ли логин.
+    """
+
+    def __init__(self, users, workers=2, max_pending=64, negative_ttl=60, negative_size=100000):
+        self.users = users
+        self.workers = max(1, workers)
+        self.max_pending = max_pending
+        self.negative_ttl = negative_ttl
+        self.negative_size = negative_size
+        self._key = os.urandom(32)
+        # Тот же формат и параметры, что у hash_password, ключ случайный:
+        # scrypt для него считается столько же, совпадения не бывает
+        self._dummy_hash = (f"scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}$"
+                            f"{_b64(os.urandom(SALT_BYTES))}${_b64(os.urandom(SCRYPT_DKLEN))}")
+        self._pool = None
+        self._inflight = {}
+        # Места очереди, занятые reserve(), и сколько из них сейчас проверяется
+        self._reserved = 0
+        self._reserved_running = 0
+        self._negative = OrderedDict()
+        self.verified = 0
+        self.coalesced = 0
+        self.negative_hits = 0
+        self.rejected = 0
+
+    async def start(self):
+        if self._pool is not None:
+            return
+        # spawn: процессы пула не наследуют потоки и соединения сервера
+        self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(loop.run_in_executor(self._pool, _warm_up) for _ in range(self.workers)))
+
+    async def stop(self):
+        if self._pool is None:
+            return
+        pool, self._pool = self._pool, None
+        await asyncio.to_thread(pool.shutdown, True, cancel_futures=True)
+
+    @property
+    def pending(self) -> int:
+        return len(self._inflight)
+
+    def _occupied(self) -> int:
+        """Места очереди: проверки без резерва плюс весь резерв"""
+        return len(self._inflight) - self._reserved_running + self._reserved
+
+    def _busy(self) -> VerifierBusy:
+        self.rejected += 1
+        return VerifierBusy("Сервер перегружен проверками паролей, повторите позже")
+
+    @asynccontextmanager
+    async def reserve(self, slots: int):
+        """Занять slots мест очереди на время блока (пачка логинов).
+
+        Проверки с reserved=True идут в эти места и VerifierBusy не получают;
+        если мест нет сейчас - VerifierBusy сразу, до первой проверки.
+        """
+        if slots > 0 and self._occupied() + slots > self.max_pending:
+            raise self._busy()
+        self._reserved += slots
+        try:
+            yield
+        finally:
+            self._reserved -= slots
+
+    def _cache_key(self, username, password):
+        digest = hmac.new(self._key, password.encode(), hashlib.sha256).digest()
+        return username, digest
+
+    def _known_bad(self, key, now) -> bool:
+        expires_at = self._negative.get(key)
+        if expires_at is None:
+            return False
+        if expires_at <= now:
+            del self._negative[key]
+            return False
+        return True
+
+    def _remember_bad(self, key, now):
+        self._negative[key] = now + self.negative_ttl
+        self._negative.move_to_end(key)
+        while len(self._negative) > self.negative_size:
+            self._negative.popitem(last=False)
+
+    async def verify(self, username: str, password: str, reserved=False) -> bool:
+        """True - пара верна (для неизвестного пользователя - всегда False).
+
+        reserved=True - проверка в месте, занятом reserve() (не больше slots одновременно).
+        """
+        encoded = self.users.get(username)
+        known = encoded is not None
+        if not known:
+            encoded = self._dummy_hash
+        key = self._cache_key(username, password)
+        now = time.monotonic()
+        if self._known_bad(key, now):
+            self.negative_hits += 1
+            return False
+        future = self._inflight.get(key)
+        if future is not None:
+            self.coalesced += 1
+            return await asyncio.shield(future)
+        if self._pool is None:
+            await self.start()
+        if not reserved and self._occupied() >= self.max_pending:
+            raise self._busy()
+        loop = asyncio.get_running_loop()
+        future = self._inflight[key] = loop.run_in_executor(self._pool, verify_password, password, encoded)
+        self._reserved_running += reserved
+        try:
+            valid = await asyncio.shield(future)
+        finally:
+            self._inflight.pop(key, None)
+            self._reserved_running -= reserved
+        self.verified += 1
+        valid = valid and known
+        if not valid and self.negative_ttl > 0:
+            self._remember_bad(key, time.monotonic())
+        return valid
+
+    async def verify_many(self, pairs, reserved=False) -> list:
+        """Проверить пачку пар (логин, пароль); результаты в том же порядке.
+
+        Одинаковые пары проверяются один раз; scrypt считается волнами по
+        workers * 2 проверок, чтобы одна пачка не занимала всю очередь.
+        """
+        unique = list(dict.fromkeys(pairs))
+        results = {}
+        wave = self.workers * 2
+        for start in range(0, len(unique), wave):
+            chunk = unique[start:start + wave]
+            verdicts = await asyncio.gather(*(self.verify(username, password, reserved)
+                                             for username, password in chunk))
+            results.update(zip(chunk, verdicts))
+        return [results[pair] for pair in pairs]
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "pending": self.pending,
+            "max_pending": self.max_pending,
+            "reserved": self._reserved,
+            "verified": self.verified,
+            "coalesced": self.coalesced,
+            "negative_hits": self.negative_hits,
+            "negative_size": len(self._negative),
+            "rejected": self.rejected,
+        }
@@ -1,8 +1,25 @@
 import os
 import sys
+import queue
 import sqlite3
 import json
-from datetime import datetime, timedelta
+import logging
+import threading
+from bisect import bisect_right
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+
+from archive import AttemptArchive, attempt_key
+from blocks import BlockRegistry, block_key
+from failures import FailureCounters
+from heavy_hitters import HeavyHitters
+from hll import precision_for_error
+from logs import log_event
+from records import AttemptRecord, to_epoch_us, from_epoch_us
+from stats import StatsEngine
+
+logger = logging.getLogger("cyber_vis.database")
 
 for stream in (sys.stdout, sys.stderr):
     if hasattr(stream, "reconfigure"):
@@ -11,143 +28,1046 @@ for stream in (sys.stdout, sys.stderr):
         except Exception:
             pass
 
+def env_int(name, default):
+    try:
+        return int(os.environ.get(name, default))
+    except (TypeError, ValueError):
+        return default
+
+def env_float(name, default):
+    try:
+        return float(os.environ.get(name, default))
+    except (TypeError, ValueError):
+        return default
+
+def normalize_user_agent(value, limit):
+    """User agent перед записью в словарь строк: пробелы схлопнуты, длина
+    не больше limit (0 - без ограничения). Значение задаёт клиент - без
+    обрезки каждый вариант длинной строки стал бы отдельной записью словаря"""
+    if value is None:
+        return None
+    value = " ".join(value.split())
+    return value[:limit] if limit > 0 else value
+
+# Ключи metadata, которые дублируют колонки попытки и не хранятся
+REDUNDANT_METADATA_KEYS = frozenset({"timestamp", "client_info", "geo", "attack_type", "threat_level"})
+
+def compact_metadata(metadata):
+    """Оставить в metadata только поля, которых нет в колонках попытки"""
+    if not metadata:
+        return None
+    if isinstance(metadata, str):
+        try:
+            metadata = json.loads(metadata)
+        except ValueError:
+            return metadata
+    if not isinstance(metadata, dict):
+        return json.dumps(metadata, ensure_ascii=False)
+    extra = {key: value for key, value in metadata.items() if key not in REDUNDANT_METADATA_KEYS}
+    return json.dumps(extra, ensure_ascii=False) if extra else None
+
+# Уровни агрегатов attempt_rollups (секунды). Более грубое разрешение
+# графика строится из самого крупного подходящего уровня.
+ROLLUP_RESOLUTIONS = (60, 3600)
+
+# Разрешения для /api/chart_data/timeseries
+TIMESERIES_RESOLUTIONS = {
+    "minute": 60,
+    "5min": 300,
+    "15min": 900,
+    "hour": 3600,
+    "day": 86400,
+}
+
+# Разрезы графика: имя параметра -> колонка attempt_rollups
+TIMESERIES_SPLITS = ("success", "attack_type", "threat_level", "country")
+
+def _migration_1_base_schema(cursor):
+    """Базовые таблицы попыток входа и блокировок"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS login_attempts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT NOT NULL,
+            ip_address TEXT,
+            country TEXT,
+            city TEXT,
+            latitude REAL,
+            longitude REAL,
+            attack_type TEXT,
+            threat_level TEXT,
+            client_type TEXT,
+            success BOOLEAN NOT NULL,
+            reason TEXT,
+            attempt_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            user_agent TEXT,
+            metadata TEXT
+        )
+    ''')
+    
+    # Add missing columns for older local SQLite databases.
+    cursor.execute("PRAGMA table_info(login_attempts)")
+    existing = {row[1] for row in cursor.fetchall()}
+    for column_name, column_type in (
+        ("country", "TEXT"),
+        ("city", "TEXT"),
+        ("latitude", "REAL"),
+        ("longitude", "REAL"),
+        ("attack_type", "TEXT"),
+        ("threat_level", "TEXT"),
+    ):
+        if column_name not in existing:
+            cursor.execute(f"ALTER TABLE login_attempts ADD COLUMN {column_name} {column_type}")
+    
+    # Таблица заблокированных IP адресов
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS ip_blocks (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ip_address TEXT UNIQUE NOT NULL,
+            reason TEXT,
+            blocked_until TIMESTAMP,
+            is_permanent BOOLEAN DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+def _migration_2_hot_path_indexes(cursor):
+    """Индексы под запросы логина, ленты попыток, карты и блокировок"""
+    # get_failed_attempts_count: ip_address = ? AND success = 0 AND attempt_time >= ?
+    # (диапазон по IP и времени, успешные отбрасываются при чтении)
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_attempts_ip_address_time
+        ON login_attempts (ip_address, attempt_time)
+    ''')
+    # get_recent_attempts и окна get_stats: ORDER BY / диапазон по attempt_time
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_attempts_time
+        ON login_attempts (attempt_time)
+    ''')
+    # get_geo_attempts: только строки с координатами
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_attempts_geo_time
+        ON login_attempts (attempt_time)
+        WHERE latitude IS NOT NULL AND longitude IS NOT NULL
+    ''')
+    # get_blocked_ips: очистка истёкших и сортировка по created_at
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_blocks_expiry
+        ON ip_blocks (is_permanent, blocked_until)
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_blocks_created
+        ON ip_blocks (created_at)
+    ''')
+    cursor.execute("ANALYZE")
+
+def _migration_3_rollups(cursor):
+    """Агрегаты попыток по минутам и часам для графиков"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS attempt_rollups (
+            resolution INTEGER NOT NULL,
+            bucket INTEGER NOT NULL,
+            success INTEGER NOT NULL,
+            attack_type TEXT NOT NULL DEFAULT '',
+            threat_level TEXT NOT NULL DEFAULT '',
+            country TEXT NOT NULL DEFAULT '',
+            attempts INTEGER NOT NULL,
+            PRIMARY KEY (resolution, bucket, success, attack_type, threat_level, country)
+        ) WITHOUT ROWID
+    ''')
+    # Заполняем агрегаты по уже накопленным строкам (attempt_time - локальное время)
+    for resolution in ROLLUP_RESOLUTIONS:
+        cursor.execute('''
+            INSERT INTO attempt_rollups
+            (resolution, bucket, success, attack_type, threat_level, country, attempts)
+            SELECT
+                ?,
+                CAST(strftime('%s', attempt_time, 'utc') AS INTEGER) / ? * ?,
+                success,
+                COALESCE(attack_type, ''),
+                COALESCE(threat_level, ''),
+                COALESCE(country, ''),
+                COUNT(*)
+            FROM login_attempts
+            WHERE strftime('%s', attempt_time, 'utc') IS NOT NULL
+            GROUP BY 2, 3, 4, 5, 6
+        ''', (resolution, resolution, resolution))
+
+# Фильтры с собственным индексом (поле, время). success, attack_type и
+# threat_level принимают два-три значения: такой фильтр читает
+# idx_attempts_time почти без пропусков, отдельный индекс только замедлял бы запись
+INDEXED_FILTERS = ("username", "ip_address", "country")
+
+def _migration_4_filter_indexes(cursor):
+    """Индексы (поле, attempt_time) под избирательные фильтры ленты попыток и карты атак"""
+    for column in INDEXED_FILTERS:
+        cursor.execute(f'''
+            CREATE INDEX IF NOT EXISTS idx_attempts_{column}_time
+            ON login_attempts ({column}, attempt_time)
+        ''')
+    cursor.execute("ANALYZE")
+
+def _iso_to_us(value):
+    try:
+        return to_epoch_us(value) if value else None
+    except (TypeError, ValueError):
+        return None
+
+def _migration_5_compact_attempts(cursor):
+    """Компактное хранение: словарь строк, attempt_ts вместо ISO, metadata без дублей"""
+    conn = cursor.connection
+    conn.create_function("iso_to_us", 1, _iso_to_us, deterministic=True)
+    conn.create_function("compact_metadata", 1, compact_metadata, deterministic=True)
+    
+    # Повторяющиеся строки (страна, тип клиента, причина, user agent) - по ID
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS attempt_strings (
+            id INTEGER PRIMARY KEY,
+            value TEXT NOT NULL UNIQUE
+        )
+    ''')
+    for column in ("country", "client_type", "reason", "user_agent"):
+        cursor.execute(f'''
+            INSERT OR IGNORE INTO attempt_strings (value)
+            SELECT DISTINCT {column} FROM login_attempts WHERE {column} IS NOT NULL
+        ''')
+    
+    cursor.execute('''
+        CREATE TABLE login_attempts_compact (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            attempt_ts INTEGER NOT NULL,
+            username TEXT NOT NULL,
+            ip_address TEXT,
+            success INTEGER NOT NULL,
+            attack_type TEXT,
+            threat_level TEXT,
+            country_id INTEGER REFERENCES attempt_strings(id),
+            city TEXT,
+            latitude REAL,
+            longitude REAL,
+            client_type_id INTEGER REFERENCES attempt_strings(id),
+            reason_id INTEGER REFERENCES attempt_strings(id),
+            user_agent_id INTEGER REFERENCES attempt_strings(id),
+            metadata TEXT
+        )
+    ''')
+    cursor.execute('''
+        INSERT INTO login_attempts_compact
+        (id, attempt_ts, username, ip_address, success, attack_type, threat_level,
+         country_id, city, latitude, longitude, client_type_id, reason_id, user_agent_id, metadata)
+        SELECT
+            a.id,
+            COALESCE(iso_to_us(a.attempt_time), 0),
+            a.username,
+            a.ip_address,
+            a.success,
+            a.attack_type,
+            a.threat_level,
+            (SELECT id FROM attempt_strings WHERE value = a.country),
+            a.city,
+            a.latitude,
+            a.longitude,
+            (SELECT id FROM attempt_strings WHERE value = a.client_type),
+            (SELECT id FROM attempt_strings WHERE value = a.reason),
+            (SELECT id FROM attempt_strings WHERE value = a.user_agent),
+            compact_metadata(a.metadata)
+        FROM login_attempts a
+        ORDER BY a.id
+    ''')
+    cursor.execute("DROP TABLE login_attempts")
+    cursor.execute("ALTER TABLE login_attempts_compact RENAME TO login_attempts")
+    
+    # Индексы прежних версий удалены вместе с таблицей - пересоздаём на attempt_ts
+    cursor.execute("CREATE INDEX idx_attempts_time ON login_attempts (attempt_ts)")
+    cursor.execute('''
+        CREATE INDEX idx_attempts_geo_time
+        ON login_attempts (attempt_ts)
+        WHERE latitude IS NOT NULL AND longitude IS NOT NULL
+    ''')
+    for column in INDEXED_FILTERS:
+        column = "country_id" if column == "country" else column
+        cursor.execute(f'''
+            CREATE INDEX idx_attempts_{column}_time
+            ON login_attempts ({column}, attempt_ts)
+        ''')
+    cursor.execute("ANALYZE")
+
+def _migration_6_cardinality_sketches(cursor):
+    """Сохранённые HyperLogLog-скетчи уникальных пользователей и IP"""
+    # span - окно (all / hour / day), slot - номер слота окна (epoch),
+    # last_id - последняя попытка, учтённая в скетче на момент сохранения
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS cardinality_sketches (
+            dimension TEXT NOT NULL,
+            span TEXT NOT NULL,
+            slot INTEGER NOT NULL,
+            precision INTEGER NOT NULL,
+            registers BLOB NOT NULL,
+            last_id INTEGER NOT NULL,
+            PRIMARY KEY (dimension, span, slot)
+        ) WITHOUT ROWID
+    ''')
+
+def _migration_7_geo_cache(cursor):
+    """Кэш геолокации IP между перезапусками"""
+    # resolved = 0 - отрицательный результат (провайдер адрес не определил),
+    # expires_at - Unix-время окончания TTL записи
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS geo_cache (
+            ip_address TEXT PRIMARY KEY,
+            resolved INTEGER NOT NULL,
+            country TEXT,
+            city TEXT,
+            latitude REAL,
+            longitude REAL,
+            expires_at REAL NOT NULL
+        ) WITHOUT ROWID
+    ''')
+
+# Миграции схемы: (версия, описание, функция). Применяются по порядку,
+# текущая версия хранится в PRAGMA user_version. Новые шаги - только в конец.
+MIGRATIONS = (
+    (1, "базовая схема", _migration_1_base_schema),
+    (2, "индексы горячих запросов", _migration_2_hot_path_indexes),
+    (3, "агрегаты для графиков", _migration_3_rollups),
+    (4, "индексы фильтров попыток", _migration_4_filter_indexes),
+    (5, "компактное хранение попыток", _migration_5_compact_attempts),
+    (6, "скетчи уникальных значений", _migration_6_cardinality_sketches),
+    (7, "кэш геолокации", _migration_7_geo_cache),
+)
+
+# После этих миграций файл БД перепаковывается (VACUUM), чтобы вернуть место.
+# Заодно включается auto_vacuum=INCREMENTAL для старых баз.
+VACUUM_AFTER_MIGRATIONS = frozenset({5})
+
+# Поля, по которым можно фильтровать ленту попыток и карту атак
+ATTEMPT_FILTERS = ("username", "ip_address", "success", "attack_type", "threat_level", "country")
+
+# Поля попытки в ответах API (порядок как в исходной таблице login_attempts)
+ATTEMPT_COLUMNS = (
+    "id", "username", "ip_address", "country", "city", "latitude", "longitude",
+    "attack_type", "threat_level", "client_type", "success", "reason",
+    "attempt_time", "user_agent", "metadata",
+)
+
+# Поля карты атак
+GEO_COLUMNS = (
+    "id", "username", "ip_address", "country", "city", "latitude", "longitude",
+    "client_type", "success", "reason", "attack_type", "threat_level", "attempt_time",
+)
+
+# Чтение попытки в прежнем виде: строки из словаря attempt_strings
+ATTEMPT_SELECT = '''
+    SELECT
+        a.id, a.username, a.ip_address, country.value AS country, a.city,
+        a.latitude, a.longitude, a.attack_type, a.threat_level,
+        client_type.value AS client_type, a.success, reason.value AS reason,
+        a.attempt_ts, user_agent.value AS user_agent, a.metadata
+    FROM login_attempts a
+    LEFT JOIN attempt_strings country ON country.id = a.country_id
+    LEFT JOIN attempt_strings client_type ON client_type.id = a.client_type_id
+    LEFT JOIN attempt_strings reason ON reason.id = a.reason_id
+    LEFT JOIN attempt_strings user_agent ON user_agent.id = a.user_agent_id
+'''
+
+# Поля попытки в архиве: attempt_ts хранится рядом с attempt_time - ключ
+# сортировки, однозначный и в час перевода часов
+ARCHIVE_COLUMNS = ATTEMPT_COLUMNS + ("attempt_ts",)
+
+class AttemptPage(list):
+    """Страница попыток; last_key - ключ (attempt_ts, id) последней строки
+    для курсора следующей страницы (None - страница пуста)"""
+    last_key = None
+
+def _attempt_from_row(row, columns=ATTEMPT_COLUMNS):
+    """Строка ATTEMPT_SELECT -> словарь попытки в формате API"""
+    attempt = dict(row)
+    attempt["attempt_time"] = from_epoch_us(attempt["attempt_ts"])
+    return {column: attempt[column] for column in columns}
+
+def _matches(attempt, before, filters, geo_only=False):
+    """Проверка архивной попытки теми же условиями, что и SQL-фильтр"""
+    key = attempt_key(attempt)
+    if geo_only and (attempt.get("latitude") is None or attempt.get("longitude") is None):
+        return False
+    if before is not None and key >= tuple(before):
+        return False
+    for name, value in filters.items():
+        if value is None:
+            continue
+        if name == "start":
+            if key[0] < to_epoch_us(value):
+                return False
+        elif name == "end":
+            if key[0] >= to_epoch_us(value):
+                return False
+        elif name == "success":
+            if bool(attempt.get("success")) != bool(value):
+                return False
+        elif attempt.get(name) != value:
+            return False
+    return True
+
 class LoginDatabase:
-    """База данных для хранения попыток входа"""
+    """База данных для хранения попыток входа.
+
+    Конструктор только читает настройки; соединения, миграции и заполнение
+    счётчиков из БД - в open() (сервер вызывает его при старте, так что
+    импорт модуля, в том числе процессами пула scrypt, ничего не открывает).
+    """
     
-    def __init__(self, db_path=None):
+    def __init__(self, db_path=None, readers=None, archive_dir=None):
         self.db_path = db_path or os.environ.get("CYBER_VIS_DB_PATH") or "login_attempts.db"
-        self.init_database()
+        self.journal_mode = os.environ.get("CYBER_VIS_DB_JOURNAL_MODE", "WAL")
+        self.synchronous = os.environ.get("CYBER_VIS_DB_SYNCHRONOUS", "NORMAL")
+        self.cache_kb = env_int("CYBER_VIS_DB_CACHE_KB", 16384)
+        self.busy_timeout_ms = env_int("CYBER_VIS_DB_BUSY_TIMEOUT_MS", 5000)
+        self.reader_count = max(1, readers or env_int("CYBER_VIS_DB_READERS", 4))
+        # In-memory база не разделяется между соединениями - читаем через писателя
+        self._shared = self.db_path == ":memory:"
+        
+        # Архив старых попыток (см. retention.py) - по умолчанию рядом с файлом БД
+        archive_dir = archive_dir or os.environ.get("CYBER_VIS_ARCHIVE_DIR")
+        if not archive_dir and not self._shared:
+            archive_dir = os.path.join(os.path.dirname(os.path.abspath(self.db_path)), "archive")
+        self.archive = AttemptArchive(archive_dir) if archive_dir else None
+        # Сколько дней хранятся минутные агрегаты (старше удаляет retention.py, 0 - всегда)
+        self.minute_rollup_days = env_int("CYBER_VIS_ROLLUP_MINUTE_DAYS", 7)
+        
+        # Одно соединение-писатель (SQLite всё равно сериализует запись)
+        # и пул соединений-читателей: в WAL читатели не ждут писателя.
+        self._write_lock = threading.RLock()
+        # ID строк attempt_strings: LRU, ключи (user agent и т.п.) задаёт клиент
+        self._string_ids = OrderedDict()
+        self.string_cache_size = env_int("CYBER_VIS_STRING_CACHE", 10000)
+        self.user_agent_max = env_int("CYBER_VIS_USER_AGENT_MAX", 256)
+        # ID строк, выданные писателю во время prune_strings (None - очистка не идёт)
+        self._strings_in_use = None
+        self._writer = None
+        # Счётчики для get_stats: при старте - из сохранённых скетчей и агрегатов,
+        # дальше - в памяти. Точность HLL задаётся допустимой ошибкой (в процентах)
+        self.stats = StatsEngine(precision=precision_for_error(
+            env_float("CYBER_VIS_UNIQUE_ERROR_PCT", 1.625) / 100
+        ))
+        # Скользящие окна попыток для правил (rules.py) и классификации:
+        # попытки учитывает движок правил, счётчики новых правил заполняются из БД
+        self.counters = FailureCounters(
+            bucket_seconds=env_int("CYBER_VIS_FAILURE_BUCKET_S", 10),
+            max_keys=env_int("CYBER_VIS_FAILURE_MAX_IPS", 100000),
+            loader=self.get_recent_attempt_keys,
+        )
+        self.failures = self.counters.pin(("ip", "failures"), env_int("CYBER_VIS_FAILURE_WINDOW_MIN", 60))
+        # Топ источников неудачных попыток (фиксированный объём памяти)
+        self.heavy_hitters = HeavyHitters(
+            width=env_int("CYBER_VIS_TOP_SKETCH_WIDTH", 2048),
+            capacity=env_int("CYBER_VIS_TOP_CANDIDATES", 100),
+        )
+        # Активные блокировки IP: проверка при логине без SQL
+        self.blocks = BlockRegistry()
+        self._readers = queue.LifoQueue()
+
+    @property
+    def is_open(self) -> bool:
+        return self._writer is not None
+
+    def open(self):
+        """Открыть соединения, применить миграции и заполнить счётчики из БД"""
+        with self._write_lock:
+            if self.is_open:
+                return
+            self._writer = self._connect()
+            self.init_database()
+            self.stats.seed(self._writer, self.archive)
+            self.heavy_hitters.seed(self._writer, max_rows=env_int("CYBER_VIS_TOP_SEED_ROWS", 50000))
+            cursor = self._writer.cursor()
+            cursor.row_factory = sqlite3.Row
+            cursor.execute('SELECT * FROM ip_blocks')
+            self.blocks.load(cursor.fetchall())
+        if not self._shared:
+            for _ in range(self.reader_count):
+                self._readers.put(self._connect(readonly=True))
+        self.counters.seed()
+        
+    def _connect(self, readonly=False):
+        """Открыть соединение и применить pragma-настройки"""
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=self.busy_timeout_ms / 1000,
+            check_same_thread=False,
+            isolation_level="DEFERRED",
+        )
+        cursor = conn.cursor()
+        if not readonly:
+            # Действует только для новой (пустой) БД: освобождённые при архивации
+            # страницы возвращаются порциями через PRAGMA incremental_vacuum
+            cursor.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        if not readonly and not self._shared:
+            cursor.execute(f"PRAGMA journal_mode={self.journal_mode}")
+        cursor.execute(f"PRAGMA synchronous={self.synchronous}")
+        cursor.execute(f"PRAGMA cache_size=-{self.cache_kb}")
+        cursor.execute(f"PRAGMA busy_timeout={self.busy_timeout_ms}")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        if readonly:
+            cursor.execute("PRAGMA query_only=1")
+        cursor.close()
+        return conn
+    
+    @contextmanager
+    def _write(self):
+        """Соединение-писатель: commit при выходе, rollback при ошибке"""
+        with self._write_lock:
+            try:
+                yield self._writer
+                self._writer.commit()
+            except BaseException:
+                self._writer.rollback()
+                raise
+    
+    @contextmanager
+    def _read(self, row_factory=None):
+        """Соединение-читатель из пула"""
+        if self._shared:
+            with self._write_lock:
+                self._writer.row_factory = row_factory
+                try:
+                    yield self._writer
+                finally:
+                    self._writer.row_factory = None
+            return
+        
+        conn = self._readers.get()
+        conn.row_factory = row_factory
+        try:
+            yield conn
+        finally:
+            # Завершаем неявную read-транзакцию, чтобы не удерживать снимок WAL
+            if conn.in_transaction:
+                conn.rollback()
+            conn.row_factory = None
+            self._readers.put(conn)
+    
+    def close(self):
+        """Закрыть все соединения пула"""
+        while True:
+            try:
+                self._readers.get_nowait().close()
+            except queue.Empty:
+                break
+        with self._write_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
         
     def init_database(self):
-        """Инициализация таблицы попыток входа"""
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS login_attempts (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    username TEXT NOT NULL,
-                    ip_address TEXT,
-                    country TEXT,
-                    city TEXT,
-                    latitude REAL,
-                    longitude REAL,
-                    attack_type TEXT,
-                    threat_level TEXT,
-                    client_type TEXT,
-                    success BOOLEAN NOT NULL,
-                    reason TEXT,
-                    attempt_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    user_agent TEXT,
-                    metadata TEXT
-                )
-            ''')
-            conn.commit()
-            
-            # Add missing columns for older local SQLite databases.
-            for column_definition in (
-                "country TEXT",
-                "city TEXT",
-                "latitude REAL",
-                "longitude REAL",
-                "attack_type TEXT",
-                "threat_level TEXT",
-            ):
+        """Применить недостающие миграции схемы (по PRAGMA user_version)"""
+        with self._write_lock:
+            conn = self._writer
+            current = conn.execute("PRAGMA user_version").fetchone()[0]
+            # Перепаковывать есть что, только если таблица попыток уже была
+            # (база до миграций - user_version 0, но не пустая)
+            had_attempts = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'login_attempts'"
+            ).fetchone() is not None
+            vacuum = False
+            for version, description, migrate in MIGRATIONS:
+                if version <= current:
+                    continue
+                conn.execute("BEGIN IMMEDIATE")
                 try:
-                    cursor.execute(f"ALTER TABLE login_attempts ADD COLUMN {column_definition}")
-                except sqlite3.OperationalError:
-                    pass
-            conn.commit()
-            
-            # Таблица заблокированных IP адресов
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS ip_blocks (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    ip_address TEXT UNIQUE NOT NULL,
-                    reason TEXT,
-                    blocked_until TIMESTAMP,
-                    is_permanent BOOLEAN DEFAULT 0,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            conn.commit()
-    
-    def add_attempt(
-        self,
-        username,
-        ip_address,
-        client_type,
-        success,
-        reason="",
-        user_agent="",
-        metadata=None,
-        country=None,
-        city=None,
-        latitude=None,
-        longitude=None,
-        attack_type="login_attempt",
-        threat_level="low",
-    ):
+                    migrate(conn.cursor())
+                    conn.execute(f"PRAGMA user_version = {version}")
+                    conn.commit()
+                except BaseException:
+                    conn.rollback()
+                    raise
+                log_event(logger, logging.INFO, "migration_applied", version=version, description=description)
+                vacuum = vacuum or (version in VACUUM_AFTER_MIGRATIONS and had_attempts)
+            # Базы, обновлённые без VACUUM, остались без auto_vacuum=INCREMENTAL
+            if had_attempts and conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 0:
+                vacuum = True
+            if vacuum:
+                conn.execute("VACUUM")
+                log_event(logger, logging.INFO, "database_vacuumed", path=self.db_path)
+    
+    _INSERT_ATTEMPT_SQL = '''
+        INSERT INTO login_attempts 
+        (attempt_ts, username, ip_address, success, attack_type, threat_level,
+         country_id, city, latitude, longitude, client_type_id, reason_id, user_agent_id, metadata)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    '''
+    
+    def _string_id(self, cursor, value, pending):
+        """ID строки из словаря attempt_strings (с кэшем в памяти; под _write_lock)"""
+        if value is None:
+            return None
+        string_id = self._string_ids.get(value)
+        if string_id is not None:
+            self._string_ids.move_to_end(value)
+        else:
+            string_id = pending.get(value)
+        if string_id is None:
+            cursor.execute('INSERT OR IGNORE INTO attempt_strings (value) VALUES (?)', (value,))
+            cursor.execute('SELECT id FROM attempt_strings WHERE value = ?', (value,))
+            string_id = cursor.fetchone()[0]
+            # В общий кэш - только после commit, иначе после rollback ID будет недействителен
+            pending[value] = string_id
+        if self._strings_in_use is not None:
+            self._strings_in_use.add(string_id)
+        return string_id
+
+    def _remember_strings(self, pending):
+        """Добавить ID строк после commit; давно не встречавшиеся вытесняются"""
+        self._string_ids.update(pending)
+        while len(self._string_ids) > self.string_cache_size:
+            self._string_ids.popitem(last=False)
+    
+    def _attempt_row(self, cursor, attempt, pending):
+        """Собрать кортеж параметров для INSERT попытки входа"""
+        return (
+            to_epoch_us(attempt.attempt_time),
+            attempt.username,
+            attempt.ip_address,
+            int(bool(attempt.success)),  # Явно конвертируем bool в int для SQLite
+            attempt.attack_type,
+            attempt.threat_level,
+            self._string_id(cursor, attempt.country, pending),
+            attempt.city,
+            attempt.latitude,
+            attempt.longitude,
+            self._string_id(cursor, attempt.client_type, pending),
+            self._string_id(cursor, attempt.reason, pending),
+            self._string_id(cursor, normalize_user_agent(attempt.user_agent, self.user_agent_max), pending),
+            compact_metadata(attempt.metadata),
+        )
+    
+    _UPSERT_ROLLUP_SQL = '''
+        INSERT INTO attempt_rollups
+        (resolution, bucket, success, attack_type, threat_level, country, attempts)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (resolution, bucket, success, attack_type, threat_level, country)
+        DO UPDATE SET attempts = attempts + excluded.attempts
+    '''
+    
+    @staticmethod
+    def _rollup_rows(attempts):
+        """Свернуть пачку попыток в приращения attempt_rollups"""
+        counts = Counter()
+        for attempt in attempts:
+            timestamp = int(attempt.attempt_time.timestamp())
+            key = (
+                int(bool(attempt.success)),
+                attempt.attack_type or '',
+                attempt.threat_level or '',
+                attempt.country or '',
+            )
+            for resolution in ROLLUP_RESOLUTIONS:
+                counts[(resolution, timestamp // resolution * resolution, *key)] += 1
+        return [(*key, count) for key, count in counts.items()]
+    
+    def add_attempt(self, username, ip_address, client_type, success, **fields):
         """Добавить попытку входа"""
-        with sqlite3.connect(self.db_path) as conn:
+        return self.add_attempts([AttemptRecord(username, ip_address, client_type, success, **fields)])[0]
+    
+    def add_attempts(self, attempts: list) -> list:
+        """Добавить пачку попыток (AttemptRecord или dict с теми же полями) одной
+        транзакцией. Записям проставляется id; возвращает ID в том же порядке"""
+        if not attempts:
+            return []
+        # Явно передаём текущее время вместо DEFAULT; исторические попытки
+        # (с attempt_time) попадают в свои корзины агрегатов
+        now = datetime.now()
+        normalized = []
+        for attempt in attempts:
+            if not isinstance(attempt, AttemptRecord):
+                attempt = AttemptRecord(**attempt)
+            if attempt.attempt_time is None:
+                attempt.set_time(now)
+            normalized.append(attempt)
+        rollups = self._rollup_rows(normalized)
+        
+        pending = {}
+        # Счётчики обновляются под той же блокировкой: сохранённый last_id
+        # скетчей не опережает реально учтённые попытки
+        with self._write_lock:
+            with self._write() as conn:
+                cursor = conn.cursor()
+                rows = [self._attempt_row(cursor, attempt, pending) for attempt in normalized]
+                cursor.executemany(self._INSERT_ATTEMPT_SQL, rows)
+                # Писатель один и держит блокировку, AUTOINCREMENT выдаёт ID подряд
+                last_id = cursor.execute("SELECT last_insert_rowid()").fetchone()[0]
+                cursor.executemany(self._UPSERT_ROLLUP_SQL, rollups)
+            self._remember_strings(pending)
+            self.stats.record_many(normalized, last_id=last_id)
+        first_id = last_id - len(rows) + 1
+        for attempt_id, attempt in enumerate(normalized, first_id):
+            attempt.set_id(attempt_id)
+            # Окна ошибок (self.counters) пополняет движок правил при оценке попытки
+            if not attempt.success:
+                self.heavy_hitters.record(
+                    attempt.ip_address, attempt.username, attempt.country, attempt.attempt_time.timestamp()
+                )
+        return list(range(first_id, last_id + 1))
+    
+    def update_attempts_geo(self, attempt_ids: list, geo: dict) -> list:
+        """Дописать геолокацию попыткам, записанным без неё (см. enrich.py).
+
+        Обновляются только строки без страны; их приращения в attempt_rollups
+        переносятся из корзин без страны в корзины найденной. Возвращает ID
+        обновлённых попыток.
+        """
+        country = geo.get("country")
+        if not attempt_ids or not country:
+            return []
+        pending = {}
+        with self._write_lock:
+            with self._write() as conn:
+                cursor = conn.cursor()
+                placeholders = ", ".join("?" * len(attempt_ids))
+                cursor.execute(f'''
+                    SELECT id, attempt_ts, success, attack_type, threat_level
+                    FROM login_attempts
+                    WHERE id IN ({placeholders}) AND country_id IS NULL
+                ''', list(attempt_ids))
+                rows = cursor.fetchall()
+                if not rows:
+                    return []
+                country_id = self._string_id(cursor, country, pending)
+                cursor.executemany('''
+                    UPDATE login_attempts
+                    SET country_id = ?, city = ?, latitude = ?, longitude = ?
+                    WHERE id = ?
+                ''', [
+                    (country_id, geo.get("city"), geo.get("latitude"), geo.get("longitude"), row[0])
+                    for row in rows
+                ])
+                moves = Counter()
+                for _, attempt_ts, success, attack_type, threat_level in rows:
+                    timestamp = attempt_ts // 1_000_000
+                    for resolution in ROLLUP_RESOLUTIONS:
+                        key = (resolution, timestamp // resolution * resolution,
+                               success, attack_type or '', threat_level or '')
+                        moves[(*key, '')] -= 1
+                        moves[(*key, country)] += 1
+                cursor.executemany(self._UPSERT_ROLLUP_SQL, [(*key, count) for key, count in moves.items()])
+            self._remember_strings(pending)
+        for _, attempt_ts, success, _, _ in rows:
+            if not success:
+                self.heavy_hitters.record(None, None, country, attempt_ts / 1_000_000)
+        return [row[0] for row in rows]
+    
+    def get_recent_attempts(self, limit=100, include_archive=False, before=None, **filters):
+        """Получить последние попытки входа (AttemptPage).
+
+        before - ключ (attempt_ts, id) последней строки предыдущей страницы
+        (last_key), filters - поля из ATTEMPT_FILTERS (плюс start/end по времени).
+        """
+        return self._find_attempts(ATTEMPT_COLUMNS, limit, include_archive, before, filters)
+
+    @staticmethod
+    def _time_conditions(start, end, conditions, params):
+        if start is not None:
+            conditions.append("a.attempt_ts >= ?")
+            params.append(to_epoch_us(start))
+        if end is not None:
+            conditions.append("a.attempt_ts < ?")
+            params.append(to_epoch_us(end))
+
+    def _find_attempts(self, columns, limit, include_archive, before, filters, geo_only=False):
+        """Страница попыток от новых к старым по ключу (attempt_ts, id)"""
+        conditions = []
+        params = []
+        if geo_only:
+            conditions.append("a.latitude IS NOT NULL AND a.longitude IS NOT NULL")
+        for name, value in filters.items():
+            if value is None or name in ("start", "end"):
+                continue
+            if name == "country":
+                conditions.append("a.country_id = (SELECT id FROM attempt_strings WHERE value = ?)")
+                params.append(value)
+            elif name in ATTEMPT_FILTERS:
+                conditions.append(f"a.{name} = ?")
+                params.append(int(value) if name == "success" else value)
+            else:
+                raise ValueError(f"Неизвестный фильтр: {name}")
+        self._time_conditions(filters.get("start"), filters.get("end"), conditions, params)
+        if before is not None:
+            conditions.append("(a.attempt_ts, a.id) < (?, ?)")
+            params.extend((int(before[0]), int(before[1])))
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        
+        with self._read(sqlite3.Row) as conn:
             cursor = conn.cursor()
-            # Явно передаём текущее время вместо DEFAULT CURRENT_TIMESTAMP
-            current_time = datetime.now().isoformat()
-            cursor.execute('''
-                INSERT INTO login_attempts 
-                (username, ip_address, country, city, latitude, longitude, attack_type, threat_level,
-                 client_type, success, reason, user_agent, metadata, attempt_time)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                username,
-                ip_address,
-                country,
-                city,
-                latitude,
-                longitude,
-                attack_type,
-                threat_level,
-                client_type,
-                int(success),  # Явно конвертируем bool в int для SQLite
-                reason,
-                user_agent,
-                json.dumps(metadata) if metadata else None,
-                current_time
-            ))
-            conn.commit()
-            return cursor.lastrowid
-    
-    def get_recent_attempts(self, limit=100):
-        """Получить последние попытки входа"""
-        with sqlite3.connect(self.db_path) as conn:
-            conn.row_factory = sqlite3.Row
+            cursor.execute(f'''
+                {ATTEMPT_SELECT}
+                {where}
+                ORDER BY a.attempt_ts DESC, a.id DESC 
+                LIMIT ?
+            ''', (*params, limit))
+            rows = cursor.fetchall()
+        attempts = AttemptPage(_attempt_from_row(row, columns) for row in rows)
+        if rows:
+            attempts.last_key = (rows[-1]["attempt_ts"], rows[-1]["id"])
+        if include_archive and len(attempts) < limit:
+            archived = self._archived(
+                limit - len(attempts),
+                lambda attempt: _matches(attempt, before, filters, geo_only),
+                start=filters.get("start"),
+                end=filters.get("end"),
+                last_day=from_epoch_us(before[0])[:10] if before is not None else None,
+            )
+            attempts.extend({column: attempt.get(column) for column in columns} for attempt in archived)
+            if archived:
+                attempts.last_key = attempt_key(archived[-1])
+        return attempts
+
+    def get_attempts_chunk(self, start=None, end=None, after=None, chunk_size=1000):
+        """Порция попыток по возрастанию (attempt_ts, id) для потоковой выгрузки (AttemptPage).
+
+        after - ключ last_key предыдущей порции: каждая порция - поиск по
+        индексу idx_attempts_time без OFFSET.
+        """
+        conditions = []
+        params = []
+        self._time_conditions(start, end, conditions, params)
+        if after is not None:
+            conditions.append("(a.attempt_ts, a.id) > (?, ?)")
+            params.extend((int(after[0]), int(after[1])))
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        with self._read(sqlite3.Row) as conn:
             cursor = conn.cursor()
-            cursor.execute('''
-                SELECT * FROM login_attempts 
-                ORDER BY attempt_time DESC 
+            cursor.execute(f'''
+                {ATTEMPT_SELECT}
+                {where}
+                ORDER BY a.attempt_ts, a.id
                 LIMIT ?
-            ''', (limit,))
-            return [dict(row) for row in cursor.fetchall()]
+            ''', (*params, chunk_size))
+            rows = cursor.fetchall()
+        chunk = AttemptPage(_attempt_from_row(row) for row in rows)
+        if rows:
+            chunk.last_key = (rows[-1]["attempt_ts"], rows[-1]["id"])
+        return chunk
+
+    def get_chart_totals(self):
+        """Получить общее количество успешных и неудачных попыток"""
+        stats = self.stats.snapshot()
+        return stats['successful'], stats['failed']
+
+    def get_top_attackers(self, dimension="ip", window="1h", limit=10):
+        """Самые активные источники неудачных попыток (оценка по скетчам)"""
+        return self.heavy_hitters.top(dimension, window, limit)
+
+    def get_timeseries(self, start, end, resolution=3600, split="success"):
+        """Ряд попыток за [start, end) с шагом resolution секунд.
+
+        Читает только attempt_rollups (самый крупный уровень, кратный шагу),
+        сырые строки login_attempts не трогает. Шаг в сутки и больше
+        отсчитывается от локальной полуночи (в дни перевода часов сутки
+        длятся 23 или 25 часов). Шаг меньше часа - только в пределах
+        minute_rollup_days: более старые минутные агрегаты удалены.
+        """
+        if split not in TIMESERIES_SPLITS:
+            raise ValueError(f"Неизвестный разрез: {split}")
+        levels = [level for level in ROLLUP_RESOLUTIONS if resolution % level == 0]
+        if not levels:
+            raise ValueError(f"Шаг должен быть кратен {ROLLUP_RESOLUTIONS[0]} секундам")
+        level = max(levels)
+        if level < ROLLUP_RESOLUTIONS[-1] and self.minute_rollup_days > 0:
+            kept_since = datetime.now() - timedelta(days=self.minute_rollup_days)
+            if start.timestamp() < kept_since.timestamp():
+                raise ValueError(
+                    f"Поминутные агрегаты хранятся {self.minute_rollup_days} дн.: "
+                    f"для более ранних периодов шаг не меньше часа"
+                )
+        end_ts = int(end.timestamp())
+        if resolution % 86400 == 0:
+            day = datetime.combine(start.date(), datetime.min.time())
+            points = []
+            while day.timestamp() < end_ts:
+                points.append(int(day.timestamp()))
+                day += timedelta(days=resolution // 86400)
+        else:
+            start_ts = int(start.timestamp()) // resolution * resolution
+            points = list(range(start_ts, end_ts, resolution))
+        if not points:
+            return []
+        
+        # Корзины уровня суммируются в точки ряда: равные шаги - в SQL,
+        # календарные сутки - по границам points
+        step = level if resolution % 86400 == 0 else resolution
+        with self._read() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'''
+                SELECT bucket / ? * ? AS point, {split}, SUM(attempts)
+                FROM attempt_rollups
+                WHERE resolution = ? AND bucket >= ? AND bucket < ?
+                GROUP BY point, {split}
+            ''', (step, step, level, points[0], end_ts))
+            rows = cursor.fetchall()
+        
+        values = {}
+        for bucket, key, count in rows:
+            # Нулевые корзины остаются после переноса в найденную страну (enrich.py)
+            if not count:
+                continue
+            if split == "success":
+                key = "successful" if key else "failed"
+            key = key or "unknown"
+            point = values.setdefault(points[bisect_right(points, bucket) - 1], {})
+            point[key] = point.get(key, 0) + count
+        
+        # Пустые интервалы тоже возвращаем, чтобы график был непрерывным
+        return [
+            {
+                "time": datetime.fromtimestamp(point).isoformat(),
+                "values": values.get(point, {}),
+            }
+            for point in points
+        ]
 
-    def get_geo_attempts(self, limit=200):
+    def get_geo_attempts(self, limit=200, include_archive=False, before=None, **filters):
         """Return recent attempts that have coordinates for the attack map."""
-        with sqlite3.connect(self.db_path) as conn:
-            conn.row_factory = sqlite3.Row
+        return self._find_attempts(
+            GEO_COLUMNS, limit, include_archive, before, filters, geo_only=True
+        )
+    
+    def _archived(self, limit, predicate=None, start=None, end=None, last_day=None):
+        """Самые новые архивные попытки (дополнение к живой таблице).
+
+        start / end / last_day отсекают дни архива, которые не нужно читать
+        """
+        if limit <= 0 or self.archive is None:
+            return []
+        result = []
+        for attempt in self.archive.iter_attempts(start, end, newest_first=True, last_day=last_day):
+            if predicate is None or predicate(attempt):
+                result.append(attempt)
+                if len(result) >= limit:
+                    break
+        return result
+    
+    def get_archived_attempts(self, start=None, end=None, limit=None):
+        """Попытки из архива за [start, end), от новых к старым"""
+        if self.archive is None:
+            return []
+        result = []
+        for attempt in self.archive.iter_attempts(start, end, newest_first=True):
+            result.append(attempt)
+            if limit and len(result) >= limit:
+                break
+        return result
+    
+    def archive_chunk(self, cutoff, chunk_size=5000, vacuum_pages=1000) -> int:
+        """Перенести в архив до chunk_size попыток старше cutoff.
+
+        Запись блокирует писателя только на время DELETE одной порции,
+        поэтому очередь попыток не простаивает. Возвращает число строк.
+        """
+        if self.archive is None:
+            return 0
+        with self._read(sqlite3.Row) as conn:
             cursor = conn.cursor()
-            cursor.execute('''
-                SELECT
-                    id, username, ip_address, country, city, latitude, longitude,
-                    client_type, success, reason, attack_type, threat_level, attempt_time
-                FROM login_attempts
-                WHERE latitude IS NOT NULL AND longitude IS NOT NULL
-                ORDER BY attempt_time DESC
+            cursor.execute(f'''
+                {ATTEMPT_SELECT}
+                WHERE a.attempt_ts < ?
+                ORDER BY a.attempt_ts
                 LIMIT ?
-            ''', (limit,))
-            return [dict(row) for row in cursor.fetchall()]
+            ''', (to_epoch_us(cutoff), chunk_size))
+            attempts = [_attempt_from_row(row, ARCHIVE_COLUMNS) for row in cursor.fetchall()]
+        if not attempts:
+            return 0
+        
+        # Сначала архив на диск (fsync), только потом удаление из таблицы
+        self.archive.append(attempts)
+        ids = [(attempt["id"],) for attempt in attempts]
+        with self._write() as conn:
+            conn.executemany('DELETE FROM login_attempts WHERE id = ?', ids)
+        
+        with self._write_lock:
+            if self._writer.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+                self._writer.execute(f"PRAGMA incremental_vacuum({int(vacuum_pages)})").fetchall()
+        return len(attempts)
+    
+    def prune_rollups(self, resolution, cutoff, chunk_buckets=1000) -> int:
+        """Удалить агрегаты уровня resolution старше cutoff - не больше
+        chunk_buckets корзин за вызов. Возвращает число удалённых строк"""
+        with self._write() as conn:
+            cursor = conn.execute('''
+                DELETE FROM attempt_rollups
+                WHERE resolution = ? AND bucket IN (
+                    SELECT DISTINCT bucket FROM attempt_rollups
+                    WHERE resolution = ? AND bucket < ?
+                    ORDER BY bucket
+                    LIMIT ?
+                )
+            ''', (resolution, resolution, int(cutoff.timestamp()), chunk_buckets))
+            return cursor.rowcount
+    
+    def prune_strings(self, chunk_size=1000) -> int:
+        """Удалить строки attempt_strings, на которые не ссылается ни одна
+        попытка (остаются после архивации). Возвращает число удалённых строк.
+
+        Ссылки собирает читатель, не блокируя запись; ID, выданные писателю
+        за это время, не удаляются.
+        """
+        with self._write_lock:
+            self._strings_in_use = set()
+        try:
+            with self._read() as conn:
+                referenced = {row[0] for row in conn.execute('''
+                    SELECT country_id FROM login_attempts
+                    UNION SELECT client_type_id FROM login_attempts
+                    UNION SELECT reason_id FROM login_attempts
+                    UNION SELECT user_agent_id FROM login_attempts
+                ''')}
+                unused = [string_id for (string_id,) in conn.execute('SELECT id FROM attempt_strings')
+                          if string_id not in referenced]
+            removed = 0
+            for start in range(0, len(unused), chunk_size):
+                with self._write_lock:
+                    ids = [string_id for string_id in unused[start:start + chunk_size]
+                           if string_id not in self._strings_in_use]
+                    with self._write() as conn:
+                        conn.executemany('DELETE FROM attempt_strings WHERE id = ?', [(i,) for i in ids])
+                    # Кэш писателя не должен выдавать удалённые ID
+                    gone = set(ids)
+                    for value in [value for value, string_id in self._string_ids.items() if string_id in gone]:
+                        del self._string_ids[value]
+                removed += len(ids)
+            return removed
+        finally:
+            with self._write_lock:
+                self._strings_in_use = None
+    
+    def get_stats(self, exact=False):
+        """Получить статистику (из инкрементальных счётчиков, без запросов к БД).
+
+        Уникальные пользователи и IP - оценки HyperLogLog с относительной
+        ошибкой unique_error; exact=True - точный подсчёт по таблице для сверки.
+        """
+        if exact:
+            return self.get_stats_exact()
+        return self.stats.snapshot()
+    
+    def save_stats_sketches(self) -> int:
+        """Сохранить скетчи уникальных в cardinality_sketches. Возвращает число слотов"""
+        with self._write_lock:
+            rows, last_id = self.stats.sketch_rows()
+            with self._write() as conn:
+                conn.execute('DELETE FROM cardinality_sketches')
+                conn.executemany('''
+                    INSERT INTO cardinality_sketches
+                    (dimension, span, slot, precision, registers, last_id)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                ''', [(*row, last_id) for row in rows])
+        return len(rows)
     
-    # В методе get_stats класса LoginDatabase:
-    def get_stats(self):
-        """Получить статистику"""
-        with sqlite3.connect(self.db_path) as conn:
+    def get_stats_exact(self):
+        """Посчитать статистику полным проходом по таблице и архиву (для сверки).
+
+        Итоги и уникальные за всё время учитывают архив (см. retention.py),
+        окна по времени - только живую таблицу: в архиве попытки старше них.
+        """
+        archived = self.archive.totals() if self.archive is not None else None
+        with self._read() as conn:
             cursor = conn.cursor()
             
             # Основная статистика
@@ -160,14 +1080,31 @@ class LoginDatabase:
                     COUNT(DISTINCT ip_address) as unique_ips
                 FROM login_attempts
             ''')
-            row = cursor.fetchone()
+            row = list(cursor.fetchone())
+            row = [value or 0 for value in row]
+            archived_total = archived["total"] if archived else 0
+            if archived_total:
+                # Уникальные - объединение множеств живой таблицы и архива
+                users = set(archived["usernames"])
+                users.update(value for (value,) in cursor.execute('SELECT DISTINCT username FROM login_attempts'))
+                ips = set(archived["ips"])
+                ips.update(value for (value,) in cursor.execute(
+                    'SELECT DISTINCT ip_address FROM login_attempts WHERE ip_address IS NOT NULL'
+                ))
+                row[0] += archived_total
+                row[1] += archived["successful"]
+                row[2] += archived_total - archived["successful"]
+                row[3], row[4] = len(users), len(ips)
+            
+            # Окна читаются диапазоном по индексу idx_attempts_time
+            now = datetime.now()
             
             # Попытки за последний час (динамически считаем каждый раз)
             cursor.execute('''
                 SELECT COUNT(*) as last_hour
                 FROM login_attempts 
-                WHERE datetime(attempt_time) > datetime('now', '-1 hour')
-            ''')
+                WHERE attempt_ts > ?
+            ''', (to_epoch_us(now - timedelta(minutes=60)),))
             last_hour_row = cursor.fetchone()
             last_hour = last_hour_row[0] if last_hour_row else 0
             
@@ -175,8 +1112,8 @@ class LoginDatabase:
             cursor.execute('''
                 SELECT COUNT(*) as last_30_min
                 FROM login_attempts 
-                WHERE datetime(attempt_time) > datetime('now', '-30 minutes')
-            ''')
+                WHERE attempt_ts > ?
+            ''', (to_epoch_us(now - timedelta(minutes=30)),))
             last_30_min_row = cursor.fetchone()
             last_30_min = last_30_min_row[0] if last_30_min_row else 0
             
@@ -184,125 +1121,175 @@ class LoginDatabase:
             cursor.execute('''
                 SELECT COUNT(*) as last_10_min
                 FROM login_attempts 
-                WHERE datetime(attempt_time) > datetime('now', '-10 minutes')
-            ''')
+                WHERE attempt_ts > ?
+            ''', (to_epoch_us(now - timedelta(minutes=10)),))
             last_10_min_row = cursor.fetchone()
             last_10_min = last_10_min_row[0] if last_10_min_row else 0
             
+            # Уникальные за час и сутки - для сверки с оценками HyperLogLog
+            unique_windows = {}
+            for name, span in (("last_hour", timedelta(hours=1)), ("last_day", timedelta(days=1))):
+                cursor.execute('''
+                    SELECT COUNT(DISTINCT username), COUNT(DISTINCT ip_address)
+                    FROM login_attempts
+                    WHERE attempt_ts > ?
+                ''', (to_epoch_us(now - span),))
+                users, ips = cursor.fetchone()
+                unique_windows[f'unique_users_{name}'] = users
+                unique_windows[f'unique_ips_{name}'] = ips
+            
             return {
-                'total_attempts': row[0] or 0,
-                'successful': row[1] or 0,
-                'failed': row[2] or 0,
-                'unique_users': row[3] or 0,
-                'unique_ips': row[4] or 0,
+                'total_attempts': row[0],
+                'successful': row[1],
+                'failed': row[2],
+                'unique_users': row[3],
+                'unique_ips': row[4],
+                'archived_attempts': archived_total,
                 'last_hour': last_hour,
                 'last_30_min': last_30_min,
                 'last_10_min': last_10_min,
+                **unique_windows,
+                'unique_error': 0.0,
                 'timestamp': datetime.now().isoformat()  # Добавляем метку времени
             }
     
+    def get_recent_attempt_keys(self, minutes: int) -> list:
+        """Попытки последних N минут для счётчиков правил: (ip, логин, успех, время в секундах)"""
+        since_us = to_epoch_us(datetime.now() - timedelta(minutes=minutes))
+        with self._read() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT ip_address, username, success, attempt_ts FROM login_attempts
+                WHERE attempt_ts >= ?
+                ORDER BY attempt_ts
+            ''', (since_us,))
+            return [(ip, username, bool(success), ts / 1_000_000) for ip, username, success, ts in cursor]
+
     def get_failed_attempts_count(self, ip_address: str, minutes: int = 15) -> int:
-        """Получить количество неудачных попыток за последние N минут"""
-        with sqlite3.connect(self.db_path) as conn:
+        """Получить количество неудачных попыток за последние N минут (из общих
+        с правилами счётчиков: попытки, ещё не оценённые правилами, не учтены)"""
+        if minutes <= self.failures.max_window:
+            return self.failures.count(ip_address, minutes)
+        
+        # Окно длиннее отслеживаемого в памяти - считаем по БД
+        with self._read() as conn:
             cursor = conn.cursor()
             time_threshold = datetime.now() - timedelta(minutes=minutes)
-            time_threshold_iso = time_threshold.isoformat()
-            
-            # DEBUG: Проверяем, что вообще есть в БД
-            cursor.execute('SELECT COUNT(*) FROM login_attempts WHERE ip_address = ?', (ip_address,))
-            total_for_ip = cursor.fetchone()[0]
-            
-            # DEBUG: Проверяем значения success
-            cursor.execute('SELECT success, COUNT(*) FROM login_attempts WHERE ip_address = ? GROUP BY success', (ip_address,))
-            success_stats = cursor.fetchall()
-            
-            print(f"   🔍 DEBUG get_failed_attempts: IP={ip_address}, всего попыток={total_for_ip}, статусы={success_stats}")
-            
-            # Исправленный запрос - используем >= для строкового сравнения ISO format
             cursor.execute('''
                 SELECT COUNT(*) FROM login_attempts 
-                WHERE ip_address = ? AND success = 0 AND attempt_time >= ?
-            ''', (ip_address, time_threshold_iso))
+                WHERE ip_address = ? AND success = 0 AND attempt_ts >= ?
+            ''', (ip_address, to_epoch_us(time_threshold)))
             result = cursor.fetchone()
-            count = result[0] if result else 0
-            
-            print(f"   🔍 DEBUG: Неудачных за {minutes} мин: {count}, порог времени: {time_threshold_iso}")
-            
-            return count
+            return result[0] if result else 0
     
     def add_ip_block(self, ip_address: str, reason: str, duration_minutes: int = None, is_permanent: bool = False) -> bool:
-        """Добавить IP в блокировку"""
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            
-            blocked_until = None
-            if not is_permanent and duration_minutes:
-                blocked_until = (datetime.now() + timedelta(minutes=duration_minutes)).isoformat()
-            
-            try:
+        """Добавить IP или подсеть (CIDR, например 203.0.113.0/24) в блокировку"""
+        try:
+            ip_address = block_key(ip_address)
+        except ValueError as e:
+            log_event(logger, logging.WARNING, "block_invalid", ip=ip_address, error=e)
+            return False
+        blocked_until = None
+        if not is_permanent and duration_minutes:
+            blocked_until = (datetime.now() + timedelta(minutes=duration_minutes)).isoformat()
+        # Как DEFAULT CURRENT_TIMESTAMP (UTC), но значение нужно и реестру
+        created_at = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+        
+        try:
+            with self._write() as conn:
+                cursor = conn.cursor()
                 cursor.execute('''
                     INSERT OR REPLACE INTO ip_blocks 
-                    (ip_address, reason, blocked_until, is_permanent)
-                    VALUES (?, ?, ?, ?)
-                ''', (ip_address, reason, blocked_until, is_permanent))
-                conn.commit()
-                return True
-            except Exception as e:
-                print(f"❌ Ошибка добавления блокировки IP: {e}")
-                return False
+                    (ip_address, reason, blocked_until, is_permanent, created_at)
+                    VALUES (?, ?, ?, ?, ?)
+                ''', (ip_address, reason, blocked_until, is_permanent, created_at))
+                block_id = cursor.lastrowid
+        except Exception as e:
+            log_event(logger, logging.ERROR, "block_add_failed", ip=ip_address, error=e)
+            return False
+        
+        self.blocks.add({
+            "id": block_id,
+            "ip_address": ip_address,
+            "reason": reason,
+            "blocked_until": blocked_until,
+            "is_permanent": int(bool(is_permanent)),
+            "created_at": created_at,
+        })
+        return True
     
-    def is_ip_blocked(self, ip_address: str) -> tuple:
-        """Проверить, заблокирован ли IP. Возвращает (is_blocked, reason)"""
-        with sqlite3.connect(self.db_path) as conn:
+    def load_geo_cache(self, limit: int) -> list:
+        """Неистёкшие записи кэша геолокации (не больше limit самых свежих), старые первыми"""
+        with self._read() as conn:
             cursor = conn.cursor()
             cursor.execute('''
-                SELECT reason, blocked_until, is_permanent FROM ip_blocks 
-                WHERE ip_address = ?
-            ''', (ip_address,))
-            result = cursor.fetchone()
-            
-            if not result:
-                return False, None
-            
-            reason, blocked_until, is_permanent = result
-            
-            # Если постоянная блокировка
-            if is_permanent:
-                return True, f"🚫 Постоянная блокировка: {reason}"
-            
-            # Если временная блокировка
-            if blocked_until:
-                blocked_until_dt = datetime.fromisoformat(blocked_until)
-                if datetime.now() < blocked_until_dt:
-                    remaining = blocked_until_dt - datetime.now()
-                    minutes = int(remaining.total_seconds() / 60)
-                    return True, f"⏱️ IP заблокирован на {minutes} мин: {reason}"
-                else:
-                    # Истекла временная блокировка, удаляем
-                    cursor.execute('DELETE FROM ip_blocks WHERE ip_address = ?', (ip_address,))
-                    conn.commit()
-                    return False, None
-            
-            return False, None
+                SELECT ip_address, resolved, country, city, latitude, longitude, expires_at
+                FROM geo_cache
+                WHERE expires_at > ?
+                ORDER BY expires_at DESC
+                LIMIT ?
+            ''', (datetime.now().timestamp(), limit))
+            rows = cursor.fetchall()
+        rows.reverse()
+        return rows
+    
+    def save_geo_cache(self, rows: list) -> int:
+        """Сохранить изменённые записи кэша геолокации и удалить истёкшие"""
+        with self._write() as conn:
+            conn.executemany('''
+                INSERT OR REPLACE INTO geo_cache
+                (ip_address, resolved, country, city, latitude, longitude, expires_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', rows)
+            conn.execute('DELETE FROM geo_cache WHERE expires_at <= ?', (datetime.now().timestamp(),))
+        return len(rows)
+    
+    def import_ip_blocks(self, blocks: list) -> int:
+        """Записать пачку блокировок одной транзакцией и перечитать реестр.
+
+        blocks - словари с ip_address (уже проверенным), reason,
+        blocked_until, is_permanent; существующие записи заменяются.
+        """
+        if not blocks:
+            return 0
+        created_at = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+        with self._write() as conn:
+            conn.executemany('''
+                INSERT OR REPLACE INTO ip_blocks
+                (ip_address, reason, blocked_until, is_permanent, created_at)
+                VALUES (?, ?, ?, ?, ?)
+            ''', [
+                (block["ip_address"], block["reason"], block["blocked_until"],
+                 int(bool(block["is_permanent"])), created_at)
+                for block in blocks
+            ])
+            cursor = conn.cursor()
+            cursor.row_factory = sqlite3.Row
+            rows = cursor.execute('SELECT * FROM ip_blocks').fetchall()
+        # Реестр подменяется целиком уже после commit
+        self.blocks.load(rows)
+        return len(blocks)
+    
+    def is_ip_blocked(self, ip_address: str) -> tuple:
+        """Проверить, заблокирован ли IP (сам или его подсеть). Возвращает (is_blocked, reason)"""
+        return self.blocks.check(ip_address)
     
     def get_blocked_ips(self) -> list:
         """Получить список всех заблокированных IP"""
-        with sqlite3.connect(self.db_path) as conn:
-            conn.row_factory = sqlite3.Row
-            cursor = conn.cursor()
-            
-            # Сначала удаляем истёкшие временные блокировки
-            cursor.execute('''
-                DELETE FROM ip_blocks 
-                WHERE is_permanent = 0 AND blocked_until < ?
-            ''', (datetime.now().isoformat(),))
-            conn.commit()
-            
-            # Получаем оставшиеся блокировки
-            cursor.execute('''
-                SELECT * FROM ip_blocks ORDER BY created_at DESC
-            ''')
-            return [dict(row) for row in cursor.fetchall()]
+        return self.blocks.snapshot()
+    
+    def sweep_expired_blocks(self, now=None, batch_size=500) -> int:
+        """Удалить истёкшие временные блокировки из реестра и из ip_blocks"""
+        expired = self.blocks.pop_expired(now)
+        for start in range(0, len(expired), batch_size):
+            batch = expired[start:start + batch_size]
+            with self._write() as conn:
+                # Условие на blocked_until: не удаляем блокировку, продлённую за это время
+                conn.executemany('''
+                    DELETE FROM ip_blocks
+                    WHERE ip_address = ? AND is_permanent = 0 AND blocked_until = ?
+                ''', [(ip_address, until.isoformat()) for ip_address, until in batch])
+        return len(expired)
 
-# Глобальный экземпляр БД
+# Глобальный экземпляр БД (соединения - db.open() при старте сервера)
 db = LoginDatabase()
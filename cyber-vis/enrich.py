@@ -0,0 +1,125 @@
+"""
+Фоновое определение геолокации для уже записанных попыток
+"""
+import asyncio
+import logging
+
+from database import env_int
+from geo import GeoUnavailable
+from logs import log_event
+
+logger = logging.getLogger("cyber_vis.enrich")
+
+
+class GeoEnricher:
+    """Пул обработчиков, дописывающих геолокацию попыткам после ответа на логин.
+
+    Попытки одного IP, ожидающие в очереди, объединяются: один вызов
+    резолвера и одно обновление БД на все их ID. Одновременно к резолверу
+    обращаются не больше workers обработчиков; очередь ограничена
+    max_queue адресами - при переполнении попытка остаётся без геолокации.
+    Если провайдер недоступен (GeoUnavailable), адрес повторяется через
+    retry_delay секунд, не больше max_retries раз; страна при этом не пишется.
+    """
+
+    def __init__(self, database, resolve, on_enriched=None, workers=None, max_queue=None,
+                 retry_delay=None, max_retries=None):
+        self.db = database
+        self.resolve = resolve
+        self.on_enriched = on_enriched
+        self.workers = workers or env_int("CYBER_VIS_GEO_WORKERS", 4)
+        self.max_queue = max_queue or env_int("CYBER_VIS_GEO_QUEUE", 10000)
+        self.retry_delay = env_int("CYBER_VIS_GEO_RETRY_S", 30) if retry_delay is None else retry_delay
+        self.max_retries = env_int("CYBER_VIS_GEO_RETRIES", 3) if max_retries is None else max_retries
+        self._queue = None
+        self._pending = {}
+        self._retries = {}
+        self._retry_tasks = set()
+        self._tasks = []
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    async def start(self):
+        if self.running:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._pending = {}
+        self._retries = {}
+        self._tasks = [
+            asyncio.create_task(self._worker(), name=f"geo-enricher-{index}")
+            for index in range(self.workers)
+        ]
+
+    async def stop(self, timeout=5.0):
+        """Дождаться очереди (не дольше timeout секунд) и остановить обработчики"""
+        if not self.running:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            log_event(logger, logging.WARNING, "geo_enrich_unfinished", ips=len(self._pending))
+        tasks = self._tasks + list(self._retry_tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks = []
+        self._retry_tasks.clear()
+
+    def submit(self, attempt_id: int, ip_address: str) -> bool:
+        """Поставить попытку в очередь. False - обработчики не запущены или очередь полна"""
+        return self._enqueue(ip_address, [attempt_id])
+
+    def _enqueue(self, ip_address, attempt_ids) -> bool:
+        if not self.running:
+            return False
+        waiting = self._pending.get(ip_address)
+        if waiting is not None:
+            waiting.extend(attempt_ids)
+            return True
+        try:
+            self._queue.put_nowait(ip_address)
+        except asyncio.QueueFull:
+            return False
+        self._pending[ip_address] = list(attempt_ids)
+        return True
+
+    def _defer(self, ip_address, attempt_ids, error):
+        """Провайдер недоступен: повторить адрес позже или оставить попытки без геолокации"""
+        tries = self._retries.pop(ip_address, 0) + 1
+        if tries > self.max_retries:
+            log_event(logger, logging.WARNING, "geo_enrich_gave_up",
+                      ip=ip_address, attempts=len(attempt_ids), error=error)
+            return
+        task = asyncio.create_task(self._retry_later(ip_address, attempt_ids, tries))
+        self._retry_tasks.add(task)
+        task.add_done_callback(self._retry_tasks.discard)
+
+    async def _retry_later(self, ip_address, attempt_ids, tries):
+        await asyncio.sleep(self.retry_delay)
+        if self._enqueue(ip_address, attempt_ids):
+            self._retries[ip_address] = max(tries, self._retries.get(ip_address, 0))
+
+    async def _worker(self):
+        while True:
+            ip_address = await self._queue.get()
+            try:
+                try:
+                    geo = await asyncio.to_thread(self.resolve, ip_address)
+                except GeoUnavailable as e:
+                    self._defer(ip_address, self._pending.pop(ip_address, []), e)
+                    continue
+                self._retries.pop(ip_address, None)
+                # ID забираем после ответа резолвера: попытки, пришедшие за
+                # время запроса, обновятся вместе с остальными
+                attempt_ids = self._pending.pop(ip_address, [])
+                updated = await asyncio.to_thread(self.db.update_attempts_geo, attempt_ids, geo)
+                if updated and self.on_enriched is not None:
+                    await self.on_enriched(updated, geo)
+            except Exception as e:
+                self._pending.pop(ip_address, None)
+                self._retries.pop(ip_address, None)
+                log_event(logger, logging.WARNING, "geo_enrich_failed", ip=ip_address, error=e)
+            finally:
+                self._queue.task_done()
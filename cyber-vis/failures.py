@@ -0,0 +1,170 @@
+"""
+Скользящие окна неудачных попыток по IP (и другим измерениям правил)
+"""
+import threading
+import time
+from collections import OrderedDict, deque
+
+from blocks import subnet_of
+
+
+class FailureCounter:
+    """Неудачные попытки по IP в корзинах по bucket_seconds секунд.
+
+    Для каждого IP хранится очередь непустых корзин не старше max_window
+    минут, поэтому ответ на "сколько ошибок за N минут" - сумма не более
+    max_window * 60 / bucket_seconds чисел, без SQL. Число отслеживаемых
+    IP ограничено max_ips: дольше всех молчавшие вытесняются (LRU).
+    """
+
+    def __init__(self, max_window=60, bucket_seconds=10, max_ips=100000):
+        self.max_window = max_window
+        self.bucket_seconds = bucket_seconds
+        self.max_ips = max_ips
+        self._lock = threading.Lock()
+        self._ips = OrderedDict()
+
+    def _bucket(self, ts):
+        return int(ts // self.bucket_seconds)
+
+    def _trim(self, buckets, now_bucket):
+        oldest = now_bucket - self.max_window * 60 // self.bucket_seconds
+        while buckets and buckets[0][0] <= oldest:
+            buckets.popleft()
+
+    def record(self, ip_address, ts=None):
+        """Учесть неудачную попытку с IP"""
+        if ip_address is None:
+            return
+        bucket = self._bucket(time.time() if ts is None else ts)
+        with self._lock:
+            buckets = self._ips.get(ip_address)
+            if buckets is None:
+                buckets = self._ips[ip_address] = deque()
+                if len(self._ips) > self.max_ips:
+                    self._ips.popitem(last=False)
+            else:
+                self._ips.move_to_end(ip_address)
+            if not buckets or buckets[-1][0] < bucket:
+                buckets.append([bucket, 1])
+            else:
+                # Та же корзина или попытка "из прошлого" (восстановление, пакетная загрузка)
+                index = len(buckets)
+                while index > 0 and buckets[index - 1][0] > bucket:
+                    index -= 1
+                if index > 0 and buckets[index - 1][0] == bucket:
+                    buckets[index - 1][1] += 1
+                else:
+                    buckets.insert(index, [bucket, 1])
+            self._trim(buckets, self._bucket(time.time()))
+
+    def count(self, ip_address, minutes, now=None) -> int:
+        """Неудачные попытки с IP за последние N минут (N <= max_window)"""
+        now_bucket = self._bucket(time.time() if now is None else now)
+        oldest = now_bucket - minutes * 60 // self.bucket_seconds
+        with self._lock:
+            buckets = self._ips.get(ip_address)
+            if not buckets:
+                return 0
+            self._trim(buckets, now_bucket)
+            if not buckets:
+                del self._ips[ip_address]
+                return 0
+            return sum(count for bucket, count in buckets if bucket > oldest)
+
+    def __len__(self):
+        return len(self._ips)
+
+
+
+def attempt_keys(ip_address, username) -> dict:
+    """Ключи попытки по измерениям счётчиков: ip, username, subnet"""
+    return {
+        "ip": ip_address,
+        "username": username,
+        "subnet": subnet_of(ip_address) if ip_address else None,
+    }
+
+
+class FailureCounters:
+    """Общие счётчики по парам (измерение, что считаем: failures/attempts).
+
+    Один набор на БД и движок правил: движок учитывает каждую попытку
+    (record), БД отвечает по счётчику ("ip", "failures") на
+    get_failed_attempts_count. Закреплённые (pin) счётчики не удаляются при
+    смене правил. После seed() новые и расширенные счётчики сразу
+    заполняются попытками из loader(minutes) - строки (ip, логин, успех,
+    время в секундах).
+    """
+
+    def __init__(self, bucket_seconds=10, max_keys=100000, loader=None):
+        self.bucket_seconds = bucket_seconds
+        self.max_keys = max_keys
+        self.loader = loader
+        self.seeded = False
+        self._counters = {}
+        self._pinned = set()
+
+    def pin(self, key, window) -> FailureCounter:
+        """Счётчик, который нужен не только правилам (окно не меньше window минут)"""
+        counter = self.ensure({key: window})[key]
+        self._pinned.add(key)
+        return counter
+
+    def ensure(self, windows: dict) -> dict:
+        """Счётчики для {(измерение, что считаем): окно в минутах}; лишние, кроме
+        закреплённых, удаляются, накопленные окна сохраняются.
+
+        После seed() новые счётчики заполняются из loader до того, как их
+        увидит record(), а расширенные - только попытками старше прежнего
+        окна: ни одна попытка не учитывается дважды. Вызывать вне цикла
+        событий - loader читает БД.
+        """
+        counters = {key: self._counters[key] for key in self._pinned}
+        # Счётчик -> сколько минут у него уже накоплено (0 - новый)
+        backfill = {}
+        for key, window in windows.items():
+            counter = self._counters.get(key)
+            if counter is None:
+                counter = FailureCounter(max_window=window, bucket_seconds=self.bucket_seconds,
+                                         max_ips=self.max_keys)
+                backfill[key] = (counter, 0)
+            elif window > counter.max_window:
+                backfill[key] = (counter, counter.max_window)
+                counter.max_window = window
+            counters[key] = counter
+        if backfill and self.seeded and self.loader is not None:
+            self._fill(backfill, self.loader(max(counter.max_window for counter, _ in backfill.values())))
+        self._counters = counters
+        return {key: counters[key] for key in windows}
+
+    def record(self, keys: dict, success, ts=None):
+        """Учесть попытку с ключами attempt_keys()"""
+        for (dimension, count), counter in self._counters.items():
+            key = keys[dimension]
+            if key is not None and (count == "attempts" or not success):
+                counter.record(key, ts)
+
+    def _fill(self, targets, rows):
+        """Дописать строки loader в счётчики {ключ: (счётчик, уже накоплено минут)}"""
+        now = time.time()
+        for ip_address, username, success, ts in rows:
+            keys = attempt_keys(ip_address, username)
+            age = now - ts
+            for (dimension, count), (counter, covered) in targets.items():
+                key = keys[dimension]
+                if key is None or (count == "failures" and success):
+                    continue
+                if age <= counter.max_window * 60 and (not covered or age > covered * 60):
+                    counter.record(key, ts)
+
+    def seed(self):
+        """Заполнить все счётчики из loader; дальше новые заполняются сами"""
+        if self.loader is not None and self._counters:
+            self._fill({key: (counter, 0) for key, counter in self._counters.items()},
+                       self.loader(self.max_window))
+        self.seeded = True
+
+    @property
+    def max_window(self) -> int:
+        return max((counter.max_window for counter in self._counters.values()), default=0)
@@ -0,0 +1,356 @@
+"""
+Геолокация IP: ограниченный кэш LRU + TTL и сменные резолверы
+"""
+import ipaddress
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+import requests
+import requests.adapters
+
+from geodb import GeoRangeDB
+from logs import log_event
+
+logger = logging.getLogger("cyber_vis.geo")
+
+# Поля геолокации (как в login_attempts)
+GEO_FIELDS = ("country", "city", "latitude", "longitude")
+
+
+def _to_float(value):
+    try:
+        if value is None or value == "":
+            return None
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class GeoUnavailable(Exception):
+    """Провайдер временно недоступен (circuit breaker, нет свободного слота,
+    сбой или таймаут) - в отличие от None ("адрес не найден") не кэшируется"""
+
+
+def is_local_ip(ip_address: str) -> bool:
+    try:
+        parsed_ip = ipaddress.ip_address(ip_address)
+        return parsed_ip.is_private or parsed_ip.is_loopback or parsed_ip.is_link_local
+    except ValueError:
+        return not ip_address or ip_address.lower() == "localhost"
+
+
+class _Flight:
+    """Запрос одного IP, к которому присоединяются одновременные вызовы"""
+
+    __slots__ = ("done", "geo", "error", "deadline")
+
+    def __init__(self, deadline):
+        self.done = threading.Event()
+        self.geo = None
+        self.error = None
+        self.deadline = deadline
+
+
+class GeoClient:
+    """HTTP-клиент ipwhois.app (бесплатно, без ключа) - резолвер ip -> dict | None;
+    если ответа провайдера нет, бросает GeoUnavailable.
+
+    - общий пул keep-alive соединений (до max_concurrency) вместо нового TLS на запрос;
+    - одновременные запросы одного IP объединяются (single-flight);
+    - не больше max_concurrency запросов к провайдеру одновременно, ждать
+      свободного места дольше timeout не будем;
+    - после failure_threshold ошибок подряд провайдер не опрашивается
+      cooldown секунд (circuit breaker), затем пропускается один пробный запрос.
+    """
+
+    URL = "https://ipwhois.app/json/{}"
+
+    def __init__(self, max_concurrency=8, timeout=2.0, failure_threshold=5, cooldown=30.0):
+        self.timeout = timeout
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=max_concurrency)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self._failures = 0
+        self._open_until = 0.0
+        self._probing = False
+        self.requests = 0
+        self.coalesced = 0
+        self.rejected = 0
+        self.saturated = 0
+        self.errors = 0
+
+    @property
+    def state(self) -> str:
+        if self._failures < self.failure_threshold:
+            return "closed"
+        return "open" if time.monotonic() < self._open_until else "half-open"
+
+    def _allow(self) -> bool:
+        """Можно ли сейчас обратиться к провайдеру (вызывается под _lock)"""
+        if self._failures < self.failure_threshold:
+            return True
+        if time.monotonic() < self._open_until or self._probing:
+            return False
+        self._probing = True
+        return True
+
+    def _record(self, ok):
+        with self._lock:
+            self._probing = False
+            if ok:
+                self._failures = 0
+                return
+            self.errors += 1
+            self._failures += 1
+            if self._failures >= self.failure_threshold:
+                self._open_until = time.monotonic() + self.cooldown
+
+    def __call__(self, ip_address: str):
+        with self._lock:
+            flight = self._inflight.get(ip_address)
+            if flight is None:
+                if not self._allow():
+                    self.rejected += 1
+                    raise GeoUnavailable("circuit breaker: провайдер временно не опрашивается")
+                flight = self._inflight[ip_address] = _Flight(
+                    # Ожидание слота + соединение + чтение ответа
+                    deadline=time.monotonic() + self.timeout * 3,
+                )
+                leader = True
+            else:
+                self.coalesced += 1
+                leader = False
+        if not leader:
+            if not flight.done.wait(max(0.0, flight.deadline - time.monotonic())):
+                raise GeoUnavailable("нет ответа на объединённый запрос")
+        else:
+            try:
+                flight.geo = self._fetch(ip_address)
+            except GeoUnavailable as e:
+                flight.error = e
+            finally:
+                with self._lock:
+                    self._inflight.pop(ip_address, None)
+                flight.done.set()
+        if flight.error is not None:
+            raise GeoUnavailable(str(flight.error))
+        return dict(flight.geo) if flight.geo is not None else None
+
+    def _fetch(self, ip_address):
+        if not self._slots.acquire(timeout=self.timeout):
+            with self._lock:
+                self.saturated += 1
+                self._probing = False
+            raise GeoUnavailable("все соединения с провайдером заняты")
+        try:
+            with self._lock:
+                self.requests += 1
+            try:
+                response = self.session.get(self.URL.format(ip_address), timeout=self.timeout)
+                data = response.json() if response.ok else None
+            except Exception as e:
+                self._record(ok=False)
+                log_event(logger, logging.WARNING, "geo_lookup_failed", ip=ip_address, error=e)
+                raise GeoUnavailable(str(e)) from e
+            # 429 и 5xx - сбой провайдера; прочие 4xx и success=false - адрес не найден
+            if not response.ok:
+                failed = response.status_code >= 500 or response.status_code == 429
+                self._record(ok=not failed)
+                if failed:
+                    raise GeoUnavailable(f"HTTP {response.status_code}")
+                return None
+            self._record(ok=True)
+            if data.get("success") is False:
+                return None
+            return {
+                "country": data.get("country"),
+                "city": data.get("city"),
+                "latitude": _to_float(data.get("latitude")),
+                "longitude": _to_float(data.get("longitude")),
+            }
+        finally:
+            self._slots.release()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "state": self.state,
+                "inflight": len(self._inflight),
+                "requests": self.requests,
+                "coalesced": self.coalesced,
+                "rejected": self.rejected,
+                "saturated": self.saturated,
+                "errors": self.errors,
+            }
+
+
+def resolve_nothing(ip_address: str):
+    return None
+
+
+def chain_resolvers(*resolvers):
+    """Резолвер, опрашивающий resolvers по очереди до первого найденного"""
+    def resolve(ip_address: str):
+        for resolver in resolvers:
+            geo = resolver(ip_address)
+            if geo is not None:
+                return geo
+        return None
+    return resolve
+
+
+# Режимы геолокации: online - ipwhois.app, offline - локальный файл geodb,
+# hybrid - сначала файл, для ненайденных адресов - ipwhois.app
+GEO_MODES = ("online", "offline", "hybrid")
+
+
+def build_resolver(mode="online", db_path=None, online=None):
+    """Резолвер для режима; без файла geodb offline ничего не находит, hybrid = online"""
+    if mode not in GEO_MODES:
+        raise ValueError(f"Режим геолокации должен быть одним из: {', '.join(GEO_MODES)}")
+    online = online or GeoClient()
+    if mode == "online":
+        return online
+    offline = None
+    if db_path:
+        try:
+            offline = GeoRangeDB(db_path)
+            log_event(logger, logging.INFO, "geodb_loaded", path=db_path, ranges=len(offline))
+        except (OSError, ValueError) as e:
+            log_event(logger, logging.WARNING, "geodb_unavailable", path=db_path, error=e)
+    else:
+        log_event(logger, logging.WARNING, "geodb_not_configured", env="CYBER_VIS_GEO_DB")
+    if mode == "offline":
+        return offline.lookup if offline else resolve_nothing
+    return chain_resolvers(offline.lookup, online) if offline else online
+
+
+class GeoCache:
+    """Кэш результатов резолвера: не больше max_entries адресов, вытесняется
+    давно не использованный.
+
+    Найденный адрес живёт positive_ttl секунд, ненайденный (None от резолвера) -
+    negative_ttl: повторный запрос к провайдеру будет, но не на каждый логин.
+    GeoUnavailable от резолвера не кэшируется и передаётся вызывающему.
+    Резолвер - любая функция ip -> dict | None, её можно подменить (stub).
+    Изменённые записи копятся для сохранения в БД (take_dirty / load).
+    """
+
+    def __init__(self, resolver, max_entries=50000, positive_ttl=86400, negative_ttl=300):
+        self.resolver = resolver
+        self.max_entries = max_entries
+        self.positive_ttl = positive_ttl
+        self.negative_ttl = negative_ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._dirty = set()
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+        self.unavailable = 0
+
+    def _lookup(self, ip_address, now, count_miss=True):
+        """(найдено, geo) из кэша; учитывает счётчики"""
+        with self._lock:
+            entry = self._entries.get(ip_address)
+            if entry is not None:
+                expires_at, geo = entry
+                if expires_at > now:
+                    self._entries.move_to_end(ip_address)
+                    if geo is None:
+                        self.negative_hits += 1
+                    else:
+                        self.hits += 1
+                    return True, geo
+                del self._entries[ip_address]
+                self.expired += 1
+            if count_miss:
+                self.misses += 1
+        return False, None
+
+    def _store(self, ip_address, geo, expires_at):
+        with self._lock:
+            self._entries[ip_address] = (expires_at, geo)
+            self._entries.move_to_end(ip_address)
+            self._dirty.add(ip_address)
+            while len(self._entries) > self.max_entries:
+                evicted, _ = self._entries.popitem(last=False)
+                self._dirty.discard(evicted)
+                self.evictions += 1
+
+    def get(self, ip_address: str):
+        """Геолокация адреса (копия dict) или None, если резолвер её не нашёл;
+        GeoUnavailable - провайдер недоступен, стоит спросить позже"""
+        now = time.time()
+        found, geo = self._lookup(ip_address, now)
+        if not found:
+            try:
+                geo = self.resolver(ip_address)
+            except GeoUnavailable:
+                with self._lock:
+                    self.unavailable += 1
+                raise
+            ttl = self.negative_ttl if geo is None else self.positive_ttl
+            self._store(ip_address, geo, now + ttl)
+        return dict(geo) if geo is not None else None
+
+    def peek(self, ip_address: str) -> tuple:
+        """(найдено, geo) только из кэша, без вызова резолвера"""
+        found, geo = self._lookup(ip_address, time.time(), count_miss=False)
+        return found, dict(geo) if geo is not None else None
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._dirty.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.negative_hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "negative_hits": self.negative_hits,
+                "misses": self.misses,
+                "expired": self.expired,
+                "evictions": self.evictions,
+                "unavailable": self.unavailable,
+                "hit_rate": round((self.hits + self.negative_hits) / lookups, 4) if lookups else 0.0,
+            }
+
+    def take_dirty(self) -> list:
+        """Записи, изменённые с прошлого вызова: (ip, resolved, country, city, lat, lon, expires_at)"""
+        with self._lock:
+            rows = []
+            for ip_address in self._dirty:
+                entry = self._entries.get(ip_address)
+                if entry is None:
+                    continue
+                expires_at, geo = entry
+                values = [geo.get(field) for field in GEO_FIELDS] if geo else [None] * len(GEO_FIELDS)
+                rows.append((ip_address, int(geo is not None), *values, expires_at))
+            self._dirty.clear()
+        return rows
+
+    def load(self, rows, now=None):
+        """Заполнить кэш сохранёнными записями (строки как у take_dirty)"""
+        now = time.time() if now is None else now
+        with self._lock:
+            for ip_address, resolved, *values, expires_at in rows:
+                if expires_at <= now:
+                    continue
+                geo = dict(zip(GEO_FIELDS, values)) if resolved else None
+                self._entries[ip_address] = (expires_at, geo)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
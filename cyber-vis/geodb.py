@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""
+Офлайн-база геолокации: диапазоны IP в отсортированном бинарном файле (mmap).
+Сборка из CSV: python3 geodb.py build ranges.csv geoip.bin
+
+CSV с заголовком: network (CIDR) или start_ip,end_ip, далее
+country,city,latitude,longitude (город и координаты могут быть пустыми).
+"""
+
+import csv
+import ipaddress
+import mmap
+import struct
+import sys
+
+MAGIC = b"CVGEO001"
+# Заголовок: magic, число записей IPv4, IPv6, число строк
+HEADER = struct.Struct(">8sIII")
+# Запись: начало и конец диапазона, индексы страны и города в таблице строк,
+# широта и долгота (NaN - нет координат)
+RECORD_V4 = struct.Struct(">IIIIff")
+RECORD_V6 = struct.Struct(">16s16sIIff")
+NO_STRING = 0xFFFFFFFF
+
+
+class GeoRangeDB:
+    """Поиск по файлу geodb: двоичный поиск по записям фиксированной длины.
+
+    Файл открывается через mmap и не читается в память целиком; экземпляр
+    - резолвер для GeoCache: lookup(ip) -> dict | None.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as file:
+            self._mm = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.v4_count, self.v6_count, string_count = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path}: не файл geodb")
+        self._v4_offset = HEADER.size
+        self._v6_offset = self._v4_offset + self.v4_count * RECORD_V4.size
+        strings_offset = self._v6_offset + self.v6_count * RECORD_V6.size
+        # Таблица строк: смещения (string_count + 1) и UTF-8 данные
+        offsets = struct.unpack_from(f">{string_count + 1}I", self._mm, strings_offset)
+        data_offset = strings_offset + 4 * (string_count + 1)
+        self._strings = [
+            self._mm[data_offset + offsets[i]:data_offset + offsets[i + 1]].decode("utf-8")
+            for i in range(string_count)
+        ]
+
+    def close(self):
+        self._mm.close()
+
+    def __len__(self):
+        return self.v4_count + self.v6_count
+
+    def _search(self, key, record, offset, count):
+        """Последняя запись с началом диапазона <= key (или None)"""
+        lo, hi = 0, count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if record.unpack_from(self._mm, offset + mid * record.size)[0] <= key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo == 0:
+            return None
+        found = record.unpack_from(self._mm, offset + (lo - 1) * record.size)
+        return found if key <= found[1] else None
+
+    def lookup(self, ip_address: str):
+        try:
+            ip = ipaddress.ip_address(ip_address)
+        except ValueError:
+            return None
+        if ip.version == 4:
+            found = self._search(int(ip), RECORD_V4, self._v4_offset, self.v4_count)
+        else:
+            found = self._search(ip.packed, RECORD_V6, self._v6_offset, self.v6_count)
+        if found is None:
+            return None
+        _, _, country, city, latitude, longitude = found
+        return {
+            "country": self._string(country),
+            "city": self._string(city),
+            "latitude": None if latitude != latitude else round(latitude, 4),
+            "longitude": None if longitude != longitude else round(longitude, 4),
+        }
+
+    __call__ = lookup
+
+    def _string(self, index):
+        return None if index == NO_STRING else self._strings[index]
+
+
+def _parse_range(row):
+    if row.get("network"):
+        network = ipaddress.ip_network(row["network"].strip(), strict=False)
+        return network.network_address, network.broadcast_address
+    start = ipaddress.ip_address(row["start_ip"].strip())
+    end = ipaddress.ip_address(row["end_ip"].strip())
+    if start.version != end.version or start > end:
+        raise ValueError("некорректный диапазон")
+    return start, end
+
+
+def _coordinate(value):
+    return float(value) if value not in (None, "") else float("nan")
+
+
+def build(csv_path, output_path) -> dict:
+    """Собрать файл geodb из CSV. Пересекающиеся диапазоны отбрасываются"""
+    strings = {}
+
+    def string_id(value):
+        if not value:
+            return NO_STRING
+        return strings.setdefault(value, len(strings))
+
+    ranges = {4: [], 6: []}
+    invalid = 0
+    with open(csv_path, newline="", encoding="utf-8-sig") as file:
+        for row in csv.DictReader(file):
+            try:
+                start, end = _parse_range(row)
+                values = (
+                    string_id(row.get("country")),
+                    string_id(row.get("city")),
+                    _coordinate(row.get("latitude")),
+                    _coordinate(row.get("longitude")),
+                )
+            except (KeyError, ValueError):
+                invalid += 1
+                continue
+            ranges[start.version].append((int(start), int(end), *values))
+
+    overlapping = 0
+    records = {}
+    for version, items in ranges.items():
+        items.sort()
+        records[version] = []
+        last_end = -1
+        for item in items:
+            if item[0] <= last_end:
+                overlapping += 1
+                continue
+            records[version].append(item)
+            last_end = item[1]
+
+    encoded = [value.encode("utf-8") for value in strings]
+    offsets = [0]
+    for value in encoded:
+        offsets.append(offsets[-1] + len(value))
+
+    with open(output_path, "wb") as out:
+        out.write(HEADER.pack(MAGIC, len(records[4]), len(records[6]), len(encoded)))
+        for start, end, *values in records[4]:
+            out.write(RECORD_V4.pack(start, end, *values))
+        for start, end, *values in records[6]:
+            out.write(RECORD_V6.pack(start.to_bytes(16, "big"), end.to_bytes(16, "big"), *values))
+        out.write(struct.pack(f">{len(offsets)}I", *offsets))
+        out.write(b"".join(encoded))
+
+    return {
+        "ipv4": len(records[4]),
+        "ipv6": len(records[6]),
+        "strings": len(encoded),
+        "invalid": invalid,
+        "overlapping": overlapping,
+    }
+
+
+def main(argv) -> int:
+    if len(argv) != 4 or argv[1] != "build":
+        print("Использование: python3 geodb.py build ranges.csv geoip.bin")
+        return 1
+    try:
+        result = build(argv[2], argv[3])
+    except OSError as e:
+        print(f"❌ Ошибка сборки базы геолокации: {e}")
+        return 1
+    print(
+        f"✅ {argv[3]}: IPv4 {result['ipv4']}, IPv6 {result['ipv6']}, "
+        f"строк {result['strings']}; пропущено: некорректных {result['invalid']}, "
+        f"пересекающихся {result['overlapping']}"
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
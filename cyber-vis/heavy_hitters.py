@@ -0,0 +1,217 @@
+"""
+Самые активные источники атак: Count-Min Sketch + Space-Saving
+"""
+import threading
+import time
+from array import array
+
+from blocks import subnet_of
+
+# Окна топа: имя -> длительность в секундах (None - за всё время)
+WINDOWS = {
+    "10m": 600,
+    "1h": 3600,
+    "24h": 86400,
+    "all": None,
+}
+
+# Измерения топа
+DIMENSIONS = ("ip", "username", "subnet", "country")
+
+# Под-окон в кольце каждого окна
+SLOTS = 6
+
+
+def sketch_indexes(key, width, depth):
+    """Позиции key в строках CMS: двойное хеширование по половинам 64-битного хеша"""
+    h = hash(key) & 0xFFFFFFFFFFFFFFFF
+    low, high = h & 0xFFFFFFFF, (h >> 32) | 1
+    return [(low + i * high) % width for i in range(depth)]
+
+
+class CountMinSketch:
+    """Оценка частот фиксированного размера (только завышает)"""
+
+    def __init__(self, width=2048, depth=4):
+        self.width = width
+        self.depth = depth
+        self.total = 0
+        self._rows = [array("q", bytes(8 * width)) for _ in range(depth)]
+
+    def indexes(self, key):
+        return sketch_indexes(key, self.width, self.depth)
+
+    def add(self, key, count=1, indexes=None) -> int:
+        """Учесть key, вернуть новую оценку его частоты"""
+        self.total += count
+        estimate = None
+        for row, index in zip(self._rows, indexes or self.indexes(key)):
+            row[index] += count
+            if estimate is None or row[index] < estimate:
+                estimate = row[index]
+        return estimate
+
+    def estimate(self, key) -> int:
+        return min(row[index] for row, index in zip(self._rows, self.indexes(key)))
+
+    def clear(self):
+        self.total = 0
+        for row in self._rows:
+            row[:] = array("q", bytes(8 * self.width))
+
+
+class SpaceSaving:
+    """Кандидаты в топ: не более capacity ключей с оценками из CMS"""
+
+    def __init__(self, capacity=100):
+        self.capacity = capacity
+        self.counts = {}
+        # Нижняя граница минимального счётчика (счётчики только растут)
+        self._floor = 0
+
+    def offer(self, key, estimate):
+        if key in self.counts or len(self.counts) < self.capacity:
+            self.counts[key] = estimate
+            return
+        if estimate <= self._floor:
+            return
+        victim = min(self.counts, key=self.counts.get)
+        self._floor = self.counts[victim]
+        if estimate > self._floor:
+            # Вытесняем минимальный счётчик
+            del self.counts[victim]
+            self.counts[key] = estimate
+
+    def clear(self):
+        self.counts.clear()
+        self._floor = 0
+
+
+class _Slot:
+    def __init__(self, width, depth, capacity):
+        self.epoch = None
+        self.sketch = CountMinSketch(width, depth)
+        self.candidates = SpaceSaving(capacity)
+
+    def reset(self, epoch):
+        self.epoch = epoch
+        self.sketch.clear()
+        self.candidates.clear()
+
+
+class WindowedTopK:
+    """Топ за скользящее окно: кольцо из slots под-окон (CMS + Space-Saving в каждом)"""
+
+    def __init__(self, window_seconds, slots=SLOTS, width=2048, depth=4, capacity=100):
+        self.window_seconds = window_seconds
+        self.slot_seconds = window_seconds / slots if window_seconds else None
+        self._slots = [_Slot(width, depth, capacity) for _ in range(slots if window_seconds else 1)]
+
+    def _epoch(self, ts):
+        return int(ts // self.slot_seconds) if self.slot_seconds else 0
+
+    def add(self, key, ts, indexes=None, count=1):
+        epoch = self._epoch(ts)
+        slot = self._slots[epoch % len(self._slots)]
+        if slot.epoch != epoch:
+            if slot.epoch is not None and slot.epoch > epoch:
+                return  # Попытка старше окна
+            slot.reset(epoch)
+        slot.candidates.offer(key, slot.sketch.add(key, count, indexes))
+
+    def top(self, limit, now):
+        current = self._epoch(now)
+        live = [
+            slot for slot in self._slots
+            if slot.epoch is not None and current - slot.epoch < len(self._slots)
+        ]
+        candidates = set()
+        for slot in live:
+            candidates.update(slot.candidates.counts)
+        total = sum(slot.sketch.total for slot in live)
+        scored = [
+            (sum(slot.sketch.estimate(key) for slot in live), key)
+            for key in candidates
+        ]
+        scored.sort(key=lambda item: (-item[0], str(item[1])))
+        return scored[:limit], total
+
+
+class HeavyHitters:
+    """Топ источников неудачных попыток по измерениям DIMENSIONS и окнам WINDOWS"""
+
+    def __init__(self, width=2048, depth=4, capacity=100):
+        self.width = width
+        self.depth = depth
+        self._lock = threading.Lock()
+        self._tops = {
+            (dimension, window): WindowedTopK(seconds, width=width, depth=depth, capacity=capacity)
+            for dimension in DIMENSIONS
+            for window, seconds in WINDOWS.items()
+        }
+
+    @property
+    def error_rate(self) -> float:
+        """Завышение оценки CMS не больше error_rate * total (с вероятностью 1 - e^-depth)"""
+        return 2.718281828 / self.width
+
+    def record(self, ip_address, username, country, ts=None, count=1):
+        """Учесть неудачную попытку (count одинаковых попыток)"""
+        ts = time.time() if ts is None else ts
+        keys = {
+            "ip": ip_address,
+            "username": username,
+            "subnet": subnet_of(ip_address),
+            "country": country,
+        }
+        # Все скетчи одного размера: индексы считаются один раз на ключ
+        indexes = {
+            dimension: sketch_indexes(key, self.width, self.depth)
+            for dimension, key in keys.items() if key is not None
+        }
+        with self._lock:
+            for (dimension, _), top in self._tops.items():
+                if dimension in indexes:
+                    top.add(keys[dimension], ts, indexes[dimension], count)
+
+    def top(self, dimension, window, limit=10, now=None) -> dict:
+        if dimension not in DIMENSIONS:
+            raise ValueError(f"dimension должен быть одним из: {', '.join(DIMENSIONS)}")
+        if window not in WINDOWS:
+            raise ValueError(f"window должен быть одним из: {', '.join(WINDOWS)}")
+        with self._lock:
+            scored, total = self._tops[(dimension, window)].top(limit, time.time() if now is None else now)
+        return {
+            "dimension": dimension,
+            "window": window,
+            "total": total,
+            "max_error": int(self.error_rate * total),
+            "items": [{"key": key, "count": count} for count, key in scored],
+        }
+
+    def seed(self, conn, window_seconds=None, max_rows=50000):
+        """Заполнить топ неудачными попытками последних суток из БД.
+
+        Попытки группируются в SQL по (IP, логин, страна, самое мелкое
+        под-окно) - повторы одного источника учитываются одним вызовом.
+        Берутся не больше max_rows самых свежих групп: после многомиллионного
+        дня старт не ждёт полного прохода, а топ за длинные окна до их
+        прокрутки занижен. max_rows = 0 - без ограничения.
+        """
+        window_seconds = window_seconds or max(s for s in WINDOWS.values() if s)
+        since_us = int((time.time() - window_seconds) * 1_000_000)
+        group_us = min(s for s in WINDOWS.values() if s) // SLOTS * 1_000_000
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT a.ip_address, a.username, country.value, MAX(a.attempt_ts) AS last_ts, COUNT(*)
+            FROM login_attempts a
+            LEFT JOIN attempt_strings country ON country.id = a.country_id
+            WHERE a.attempt_ts >= ? AND a.success = 0
+            GROUP BY a.attempt_ts / ?, a.ip_address, a.username, a.country_id
+            ORDER BY last_ts DESC
+            LIMIT ?
+        ''', (since_us, group_us, max_rows or -1))
+        rows = cursor.fetchall()
+        for ip_address, username, country, attempt_ts, count in reversed(rows):
+            self.record(ip_address, username, country, attempt_ts / 1_000_000, count)
+        return len(rows)
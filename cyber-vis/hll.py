@@ -0,0 +1,182 @@
+"""
+Оценка числа уникальных значений: HyperLogLog
+"""
+import hashlib
+import math
+import time
+
+# Вклад регистра со значением r в гармоническое среднее: 2^-r
+_INV_POW = [2.0 ** -rank for rank in range(65)]
+
+
+def hash64(value) -> int:
+    """Стабильный 64-битный хеш (hash() меняется между запусками, а скетчи сохраняются)"""
+    digest = hashlib.blake2b(str(value).encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big")
+
+
+def precision_for_error(error) -> int:
+    """Точность p (2^p регистров), при которой стандартная ошибка 1.04/sqrt(2^p) <= error"""
+    if not error > 0:
+        return 18  # ноль, отрицательная или nan - максимальная точность
+    return max(4, min(18, math.ceil(2 * math.log2(1.04 / error))))
+
+
+class HyperLogLog:
+    """Скетч кардинальности: 2^precision однобайтовых регистров, сливается через max"""
+
+    def __init__(self, precision=12, registers=None):
+        self.precision = precision
+        self.size = 1 << precision
+        self.registers = bytearray(registers) if registers is not None else bytearray(self.size)
+        if len(self.registers) != self.size:
+            raise ValueError("Размер регистров не соответствует точности")
+
+    @property
+    def error(self) -> float:
+        """Относительная стандартная ошибка оценки"""
+        return 1.04 / math.sqrt(self.size)
+
+    def add_hash(self, h):
+        index = h >> (64 - self.precision)
+        rest = h & ((1 << (64 - self.precision)) - 1)
+        rank = 64 - self.precision - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def add(self, value):
+        self.add_hash(hash64(value))
+
+    def merge(self, other):
+        """Объединить с другим скетчем той же точности (на месте)"""
+        if other.precision != self.precision:
+            raise ValueError("Нельзя объединить скетчи разной точности")
+        self.registers = bytearray(map(max, self.registers, other.registers))
+        return self
+
+    def count(self) -> int:
+        m = self.size
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(map(_INV_POW.__getitem__, self.registers))
+        if estimate <= 2.5 * m:
+            # Малые множества: линейный счёт по пустым регистрам
+            zeros = self.registers.count(0)
+            if zeros:
+                estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+    def is_empty(self) -> bool:
+        return not any(self.registers)
+
+
+class CardinalityTracker:
+    """Уникальные пользователи и IP: за всё время, последний час и последние сутки"""
+
+    DIMENSIONS = ("username", "ip")
+    # Окно: (длительность слота в секундах, число слотов); None - за всё время
+    WINDOWS = {
+        "all": (None, 1),
+        "hour": (300, 12),
+        "day": (3600, 24),
+    }
+
+    def __init__(self, precision=12):
+        self.precision = precision
+        self.reset()
+
+    def reset(self):
+        self._sketches = {
+            (dimension, window): {}
+            for dimension in self.DIMENSIONS
+            for window in self.WINDOWS
+        }
+        # Объединение закрытых слотов окна: (текущий epoch, скетч), пересчёт при смене слота
+        self._closed = {}
+
+    @property
+    def error(self) -> float:
+        return 1.04 / math.sqrt(1 << self.precision)
+
+    def _epoch(self, window, ts) -> int:
+        slot_seconds, _ = self.WINDOWS[window]
+        return int(ts // slot_seconds) if slot_seconds else 0
+
+    def _oldest(self, window, now) -> int:
+        _, slots = self.WINDOWS[window]
+        return self._epoch(window, now) - slots + 1
+
+    def _slot(self, dimension, window, epoch) -> HyperLogLog:
+        ring = self._sketches[(dimension, window)]
+        sketch = ring.get(epoch)
+        if sketch is None:
+            sketch = ring[epoch] = HyperLogLog(self.precision)
+        return sketch
+
+    def record(self, username, ip_address, ts=None, now=None):
+        """Учесть попытку; попытки старше окна в оконные скетчи не попадают"""
+        ts = time.time() if ts is None else ts
+        now = time.time() if now is None else now
+        values = {"username": username, "ip": ip_address}
+        for dimension, value in values.items():
+            if value is None:
+                continue
+            h = hash64(value)
+            for window in self.WINDOWS:
+                epoch = self._epoch(window, ts)
+                if epoch >= self._oldest(window, now):
+                    self._slot(dimension, window, epoch).add_hash(h)
+                    if epoch != self._epoch(window, now):
+                        self._closed.pop((dimension, window), None)
+
+    def record_all_time(self, username, ip_address):
+        """Учесть значения только в скетчах за всё время (первичное заполнение)"""
+        for dimension, value in (("username", username), ("ip", ip_address)):
+            if value is not None:
+                self._slot(dimension, "all", 0).add(value)
+
+    def prune(self, now=None):
+        """Удалить слоты, вышедшие из окон"""
+        now = time.time() if now is None else now
+        for (_, window), ring in self._sketches.items():
+            oldest = self._oldest(window, now)
+            for epoch in [epoch for epoch in ring if epoch < oldest]:
+                del ring[epoch]
+
+    def estimate(self, dimension, window, now=None) -> int:
+        now = time.time() if now is None else now
+        key = (dimension, window)
+        ring = self._sketches[key]
+        current = self._epoch(window, now)
+        cached = self._closed.get(key)
+        if cached is None or cached[0] != current:
+            oldest = self._oldest(window, now)
+            closed = HyperLogLog(self.precision)
+            for epoch, sketch in ring.items():
+                if oldest <= epoch < current:
+                    closed.merge(sketch)
+            cached = self._closed[key] = (current, closed)
+        merged = HyperLogLog(self.precision, cached[1].registers)
+        if current in ring:
+            merged.merge(ring[current])
+        return merged.count()
+
+    def rows(self, now=None):
+        """Непустые слоты для сохранения: (dimension, window, epoch, precision, registers)"""
+        self.prune(now)
+        return [
+            (dimension, window, epoch, self.precision, bytes(sketch.registers))
+            for (dimension, window), ring in self._sketches.items()
+            for epoch, sketch in ring.items()
+            if not sketch.is_empty()
+        ]
+
+    def load(self, rows, now=None) -> bool:
+        """Восстановить слоты из сохранённых строк. False - если точность не совпала"""
+        if any(row[3] != self.precision for row in rows):
+            return False
+        self._closed.clear()
+        for dimension, window, epoch, precision, registers in rows:
+            if (dimension, window) in self._sketches:
+                self._sketches[(dimension, window)][epoch] = HyperLogLog(precision, registers)
+        self.prune(now)
+        return True
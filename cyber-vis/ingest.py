@@ -0,0 +1,124 @@
+"""
+Очередь записи попыток входа с групповым коммитом
+"""
+import asyncio
+import logging
+
+from database import db, env_int
+from logs import log_event
+from records import AttemptRecord
+
+logger = logging.getLogger("cyber_vis.ingest")
+
+
+class AttemptWriter:
+    """Один писатель разбирает ограниченную очередь и пишет попытки пачками.
+
+    Пачка сбрасывается при достижении max_batch записей или через
+    max_delay секунд после первой записи - один executemany и один commit
+    (один fsync) на всю пачку вместо одного на каждую попытку.
+    """
+
+    def __init__(self, database, max_batch=None, max_delay=None, max_queue=None):
+        self.db = database
+        self.max_batch = max_batch or env_int("CYBER_VIS_INGEST_BATCH", 500)
+        self.max_delay = max_delay if max_delay is not None else (
+            env_int("CYBER_VIS_INGEST_DELAY_MS", 20) / 1000
+        )
+        self.max_queue = max_queue or env_int("CYBER_VIS_INGEST_QUEUE", 10000)
+        self._queue = None
+        self._task = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def start(self):
+        """Запустить фоновый писатель в текущем event loop"""
+        if self.running:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._task = asyncio.create_task(self._run(), name="attempt-writer")
+
+    async def stop(self):
+        """Дописать всё, что уже в очереди, и остановить писатель"""
+        if not self.running:
+            return
+        await self._queue.put(None)
+        await self._task
+        self._task = None
+
+    async def submit(self, record: AttemptRecord) -> asyncio.Future:
+        """Поставить попытку в очередь. Future получит ID после commit.
+
+        Если очередь заполнена, ждём места (backpressure на входящие логины).
+        """
+        if not self.running:
+            raise RuntimeError("AttemptWriter не запущен")
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((record, future))
+        return future
+
+    async def add_record(self, record: AttemptRecord) -> int:
+        """Записать попытку и дождаться её фиксации в БД (id проставится и в record)"""
+        if not self.running:
+            # Без запущенного писателя (скрипты, тесты) пишем напрямую
+            return (await asyncio.to_thread(self.db.add_attempts, [record]))[0]
+        return await (await self.submit(record))
+
+    async def _collect_batch(self, first):
+        batch = [first]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_delay
+        while len(batch) < self.max_batch:
+            try:
+                item = self._queue.get_nowait()
+            except asyncio.QueueEmpty:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+            batch.append(item)
+            if item is None:
+                break
+        return batch
+
+    async def _run(self):
+        stopping = False
+        while not stopping:
+            first = await self._queue.get()
+            if first is None:
+                # Стоп-маркер: дочитываем то, что успели положить до него
+                batch = []
+                while not self._queue.empty():
+                    batch.append(self._queue.get_nowait())
+                stopping = True
+            else:
+                batch = await self._collect_batch(first)
+            if batch and batch[-1] is None:
+                batch.pop()
+                stopping = True
+            items = [item for item in batch if item is not None]
+            if items:
+                await self._flush(items)
+
+    async def _flush(self, items):
+        attempts = [record for record, _ in items]
+        try:
+            ids = await asyncio.to_thread(self.db.add_attempts, attempts)
+        except Exception as e:
+            log_event(logger, logging.ERROR, "attempts_write_failed", attempts=len(items), error=e)
+            for _, future in items:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), attempt_id in zip(items, ids):
+            if not future.done():
+                future.set_result(attempt_id)
+
+
+# Глобальный писатель попыток
+attempt_writer = AttemptWriter(db)
@@ -0,0 +1,169 @@
+"""
+Журнал сервера: логгер cyber_vis через очередь (QueueHandler/QueueListener).
+
+Вызывающий код только кладёт запись в очередь, форматирование и запись в
+stdout - в отдельном потоке, так что медленный вывод (backpressure лог-драйвера
+Docker) не блокирует event loop. Повторяющиеся события ограничиваются по частоте,
+секреты в полях событий маскируются.
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import threading
+import time
+
+LOGGER_NAME = "cyber_vis"
+TEXT_FORMAT = "%(asctime)s | %(levelname)s | %(message)s"
+LOG_FORMATS = ("text", "json")
+
+# Поля событий, значения которых в журнал не попадают
+SECRET_FIELDS = frozenset({"password", "password_hash", "hash", "saved_hash", "token", "secret"})
+REDACTED = "***"
+
+
+def log_event(logger, level, event, **fields):
+    """Структурированное событие: имя и поля key=value (не форматируется, если уровень выключен)"""
+    if logger.isEnabledFor(level):
+        logger.log(level, event, extra={"event": event, "fields": fields})
+
+
+class RedactFilter(logging.Filter):
+    """Маскирует значения секретных полей события"""
+
+    def filter(self, record):
+        fields = getattr(record, "fields", None)
+        if fields and not SECRET_FIELDS.isdisjoint(fields):
+            record.fields = {
+                key: REDACTED if key in SECRET_FIELDS else value
+                for key, value in fields.items()
+            }
+        return True
+
+
+class RateLimitFilter(logging.Filter):
+    """Не больше burst записей одного события за interval секунд.
+
+    Касается событий (log_event) ниже уровня ERROR; ошибки проходят всегда.
+    Число отброшенных записей добавляется полем suppressed к первой записи
+    события в следующем интервале.
+    """
+
+    def __init__(self, burst=20, interval=10.0):
+        super().__init__()
+        self.burst = burst
+        self.interval = interval
+        self._lock = threading.Lock()
+        # событие -> [начало интервала, записей в интервале, отброшено]
+        self._events = {}
+        self.suppressed = 0
+
+    def filter(self, record):
+        event = getattr(record, "event", None)
+        if event is None or record.levelno >= logging.ERROR or not self.burst:
+            return True
+        now = time.monotonic()
+        with self._lock:
+            state = self._events.get(event)
+            if state is None:
+                state = self._events[event] = [now, 0, 0]
+            if now - state[0] >= self.interval:
+                dropped = state[2]
+                state[:] = [now, 0, 0]
+                if dropped:
+                    record.fields = {**record.fields, "suppressed": dropped}
+            if state[1] >= self.burst:
+                state[2] += 1
+                self.suppressed += 1
+                return False
+            state[1] += 1
+        return True
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler, который при переполненной очереди отбрасывает запись, а не ждёт"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class _Listener(logging.handlers.QueueListener):
+    def enqueue_sentinel(self):
+        # Очередь ограничена: ждём места, а не теряем сигнал остановки
+        self.queue.put(self._sentinel)
+
+
+class StructuredFormatter(logging.Formatter):
+    """text: прежний формат + поля key=value; json: одна JSON-строка на запись"""
+
+    def __init__(self, fmt="text"):
+        super().__init__(TEXT_FORMAT)
+        self.json = fmt == "json"
+
+    def format(self, record):
+        fields = getattr(record, "fields", None) or {}
+        if self.json:
+            data = {
+                "ts": self.formatTime(record),
+                "level": record.levelname,
+                "logger": record.name,
+                "message": record.getMessage(),
+                **fields,
+            }
+            return json.dumps(data, ensure_ascii=False, default=str)
+        line = super().format(record)
+        if fields:
+            line += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+        return line
+
+
+class LogPipeline:
+    """Очередь, обработчик логгера cyber_vis и поток записи в stdout"""
+
+    def __init__(self):
+        self.handler = None
+        self.listener = None
+        self.rate_limit = None
+        self._atexit = False
+
+    def setup(self, level="INFO", fmt="text", queue_size=10000, burst=20, interval=10.0):
+        if fmt not in LOG_FORMATS:
+            fmt = "text"
+        self.stop()
+        log_queue = queue.Queue(maxsize=queue_size)
+        self.rate_limit = RateLimitFilter(burst, interval)
+        self.handler = DroppingQueueHandler(log_queue)
+        self.handler.addFilter(self.rate_limit)
+        self.handler.addFilter(RedactFilter())
+
+        output = logging.StreamHandler()
+        output.setFormatter(StructuredFormatter(fmt))
+        self.listener = _Listener(log_queue, output)
+
+        logger = logging.getLogger(LOGGER_NAME)
+        logger.handlers = [self.handler]
+        logger.setLevel(getattr(logging, str(level).upper(), logging.INFO))
+        logger.propagate = False
+        self.listener.start()
+        if not self._atexit:
+            # setup() вызывается при каждом старте приложения - регистрируем один раз
+            atexit.register(self.stop)
+            self._atexit = True
+        return logger
+
+    def stop(self):
+        """Дописать очередь и остановить поток записи"""
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+
+
+log_pipeline = LogPipeline()
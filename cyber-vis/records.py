@@ -0,0 +1,128 @@
+"""
+Попытка входа в памяти: одна запись на весь путь от логина до рассылки мониторам
+"""
+import json
+from datetime import datetime
+
+
+def to_epoch_us(value) -> int:
+    """datetime или ISO-строка -> микросекунды Unix-времени (attempt_ts)"""
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    return int(value.replace(microsecond=0).timestamp()) * 1_000_000 + value.microsecond
+
+
+def from_epoch_us(value) -> str:
+    """attempt_ts -> локальное ISO-время (прежний формат attempt_time).
+
+    В час перевода часов назад два разных attempt_ts дают одну строку -
+    ключом сортировки и курсоров служит attempt_ts, а не attempt_time
+    """
+    seconds, micros = divmod(int(value), 1_000_000)
+    return datetime.fromtimestamp(seconds).replace(microsecond=micros).isoformat()
+
+
+class AttemptRecord:
+    """Попытка входа с полями login_attempts (ATTEMPT_COLUMNS) и флагом geo_pending.
+
+    Обработчик логина создаёт запись один раз; писатель пишет её в БД и
+    проставляет id, счётчики статистики читают её поля, событие мониторам
+    сериализуется один раз (to_json) - перечитывать строку из БД не нужно.
+    После создания поля меняются только методами set_* - они сбрасывают
+    сохранённый JSON.
+    """
+
+    __slots__ = (
+        "id", "username", "ip_address", "country", "city", "latitude", "longitude",
+        "attack_type", "threat_level", "client_type", "success", "reason",
+        "attempt_time", "user_agent", "metadata", "geo_pending", "_json",
+    )
+
+    def __init__(
+        self,
+        username,
+        ip_address,
+        client_type,
+        success,
+        reason="",
+        user_agent="",
+        metadata=None,
+        country=None,
+        city=None,
+        latitude=None,
+        longitude=None,
+        attack_type="login_attempt",
+        threat_level="low",
+        attempt_time=None,
+        id=None,
+        geo_pending=False,
+    ):
+        self.id = id
+        self.username = username
+        self.ip_address = ip_address
+        self.client_type = client_type
+        self.success = success
+        self.reason = reason
+        self.user_agent = user_agent
+        self.metadata = metadata
+        self.country = country
+        self.city = city
+        self.latitude = latitude
+        self.longitude = longitude
+        self.attack_type = attack_type
+        self.threat_level = threat_level
+        self.attempt_time = attempt_time
+        self.geo_pending = geo_pending
+        self._json = None
+
+    def set_geo(self, geo, pending=False):
+        """Заполнить геолокацию из dict (None - неизвестна; pending - дописывается фоном)"""
+        geo = geo or {}
+        self.country = geo.get("country")
+        self.city = geo.get("city")
+        self.latitude = geo.get("latitude")
+        self.longitude = geo.get("longitude")
+        self.geo_pending = pending
+        self._json = None
+
+    def set_tag(self, attack_type, threat_level):
+        """Тип атаки и уровень угрозы (действие tag правил)"""
+        self.attack_type = attack_type
+        self.threat_level = threat_level
+        self._json = None
+
+    def set_time(self, attempt_time):
+        self.attempt_time = attempt_time
+        self._json = None
+
+    def set_id(self, attempt_id):
+        """ID строки в login_attempts (проставляет писатель после записи)"""
+        self.id = attempt_id
+        self._json = None
+
+    def to_dict(self) -> dict:
+        """Попытка в формате событий WebSocket (как строки get_recent_attempts, success - bool)"""
+        return {
+            "id": self.id,
+            "username": self.username,
+            "ip_address": self.ip_address,
+            "country": self.country,
+            "city": self.city,
+            "latitude": self.latitude,
+            "longitude": self.longitude,
+            "attack_type": self.attack_type,
+            "threat_level": self.threat_level,
+            "client_type": self.client_type,
+            "success": bool(self.success),
+            "reason": self.reason,
+            "attempt_time": self.attempt_time.isoformat() if self.attempt_time else None,
+            "user_agent": self.user_agent,
+            "metadata": self.metadata,
+            "geo_pending": self.geo_pending,
+        }
+
+    def to_json(self) -> str:
+        """JSON записи; считается один раз и переиспользуется (сбрасывают set_*)"""
+        if self._json is None:
+            self._json = json.dumps(self.to_dict(), ensure_ascii=False, default=str)
+        return self._json
@@ -0,0 +1,121 @@
+"""
+Фоновый перенос старых попыток из login_attempts в архив и очистка
+минутных агрегатов
+"""
+import asyncio
+import logging
+from datetime import datetime, timedelta
+
+from database import db, env_int, ROLLUP_RESOLUTIONS
+from logs import log_event
+
+logger = logging.getLogger("cyber_vis.retention")
+
+
+class RetentionWorker:
+    """Периодически переносит попытки старше горячего окна в архив.
+
+    Перенос идёт порциями по chunk_size строк с паузой между ними, чтобы
+    запись новых попыток не ждала долго. hot_days = 0 отключает архивацию.
+    Минутные агрегаты старше rollup_days удаляются (часовые остаются);
+    rollup_days = 0 - хранить всё. После архивации из словаря attempt_strings
+    удаляются строки, на которые больше нет ссылок. Начатая порция не
+    прерывается: stop() дожидается её, иначе закрытие БД могло бы попасть
+    между записью в архив и DELETE, и порция ушла бы в архив повторно.
+    """
+
+    def __init__(self, database, hot_days=None, chunk_size=None, interval=None, pause=0.05,
+                 rollup_days=None):
+        self.db = database
+        self.hot_days = hot_days if hot_days is not None else env_int("CYBER_VIS_RETENTION_DAYS", 0)
+        self.rollup_days = rollup_days if rollup_days is not None else database.minute_rollup_days
+        self.chunk_size = chunk_size or env_int("CYBER_VIS_RETENTION_CHUNK", 5000)
+        self.interval = interval or env_int("CYBER_VIS_RETENTION_INTERVAL_S", 600)
+        self.pause = pause
+        self._task = None
+        self._step = None
+
+    @property
+    def archiving(self) -> bool:
+        return self.hot_days > 0 and self.db.archive is not None
+
+    @property
+    def enabled(self) -> bool:
+        return self.archiving or self.rollup_days > 0
+
+    async def start(self):
+        if not self.enabled or self._task is not None:
+            return
+        self._task = asyncio.create_task(self._run(), name="retention")
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        if self._step is not None:
+            try:
+                await self._step
+            except Exception as e:
+                log_event(logger, logging.ERROR, "retention_failed", error=e)
+            self._step = None
+
+    async def _in_thread(self, func, *args):
+        """Выполнить порцию в потоке; отмена ожидающей задачи её не прерывает"""
+        self._step = asyncio.ensure_future(asyncio.to_thread(func, *args))
+        try:
+            return await asyncio.shield(self._step)
+        finally:
+            if self._step.done():
+                self._step = None
+
+    async def run_once(self) -> int:
+        """Перенести в архив всё, что старше горячего окна. Возвращает число строк"""
+        if not self.archiving:
+            return 0
+        cutoff = datetime.now() - timedelta(days=self.hot_days)
+        moved = 0
+        while True:
+            count = await self._in_thread(self.db.archive_chunk, cutoff, self.chunk_size)
+            moved += count
+            if count < self.chunk_size:
+                return moved
+            await asyncio.sleep(self.pause)
+
+    async def prune_rollups(self) -> int:
+        """Удалить минутные агрегаты старше rollup_days. Возвращает число строк"""
+        if self.rollup_days <= 0:
+            return 0
+        cutoff = datetime.now() - timedelta(days=self.rollup_days)
+        removed = 0
+        while True:
+            count = await self._in_thread(self.db.prune_rollups, ROLLUP_RESOLUTIONS[0], cutoff)
+            removed += count
+            if not count:
+                return removed
+            await asyncio.sleep(self.pause)
+
+    async def _run(self):
+        while True:
+            try:
+                moved = await self.run_once()
+                if moved:
+                    log_event(logger, logging.INFO, "attempts_archived", moved=moved)
+                    # Строки словаря, нужные только перенесённым попыткам
+                    removed = await self._in_thread(self.db.prune_strings)
+                    if removed:
+                        log_event(logger, logging.INFO, "strings_pruned", removed=removed)
+                pruned = await self.prune_rollups()
+                if pruned:
+                    log_event(logger, logging.INFO, "rollups_pruned", resolution=ROLLUP_RESOLUTIONS[0], removed=pruned)
+            except Exception as e:
+                log_event(logger, logging.ERROR, "retention_failed", error=e)
+            await asyncio.sleep(self.interval)
+
+
+# Глобальный обработчик хранения
+retention_worker = RetentionWorker(db)
@@ -0,0 +1,287 @@
+"""
+Правила обнаружения атак из файла конфигурации (JSON)
+
+Пример rules.json:
+
+    {"rules": [
+        {"name": "ip_bruteforce", "dimension": "ip", "window_minutes": 15,
+         "threshold": 3, "action": "block", "block_minutes": 10},
+        {"name": "password_spray", "dimension": "username", "window_minutes": 10,
+         "threshold": 20, "action": "alert"},
+        {"name": "subnet_scan", "dimension": "subnet", "count": "attempts",
+         "window_minutes": 5, "threshold": 100, "action": "tag", "tag": "subnet_scan"}
+    ]}
+
+Файл перечитывается при изменении, без перезапуска сервера.
+"""
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from collections import namedtuple
+
+from failures import FailureCounters, attempt_keys
+from logs import log_event
+
+logger = logging.getLogger("cyber_vis.rules")
+
+DIMENSIONS = ("ip", "username", "subnet")
+COUNTS = ("failures", "attempts")
+ACTIONS = ("block", "tag", "alert")
+MAX_WINDOW_MINUTES = 24 * 60
+
+# Правила по умолчанию (если файла нет): прежние правила 1 и 2
+DEFAULT_RULES = [
+    {
+        "name": "ip_failures_15m",
+        "dimension": "ip",
+        "window_minutes": 15,
+        "threshold": 3,
+        "action": "block",
+        "block_minutes": 10,
+        "reason": "Слишком много неудачных попыток (3+ за 15 мин)",
+        "event_reason": "3+ ошибки за 15 минут",
+        "message": "⏱️ IP заблокирован на 10 минут из-за частых ошибок. Попробуйте позже.",
+    },
+    {
+        "name": "ip_failures_60m",
+        "dimension": "ip",
+        "window_minutes": 60,
+        "threshold": 10,
+        "action": "block",
+        "block_minutes": 24 * 60,
+        "reason": "Слишком много неудачных попыток (10+ за час)",
+        "event_reason": "10+ ошибок за час",
+        "message": "⏱️ IP заблокирован на 24 часа из-за многочисленных ошибок.",
+    },
+]
+
+# Сработавшее правило: key - значение измерения (IP, логин или подсеть),
+# count - попыток в окне вместе с текущей
+RuleMatch = namedtuple("RuleMatch", "rule key count")
+
+
+class Rule:
+    """Правило: больше threshold попыток (count) по измерению за window_minutes -> action"""
+
+    __slots__ = (
+        "name", "dimension", "count", "window_minutes", "threshold", "action",
+        "block_minutes", "reason", "event_reason", "message", "tag", "threat_level",
+    )
+
+    def __init__(self, data: dict):
+        if not isinstance(data, dict):
+            raise ValueError("правило должно быть объектом")
+        self.name = data.get("name")
+        if not self.name or not isinstance(self.name, str):
+            raise ValueError("у правила нет имени (name)")
+        self.dimension = self._choice(data, "dimension", DIMENSIONS, None)
+        self.count = self._choice(data, "count", COUNTS, "failures")
+        self.action = self._choice(data, "action", ACTIONS, None)
+        self.window_minutes = self._positive(data, "window_minutes", MAX_WINDOW_MINUTES)
+        self.threshold = self._positive(data, "threshold")
+        self.block_minutes = None
+        self.tag = None
+        self.threat_level = None
+        if self.action == "block":
+            if self.dimension == "username":
+                raise ValueError(f"{self.name}: блокировать можно только ip или subnet")
+            # Без block_minutes - постоянная блокировка
+            if data.get("block_minutes") is not None:
+                self.block_minutes = self._positive(data, "block_minutes")
+        elif self.action == "tag":
+            self.tag = data.get("tag")
+            if not self.tag or not isinstance(self.tag, str):
+                raise ValueError(f"{self.name}: для tag нужно поле tag")
+            self.threat_level = data.get("threat_level", "high")
+        default_reason = f"Правило {self.name}: {self.threshold}+ за {self.window_minutes} мин"
+        self.reason = data.get("reason") or default_reason
+        self.event_reason = data.get("event_reason") or self.reason
+        self.message = data.get("message") or "⏱️ IP заблокирован из-за подозрительной активности."
+
+    def _choice(self, data, field, choices, default):
+        value = data.get(field, default)
+        if value not in choices:
+            raise ValueError(f"{self.name}: {field} должен быть одним из: {', '.join(choices)}")
+        return value
+
+    def _positive(self, data, field, maximum=None):
+        value = data.get(field)
+        if isinstance(value, bool) or not isinstance(value, int) or value < 1:
+            raise ValueError(f"{self.name}: {field} должен быть целым числом >= 1")
+        if maximum is not None and value > maximum:
+            raise ValueError(f"{self.name}: {field} не больше {maximum}")
+        return value
+
+    def to_dict(self) -> dict:
+        return {
+            field: getattr(self, field)
+            for field in self.__slots__
+            if getattr(self, field) is not None
+        }
+
+
+def parse_rules(data) -> list:
+    """Правила из разобранного JSON ({"rules": [...]} или список). ValueError - ошибка в конфиге"""
+    items = data.get("rules") if isinstance(data, dict) else data
+    if not isinstance(items, list):
+        raise ValueError('ожидается {"rules": [...]}')
+    rules = [Rule(item) for item in items if not (isinstance(item, dict) and item.get("enabled") is False)]
+    names = [rule.name for rule in rules]
+    duplicates = sorted({name for name in names if names.count(name) > 1})
+    if duplicates:
+        raise ValueError(f"повторяются имена правил: {', '.join(duplicates)}")
+    return rules
+
+
+class RulesEngine:
+    """Все правила за один проход по общим скользящим счётчикам в памяти.
+
+    Счётчик - один на пару (измерение, что считаем) для всех правил с ней,
+    с окном по самому длинному из них; ответ на правило - сумма корзин, без
+    SQL. Новое правило не добавляет запросов к БД на логин. Файл правил
+    проверяется фоновой задачей раз в reload_interval секунд и перечитывается
+    при изменении в отдельном потоке: разбор и заполнение новых счётчиков из
+    БД не задерживают логины, правила и их счётчики подменяются разом.
+    С ошибкой в файле остаются прежние правила. Повторные alert одного
+    правила по одному ключу подавляются на время его окна.
+    До первого reload() действуют правила по умолчанию.
+    """
+
+    def __init__(self, path=None, reload_interval=2.0, counters=None, max_keys=100000):
+        self.path = path
+        self.reload_interval = reload_interval
+        # Счётчики общие с БД (db.counters): окно ошибок IP для классификации
+        # попыток - тот же счётчик, что у правил
+        self.counters = counters if counters is not None else FailureCounters(max_keys=max_keys)
+        self.max_keys = max_keys
+        self.source = "default"
+        self.error = None
+        self._mtime = None
+        self._lock = threading.Lock()
+        self._task = None
+        self._alerted = {}
+        # (правила, их счётчики) - заменяются одним присваиванием
+        self._active = self._activate(parse_rules(DEFAULT_RULES))
+
+    @property
+    def rules(self) -> list:
+        return self._active[0]
+
+    def _activate(self, rules) -> tuple:
+        """Счётчики для измерений правил (накопленные окна сохраняются,
+        новые и расширенные заполняются попытками из БД)"""
+        windows = {}
+        for rule in rules:
+            key = (rule.dimension, rule.count)
+            windows[key] = max(windows.get(key, 0), rule.window_minutes)
+        return rules, self.counters.ensure(windows)
+
+    def reload(self) -> bool:
+        """Перечитать файл правил (блокирующий вызов, читает файл и БД).
+        False - файла нет или в нём ошибка"""
+        with self._lock:
+            try:
+                self._mtime = os.stat(self.path).st_mtime
+                with open(self.path, encoding="utf-8") as file:
+                    rules = parse_rules(json.load(file))
+            except FileNotFoundError:
+                self._mtime = None
+                self.error = f"файл правил {self.path} не найден, действуют прежние правила"
+                return False
+            except (OSError, ValueError) as e:
+                # Следующая попытка - когда файл снова изменится
+                self.error = f"{self.path}: {e}"
+                log_event(logger, logging.ERROR, "rules_invalid", path=self.path, error=e)
+                return False
+            self._active = self._activate(rules)
+            self.source = self.path
+            self.error = None
+            self._alerted = {}
+        log_event(logger, logging.INFO, "rules_loaded", path=self.path, rules=len(rules))
+        return True
+
+    def maybe_reload(self) -> bool:
+        """Перечитать файл правил, если он изменился (блокирующий вызов)"""
+        if not self.path:
+            return False
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError:
+            mtime = None
+        return mtime != self._mtime and self.reload()
+
+    async def start(self):
+        if self._task is None and self.path:
+            self._task = asyncio.create_task(self._run(), name="rules-reload")
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.reload_interval)
+            try:
+                await asyncio.to_thread(self.maybe_reload)
+            except Exception as e:
+                log_event(logger, logging.ERROR, "rules_reload_failed", path=self.path, error=e)
+
+    def evaluate(self, record, now=None) -> list:
+        """Учесть попытку (AttemptRecord) и вернуть сработавшие правила в порядке файла.
+
+        Только память: правила перечитывает фоновая задача (start()).
+        Для попыток старше окна правила (повтор журналов) правило не срабатывает.
+        """
+        now = time.time() if now is None else now
+        rules, counters = self._active
+        ts = record.attempt_time.timestamp() if record.attempt_time else now
+        keys = attempt_keys(record.ip_address, record.username)
+        self.counters.record(keys, record.success, ts)
+
+        matches = []
+        counts = {}
+        for rule in rules:
+            key = keys[rule.dimension]
+            if key is None or (rule.count == "failures" and record.success):
+                continue
+            if now - ts > rule.window_minutes * 60:
+                continue
+            window = (rule.dimension, rule.count, rule.window_minutes)
+            if window not in counts:
+                counts[window] = counters[(rule.dimension, rule.count)].count(key, rule.window_minutes, now)
+            if counts[window] < rule.threshold:
+                continue
+            if rule.action == "alert" and not self._first_alert(rule, key, now):
+                continue
+            matches.append(RuleMatch(rule, key, counts[window]))
+        return matches
+
+    def _first_alert(self, rule, key, now) -> bool:
+        until = self._alerted.get((rule.name, key))
+        if until is not None and until > now:
+            return False
+        if len(self._alerted) >= self.max_keys:
+            self._alerted = {item: expires for item, expires in self._alerted.items() if expires > now}
+        self._alerted[(rule.name, key)] = now + rule.window_minutes * 60
+        return True
+
+    def describe(self) -> dict:
+        rules, counters = self._active
+        return {
+            "source": self.source,
+            "error": self.error,
+            "rules": [rule.to_dict() for rule in rules],
+            "counters": {
+                f"{dimension}:{count}": {"window_minutes": counter.max_window, "keys": len(counter)}
+                for (dimension, count), counter in counters.items()
+            },
+        }
@@ -1,22 +1,23 @@
 """
 FastAPI сервер с WebSocket для системы мониторинга
 """
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Request, Response  # Добавили Request
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Request, Response, Query, Depends  # Добавили Request
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel, ValidationError
 from typing import Optional, List
-import hashlib
 import json
-from datetime import datetime
+import base64
+import codecs
+import csv
+import io
+from datetime import datetime, timedelta
 import os
 import sys
 import time
 import logging
 import uvicorn
 import asyncio
-import sqlite3
-import requests
-import ipaddress
 
 for stream in (sys.stdout, sys.stderr):
     if hasattr(stream, "reconfigure"):
@@ -25,13 +26,41 @@ for stream in (sys.stdout, sys.stderr):
         except Exception:
             pass
 
-from database import db
+from database import db, env_int, ATTEMPT_COLUMNS, TIMESERIES_RESOLUTIONS
+from blocks import subnet_of, BlocklistParser, BLOCKLIST_COLUMNS
+from async_db import adb, DatabaseTimeout
+from ingest import attempt_writer
+from retention import retention_worker
+from sweeper import block_sweeper
+from checkpoint import stats_checkpoint
+from geo import GeoCache, GeoClient, GeoUnavailable, build_resolver, is_local_ip
+from enrich import GeoEnricher
+from records import AttemptRecord
+from rules import RulesEngine
+from logs import LOGGER_NAME, log_pipeline, log_event
+from credentials import CredentialVerifier, VerifierBusy, hash_password
 
 app = FastAPI(title="Login Monitor API", version="1.0")
 
-logger = logging.getLogger("cyber_vis")
-if not logger.handlers:
-    logging.basicConfig(level=logging.INFO, format="%(asctime)s | %(levelname)s | %(message)s")
+# Журнал пишется через очередь в отдельном потоке (запускается при старте);
+# события попыток входа - уровня DEBUG и ограничены по частоте
+# (CYBER_VIS_LOG_BURST за CYBER_VIS_LOG_INTERVAL_S)
+logger = logging.getLogger(LOGGER_NAME)
+
+def setup_logging():
+    log_pipeline.setup(
+        level=os.environ.get("CYBER_VIS_LOG_LEVEL", "INFO"),
+        fmt=os.environ.get("CYBER_VIS_LOG_FORMAT", "text"),
+        queue_size=env_int("CYBER_VIS_LOG_QUEUE", 10000),
+        burst=env_int("CYBER_VIS_LOG_BURST", 20),
+        interval=env_int("CYBER_VIS_LOG_INTERVAL_S", 10),
+    )
+
+# Строка журнала на HTTP-запрос: каждый N-й запрос, а также ошибки 5xx и
+# запросы медленнее порога - всегда
+HTTP_LOG_SAMPLE = max(1, env_int("CYBER_VIS_HTTP_LOG_SAMPLE", 1))
+HTTP_LOG_SLOW_MS = env_int("CYBER_VIS_HTTP_LOG_SLOW_MS", 1000)
+http_request_counter = 0
 
 def extract_client_ip(headers: dict, fallback: str) -> str:
     return (
@@ -43,9 +72,17 @@ def extract_client_ip(headers: dict, fallback: str) -> str:
 
 @app.middleware("http")
 async def log_requests(request: Request, call_next):
+    global http_request_counter
     start = time.perf_counter()
     response = await call_next(request)
     duration_ms = (time.perf_counter() - start) * 1000
+    http_request_counter += 1
+    if (
+        http_request_counter % HTTP_LOG_SAMPLE
+        and response.status_code < 500
+        and duration_ms < HTTP_LOG_SLOW_MS
+    ) or not logger.isEnabledFor(logging.INFO):
+        return response
     headers = {k.lower(): v for k, v in request.headers.items()}
     client_ip = extract_client_ip(headers, request.client.host if request.client else "unknown")
     cf_ray = headers.get("cf-ray", "-")
@@ -84,6 +121,30 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.exception_handler(DatabaseTimeout)
+async def database_timeout_handler(request: Request, exc: DatabaseTimeout):
+    logger.warning("DB TIMEOUT %s %s: %s", request.method, request.url.path, exc)
+    return JSONResponse(
+        status_code=503,
+        content={
+            "success": False,
+            "error": str(exc),
+            "timestamp": datetime.now().isoformat()
+        }
+    )
+
+@app.exception_handler(VerifierBusy)
+async def verifier_busy_handler(request: Request, exc: VerifierBusy):
+    return JSONResponse(
+        status_code=503,
+        headers={"Retry-After": "1"},
+        content={
+            "success": False,
+            "error": str(exc),
+            "timestamp": datetime.now().isoformat()
+        }
+    )
+
 @app.get("/favicon.ico", include_in_schema=False)
 async def favicon():
     return Response(status_code=204)
@@ -96,6 +157,10 @@ class LoginRequest(BaseModel):
     user_agent: Optional[str] = "unknown"
     ip_address: Optional[str] = None  # optional client-supplied IP (preferred if present)
 
+# Элемент пачки логинов: attempt_time - время исторической попытки (повтор журналов)
+class BatchLoginItem(LoginRequest):
+    attempt_time: Optional[datetime] = None
+
 # Модель ответа
 class LoginResponse(BaseModel):
     success: bool
@@ -123,6 +188,37 @@ def get_client_ip(request: Request) -> str:
     
     return "127.0.0.1"  # fallback
 
+# Кэш геолокации: повторные логины с того же IP не ходят к провайдеру.
+# Резолвер подменяется через geo_cache.resolver (например, заглушкой в тестах);
+# источник - CYBER_VIS_GEO_MODE: online / offline (файл CYBER_VIS_GEO_DB) / hybrid,
+# собирается при старте, если резолвер не подменён
+geo_client = GeoClient(
+    max_concurrency=env_int("CYBER_VIS_GEO_CONCURRENCY", 8),
+    timeout=env_int("CYBER_VIS_GEO_TIMEOUT_MS", 2000) / 1000,
+    failure_threshold=env_int("CYBER_VIS_GEO_BREAKER_FAILURES", 5),
+    cooldown=env_int("CYBER_VIS_GEO_BREAKER_COOLDOWN_S", 30),
+)
+geo_cache = GeoCache(
+    resolver=None,
+    max_entries=env_int("CYBER_VIS_GEO_CACHE_SIZE", 50000),
+    positive_ttl=env_int("CYBER_VIS_GEO_TTL_S", 86400),
+    negative_ttl=env_int("CYBER_VIS_GEO_NEGATIVE_TTL_S", 300),
+)
+GEO_CACHE_PERSIST = env_int("CYBER_VIS_GEO_CACHE_PERSIST", 1) == 1
+
+def setup_geo_resolver():
+    if geo_cache.resolver is None:
+        geo_cache.resolver = build_resolver(
+            os.environ.get("CYBER_VIS_GEO_MODE", "online"),
+            os.environ.get("CYBER_VIS_GEO_DB"),
+            online=geo_client,
+        )
+
+def save_geo_cache():
+    rows = geo_cache.take_dirty()
+    if rows:
+        db.save_geo_cache(rows)
+
 # Функция для получения страны по IP
 def get_country_by_ip(ip_address: str) -> str:
     """Получить страну по IP-адресу"""
@@ -130,61 +226,46 @@ def get_country_by_ip(ip_address: str) -> str:
         return "Локальное"
     
     try:
-        # Используем ipwhois.app API (бесплатно, без ключа)
-        response = requests.get(f'https://ipwhois.app/json/{ip_address}', timeout=2)
-        if response.ok:
-            data = response.json()
-            country = data.get('country')
-            if country:
-                return country
-    except Exception as e:
-        print(f"⚠️  Ошибка определения страны для IP {ip_address}: {e}")
-    
+        geo = geo_cache.get(ip_address)
+    except GeoUnavailable:
+        geo = None
+    if geo and geo.get("country"):
+        return geo["country"]
     return "Неизвестно"
 
-def _to_float(value):
-    try:
-        if value is None or value == "":
-            return None
-        return float(value)
-    except (TypeError, ValueError):
-        return None
-
-def is_local_ip(ip_address: str) -> bool:
-    try:
-        parsed_ip = ipaddress.ip_address(ip_address)
-        return parsed_ip.is_private or parsed_ip.is_loopback or parsed_ip.is_link_local
-    except ValueError:
-        return not ip_address or ip_address.lower() == "localhost"
-
-def get_geo_by_ip(ip_address: str) -> dict:
-    """Get country/city/coordinates for the attack map."""
+def _geo_or_fallback(ip_address: str, geo) -> dict:
     fallback = {
         "country": "Локальное" if is_local_ip(ip_address or "") else "Неизвестно",
         "city": None,
         "latitude": None,
         "longitude": None,
     }
-
-    if not ip_address or is_local_ip(ip_address):
+    if geo is None:
         return fallback
+    geo["country"] = geo["country"] or fallback["country"]
+    return geo
+
+def get_geo_by_ip(ip_address: str, strict: bool = False) -> dict:
+    """Get country/city/coordinates for the attack map.
 
+    strict=True: GeoUnavailable пробрасывается, а не заменяется на "Неизвестно"
+    """
+    if not ip_address or is_local_ip(ip_address):
+        return _geo_or_fallback(ip_address, None)
     try:
-        response = requests.get(f"https://ipwhois.app/json/{ip_address}", timeout=2)
-        if response.ok:
-            data = response.json()
-            if data.get("success") is False:
-                return fallback
-            return {
-                "country": data.get("country") or fallback["country"],
-                "city": data.get("city"),
-                "latitude": _to_float(data.get("latitude")),
-                "longitude": _to_float(data.get("longitude")),
-            }
-    except Exception as e:
-        print(f"⚠️ Ошибка определения геолокации для IP {ip_address}: {e}")
+        geo = geo_cache.get(ip_address)
+    except GeoUnavailable:
+        if strict:
+            raise
+        geo = None
+    return _geo_or_fallback(ip_address, geo)
 
-    return fallback
+def peek_geo_by_ip(ip_address: str):
+    """Геолокация без запроса к провайдеру (локальный адрес или кэш); None - нужен запрос"""
+    if not ip_address or is_local_ip(ip_address):
+        return _geo_or_fallback(ip_address, None)
+    found, geo = geo_cache.peek(ip_address)
+    return _geo_or_fallback(ip_address, geo) if found else None
 
 def classify_attempt(success: bool, failed_attempts_before: int) -> tuple[str, str]:
     if success:
@@ -193,11 +274,7 @@ def classify_attempt(success: bool, failed_attempts_before: int) -> tuple[str, s
         return "brute_force", "high"
     return "failed_login", "medium"
 
-# Хеш паролей
-def hash_password(password: str) -> str:
-    return hashlib.sha256(password.encode()).hexdigest()
-
-# Создаем словарь с хешированными паролями
+# Создаем словарь с хешированными паролями (scrypt, см. credentials.py)
 RAW_USERS = {
     "ilya": "1111",
     "admin": "admin123",
@@ -205,7 +282,22 @@ RAW_USERS = {
     "user": "password"
 }
 
-USERS = {username: hash_password(password) for username, password in RAW_USERS.items()}
+# Хеши считаются при старте сервера (scrypt не на импорте модуля)
+USERS = {}
+
+def hash_users():
+    if not USERS:
+        USERS.update({username: hash_password(password) for username, password in RAW_USERS.items()})
+
+# Проверка паролей - в пуле процессов; сверх CYBER_VIS_KDF_QUEUE ожидающих
+# проверок логин отвечает 503, неверные пары помнятся CYBER_VIS_KDF_NEGATIVE_TTL_S
+credential_verifier = CredentialVerifier(
+    USERS,
+    workers=env_int("CYBER_VIS_KDF_WORKERS", min(4, os.cpu_count() or 1)),
+    max_pending=env_int("CYBER_VIS_KDF_QUEUE", 64),
+    negative_ttl=env_int("CYBER_VIS_KDF_NEGATIVE_TTL_S", 60),
+    negative_size=env_int("CYBER_VIS_KDF_NEGATIVE_SIZE", 100000),
+)
 
 # WebSocket подключения для мониторинга
 class ConnectionManager:
@@ -239,10 +331,19 @@ class ConnectionManager:
             self.disconnect(websocket)
             
     async def broadcast(self, message: dict):
+        # Сериализуем один раз на всех получателей
+        await self.broadcast_text(json.dumps(message, separators=(",", ":"), ensure_ascii=False))
+
+    async def broadcast_event(self, event_type: str, data_json: str):
+        """Событие с уже сериализованными данными (AttemptRecord.to_json)"""
+        timestamp = json.dumps(datetime.now().isoformat())
+        await self.broadcast_text(f'{{"type":"{event_type}","data":{data_json},"timestamp":{timestamp}}}')
+
+    async def broadcast_text(self, text: str):
         disconnected = []
         for connection in self.active_connections:
             try:
-                await connection.send_json(message)
+                await connection.send_text(text)
             except:
                 disconnected.append(connection)
         for connection in disconnected:
@@ -250,6 +351,143 @@ class ConnectionManager:
 
 manager = ConnectionManager()
 
+async def broadcast_enriched(attempt_ids: list, geo: dict):
+    """Геолокация дописана фоном - одно событие на все попытки с этого IP"""
+    await manager.broadcast({
+        "type": "login_attempt_enriched",
+        "data": {"ids": list(attempt_ids), **geo},
+        "timestamp": datetime.now().isoformat()
+    })
+
+# Геолокация адресов, которых нет в кэше, определяется после ответа на логин
+geo_enricher = GeoEnricher(
+    db,
+    resolve=lambda ip_address: get_geo_by_ip(ip_address, strict=True),
+    on_enriched=broadcast_enriched,
+)
+
+@app.on_event("startup")
+async def start_background_workers():
+    # Всё, что открывает файлы, потоки и считает scrypt, - здесь, а не при
+    # импорте: процессы пула проверки паролей (spawn) заново импортируют
+    # запускаемый модуль и не должны повторять старт сервера
+    setup_logging()
+    await asyncio.to_thread(db.open)
+    await asyncio.to_thread(hash_users)
+    setup_geo_resolver()
+    # Счётчики правил, появившиеся после db.open(), заполняются из БД
+    if rules_engine.path:
+        await asyncio.to_thread(rules_engine.reload)
+    if GEO_CACHE_PERSIST:
+        geo_cache.load(await adb.load_geo_cache(geo_cache.max_entries))
+        stats_checkpoint.register(save_geo_cache)
+    await credential_verifier.start()
+    await attempt_writer.start()
+    await geo_enricher.start()
+    await retention_worker.start()
+    await block_sweeper.start()
+    await rules_engine.start()
+    await stats_checkpoint.start()
+
+@app.on_event("shutdown")
+async def close_database():
+    # Сначала дописываем очередь попыток, потом закрываем соединения
+    await rules_engine.stop()
+    await block_sweeper.stop()
+    await retention_worker.stop()
+    await geo_enricher.stop()
+    await attempt_writer.stop()
+    # Скетчи статистики - после дописанной очереди, чтобы учесть всё
+    await stats_checkpoint.stop()
+    await credential_verifier.stop()
+    adb.close()
+    db.close()
+
+# Правила обнаружения (блокировка, пометка, оповещение) - из JSON-файла
+# CYBER_VIS_RULES, перечитываются при изменении без перезапуска
+rules_engine = RulesEngine(
+    path=os.environ.get("CYBER_VIS_RULES") or os.path.join(os.path.dirname(os.path.abspath(__file__)), "rules.json"),
+    reload_interval=env_int("CYBER_VIS_RULES_RELOAD_S", 2),
+    counters=db.counters,
+    max_keys=env_int("CYBER_VIS_FAILURE_MAX_IPS", 100000),
+)
+
+# Правило 3: столько отдельно заблокированных IP одной подсети /24 (/48)
+# переводят блокировку на всю подсеть (0 - выключено)
+SUBNET_ESCALATION_IPS = env_int("CYBER_VIS_SUBNET_ESCALATE_IPS", 3)
+SUBNET_BLOCK_MINUTES = env_int("CYBER_VIS_SUBNET_BLOCK_MIN", 24 * 60)
+
+async def escalate_to_subnet(client_ip: str, notify: bool = True):
+    """Заблокировать подсеть адреса, если в ней уже достаточно заблокированных IP.
+
+    notify=False - без события ip_blocked (его отправит вызывающий, например пачка логинов)
+    """
+    subnet = subnet_of(client_ip)
+    if not SUBNET_ESCALATION_IPS or subnet is None:
+        return None
+    blocked = db.blocks.blocked_in_subnet(client_ip)
+    if blocked < SUBNET_ESCALATION_IPS or db.is_ip_blocked(subnet)[0]:
+        return None
+    await adb.add_ip_block(subnet, reason=f"Заблокировано {blocked}+ IP подсети",
+                           duration_minutes=SUBNET_BLOCK_MINUTES, is_permanent=False)
+    log_event(logger, logging.WARNING, "subnet_blocked", subnet=subnet, minutes=SUBNET_BLOCK_MINUTES, rule=3)
+    if not notify:
+        return subnet
+    await manager.broadcast({
+        "type": "ip_blocked",
+        "data": {"ip_address": subnet, "reason": f"{blocked}+ заблокированных IP в подсети"},
+        "timestamp": datetime.now().isoformat()
+    })
+    return subnet
+
+def apply_rule_tags(record: AttemptRecord, matches: list):
+    """Действие tag: пометить попытку до записи (первое сработавшее правило)"""
+    for match in matches:
+        if match.rule.action == "tag":
+            record.set_tag(match.rule.tag, match.rule.threat_level)
+            return
+
+def first_rule_block(matches: list):
+    """Первое сработавшее правило с действием block (или None)"""
+    return next((match for match in matches if match.rule.action == "block"), None)
+
+async def apply_rule_actions(matches: list, notify: bool = True):
+    """Действия block и alert после записи попытки.
+
+    Возвращает (ответ клиенту при блокировке или None, события мониторам).
+    notify=False - события не рассылаются, а только возвращаются (пачка логинов).
+    """
+    events = []
+    for match in matches:
+        rule = match.rule
+        if rule.action != "alert":
+            continue
+        log_event(logger, logging.WARNING, "rule_alert", rule=rule.name, dimension=rule.dimension,
+                  key=match.key, count=match.count)
+        events.append({"type": "rule_alert", "data": {
+            "rule": rule.name,
+            "dimension": rule.dimension,
+            "key": match.key,
+            "count": match.count,
+            "window_minutes": rule.window_minutes,
+            "reason": rule.reason,
+        }})
+    block = first_rule_block(matches)
+    if block is not None:
+        rule = block.rule
+        await adb.add_ip_block(block.key, reason=rule.reason, duration_minutes=rule.block_minutes,
+                               is_permanent=rule.block_minutes is None)
+        log_event(logger, logging.WARNING, "ip_blocked", ip=block.key, minutes=rule.block_minutes,
+                  rule=rule.name, count=block.count)
+        events.append({"type": "ip_blocked", "data": {"ip_address": block.key, "reason": rule.event_reason}})
+        subnet = await escalate_to_subnet(block.key, notify=False) if rule.dimension == "ip" else None
+        if subnet:
+            events.append({"type": "ip_blocked", "data": {"ip_address": subnet, "reason": "Подсеть с заблокированными IP"}})
+    if notify:
+        for event in events:
+            await manager.broadcast({**event, "timestamp": datetime.now().isoformat()})
+    return (block.rule.message if block is not None else None), events
+
 @app.post("/api/auth/login", response_model=LoginResponse)
 async def login(request: LoginRequest, http_request: Request):
     """Обработка попытки входа"""
@@ -259,173 +497,493 @@ async def login(request: LoginRequest, http_request: Request):
     # НОВОЕ: Проверяем, заблокирован ли IP
     is_blocked, block_reason = db.is_ip_blocked(client_ip)
     if is_blocked:
-        print(f"🚫 Попытка входа с заблокированного IP: {client_ip} - {block_reason}")
+        log_event(logger, logging.DEBUG, "login_blocked", ip=client_ip, reason=block_reason)
         return LoginResponse(
             success=False,
             message=block_reason
         )
     
-    print(f"🔍 Попытка входа:")
-    print(f"   Пользователь: {request.username}")
-    print(f"   IP-адрес: {client_ip}")
-    print(f"   Введенный пароль: {request.password}")
-    print(f"   Хеш введенного пароля: {hash_password(request.password)}")
-    print(f"   Сохраненный хеш: {USERS.get(request.username)}")
-    
-    # Получаем сохраненный хеш пароля для пользователя
-    saved_password_hash = USERS.get(request.username)
-    
-    # Хешируем введенный пароль
-    input_password_hash = hash_password(request.password)
-    
-    # Проверяем учетные данные - сравниваем хеши
-    is_valid = False
+    # Проверяем учетные данные: scrypt в пуле процессов, заблокированные IP
+    # сюда уже не доходят
+    is_valid = await credential_verifier.verify(request.username, request.password)
     reason = ""
     
-    if request.username in USERS and input_password_hash == saved_password_hash:
-        is_valid = True
+    if is_valid:
         reason = "Успешная авторизация"
         message = f"Добро пожаловать, {request.username}!"
-        print(f"   ✅ Авторизация успешна")
     else:
         is_valid = False
         if request.username in USERS:
             reason = "Неверный пароль"
-            print(f"   ❌ Неверный пароль")
-            print(f"   Введенный хеш: {input_password_hash}")
-            print(f"   Ожидаемый хеш: {saved_password_hash}")
         else:
             reason = "Пользователь не найден"
-            print(f"   ❌ Пользователь не найден")
         message = "Неверный логин или пароль"
     
     failed_attempts_before = 0 if is_valid else db.get_failed_attempts_count(client_ip, minutes=15)
     attack_type, threat_level = classify_attempt(is_valid, failed_attempts_before)
-    geo = await asyncio.to_thread(get_geo_by_ip, client_ip)
+    # Геолокация из кэша - сразу; иначе попытка пишется без неё и дополняется
+    # фоном (событие login_attempt_enriched), ответ провайдера не ждём
+    geo = peek_geo_by_ip(client_ip)
+    geo_pending = geo is None and geo_enricher.running
+    if geo is None and not geo_pending:
+        geo = await asyncio.to_thread(get_geo_by_ip, client_ip)
 
-    # Сохраняем попытку в БД ПЕРЕД проверкой блокировки
-    attempt_id = db.add_attempt(
+    # Одна запись попытки на запись в БД, счётчики и событие мониторам
+    record = AttemptRecord(
         username=request.username,
         ip_address=client_ip,  # Используем реальный IP
         client_type=request.client_type,
         success=is_valid,
         reason=reason,
         user_agent=request.user_agent,
-        country=geo["country"],
-        city=geo["city"],
-        latitude=geo["latitude"],
-        longitude=geo["longitude"],
         attack_type=attack_type,
         threat_level=threat_level,
-        metadata={
-            "timestamp": datetime.now().isoformat(),
-            "client_info": {
-                "type": request.client_type,
-                "user_agent": request.user_agent,
-                "ip_address": client_ip
-            },
-            "geo": geo,
-            "attack_type": attack_type,
-            "threat_level": threat_level
-        }
     )
+    record.set_geo(geo, pending=geo_pending)
+    # Все правила обнаружения - по счётчикам в памяти, вместе с этой попыткой
+    matches = rules_engine.evaluate(record)
+    apply_rule_tags(record, matches)
+
+    # Сохраняем попытку в БД ПЕРЕД блокировкой
+    attempt_id = await attempt_writer.add_record(record)
     
-    print(f"   Попытка сохранена с ID: {attempt_id}")
+    log_event(logger, logging.DEBUG, "login_attempt", id=attempt_id, username=request.username,
+              ip=client_ip, success=is_valid, reason=reason)
+    if geo_pending and not geo_enricher.submit(attempt_id, client_ip):
+        log_event(logger, logging.INFO, "geo_queue_full", id=attempt_id, ip=client_ip)
     
-    # НОВОЕ: Если ошибка - считаем попытки (теперь включая текущую) и автоматически блокируем
-    if not is_valid:
-        failed_count_15min = db.get_failed_attempts_count(client_ip, minutes=15)
-        failed_count_60min = db.get_failed_attempts_count(client_ip, minutes=60)
-        
-        print(f"   ⚠️  Неудачных попыток за 15 мин: {failed_count_15min}, за 60 мин: {failed_count_60min}")
-        print(f"   📊 Проверка блокировки: success={is_valid}, reason={reason}")
-        
-        # Правило 1: 3 ошибки за 15 минут = 10 минут блокировки
-        if failed_count_15min >= 3:
-            db.add_ip_block(client_ip, reason="Слишком много неудачных попыток (3+ за 15 мин)", 
-                          duration_minutes=10, is_permanent=False)
-            print(f"   🚫 IP {client_ip} заблокирован на 10 минут (правило 1)")
-            # Отправляем событие о блокировке
-            await manager.broadcast({
-                "type": "ip_blocked",
-                "data": {"ip_address": client_ip, "reason": "3+ ошибки за 15 минут"},
-                "timestamp": datetime.now().isoformat()
-            })
-            return LoginResponse(
-                success=False,
-                message="⏱️ IP заблокирован на 10 минут из-за частых ошибок. Попробуйте позже."
-            )
-        
-        # Правило 2: 10 ошибок за 60 минут = 24 часа блокировки
-        if failed_count_60min >= 10:
-            db.add_ip_block(client_ip, reason="Слишком много неудачных попыток (10+ за час)", 
-                          duration_minutes=24*60, is_permanent=False)
-            print(f"   🚫 IP {client_ip} заблокирован на 24 часа (правило 2)")
-            # Отправляем событие о блокировке
-            await manager.broadcast({
-                "type": "ip_blocked",
-                "data": {"ip_address": client_ip, "reason": "10+ ошибок за час"},
-                "timestamp": datetime.now().isoformat()
-            })
-            return LoginResponse(
-                success=False,
-                message="⏱️ IP заблокирован на 24 часа из-за многочисленных ошибок."
-            )
-    
-    # Получаем полные данные о попытке
-    with sqlite3.connect(db.db_path) as conn:
-        cursor = conn.cursor()
-        cursor.execute('SELECT * FROM login_attempts WHERE id = ?', (attempt_id,))
-        row = cursor.fetchone()
-        
-        attempt_data = {}
-        if row:
-            columns = [desc[0] for desc in cursor.description]
-            attempt_data = dict(zip(columns, row))
-            attempt_data['success'] = bool(attempt_data['success'])
+    # Блокировки и оповещения сработавших правил
+    block_message, _ = await apply_rule_actions(matches)
+    if block_message is not None:
+        return LoginResponse(
+            success=False,
+            message=block_message
+        )
     
-    # Отправляем событие мониторам
-    await manager.broadcast({
-        "type": "login_attempt",
-        "data": attempt_data,
-        "timestamp": datetime.now().isoformat()
-    })
+    # Отправляем событие мониторам - из записи в памяти, без чтения из БД
+    await manager.broadcast_event("login_attempt", record.to_json())
     
     return LoginResponse(
         success=is_valid,
         message=message
     )
 
+# Пачка логинов (сенсоры, повтор журналов): не больше CYBER_VIS_LOGIN_BATCH_MAX
+# попыток в запросе, в событии мониторам - последние BATCH_BROADCAST_ATTEMPTS
+LOGIN_BATCH_MAX = env_int("CYBER_VIS_LOGIN_BATCH_MAX", 10000)
+# Размер тела пачки: больше - 413 до чтения (по Content-Length) или при чтении
+LOGIN_BATCH_MAX_BYTES = env_int("CYBER_VIS_LOGIN_BATCH_MAX_BYTES", 8 * 1024 * 1024)
+BATCH_BROADCAST_ATTEMPTS = 50
+
+async def read_login_batch(request: Request):
+    """Элементы пачки: JSON-массив или NDJSON (по строке на попытку).
+
+    Возвращает список dict или строк-ошибок (для нераспознанных строк NDJSON);
+    ValueError - тело не массив, OverflowError - больше LOGIN_BATCH_MAX элементов
+    или LOGIN_BATCH_MAX_BYTES байт.
+    """
+    too_many = f"В пачке не больше {LOGIN_BATCH_MAX} попыток"
+    content_type = request.headers.get("content-type", "")
+    if "ndjson" in content_type or "jsonl" in content_type:
+        items = []
+        async for line in iter_body_lines(request, max_bytes=LOGIN_BATCH_MAX_BYTES):
+            if not line.strip():
+                continue
+            if len(items) >= LOGIN_BATCH_MAX:
+                raise OverflowError(too_many)
+            try:
+                items.append(json.loads(line))
+            except ValueError as e:
+                items.append(f"Некорректный JSON: {e}")
+        return items
+    body = b"".join([chunk async for chunk in iter_body(request, max_bytes=LOGIN_BATCH_MAX_BYTES)])
+    try:
+        items = json.loads(body)
+    except ValueError as e:
+        raise ValueError(f"Некорректный JSON: {e}") from None
+    if not isinstance(items, list):
+        raise ValueError("Тело запроса должно быть JSON-массивом или NDJSON")
+    if len(items) > LOGIN_BATCH_MAX:
+        raise OverflowError(too_many)
+    return items
+
+def _batch_error(status_code: int, error: str):
+    return JSONResponse(status_code=status_code, content={
+        "success": False,
+        "error": error,
+        "timestamp": datetime.now().isoformat()
+    })
+
+@app.post("/api/auth/login/batch")
+async def login_batch(http_request: Request):
+    """Пачка попыток входа: JSON-массив LoginRequest или NDJSON.
+
+    Проверка паролей, правила блокировки и геолокация - для всей пачки сразу,
+    запись - одной транзакцией, мониторам - одно событие login_attempts_batch.
+    Результаты - по элементу на попытку в исходном порядке. Попытки после
+    блокировки IP (в том числе внутри пачки) не записываются, как и в /api/auth/login.
+    """
+    try:
+        raw_items = await read_login_batch(http_request)
+    except OverflowError as e:
+        return _batch_error(413, str(e))
+    except ValueError as e:
+        return _batch_error(400, str(e))
+
+    fallback_ip = get_client_ip(http_request)
+    results = [None] * len(raw_items)
+    items = []
+    for index, raw in enumerate(raw_items):
+        try:
+            if isinstance(raw, str):
+                raise ValueError(raw)
+            item = BatchLoginItem(**raw) if isinstance(raw, dict) else None
+            if item is None:
+                raise ValueError("Попытка должна быть JSON-объектом")
+        except ValidationError as e:
+            errors = "; ".join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors())
+            results[index] = {"success": False, "error": errors}
+            continue
+        except (ValueError, TypeError) as e:
+            results[index] = {"success": False, "error": str(e)}
+            continue
+        items.append((index, item, item.ip_address or fallback_ip))
+
+    # Заблокированные до пачки IP до проверки паролей не доходят
+    to_verify = []
+    for index, item, client_ip in items:
+        is_blocked, block_reason = db.is_ip_blocked(client_ip)
+        if is_blocked:
+            results[index] = {"success": False, "message": block_reason}
+        else:
+            to_verify.append((index, item, client_ip))
+
+    # Правила - по порядку пачки: счётчики правил учитывают попытки сразу,
+    # ошибки для классификации (ещё не записанные в БД) - по времени внутри пачки
+    now = datetime.now()
+    batch_failures = {}
+    batch_blocked = {}
+    recorded = []
+
+    def failures_before(client_ip, ts):
+        """Ошибки IP за 15 минут до попытки. Свежие - по общим счётчикам (в них
+        уже учтены предыдущие попытки пачки), старые (повтор журнала) - по пачке"""
+        if now.timestamp() - ts <= 900:
+            return db.get_failed_attempts_count(client_ip, minutes=15)
+        return sum(1 for failed_ts in batch_failures.get(client_ip, ()) if ts - 900 <= failed_ts <= ts)
+
+    def blocked_in_batch(index, client_ip) -> bool:
+        blocked_by = batch_blocked.get(client_ip) or batch_blocked.get(subnet_of(client_ip))
+        if blocked_by:
+            results[index] = {"success": False, "message": blocked_by}
+        return bool(blocked_by)
+
+    def evaluate_item(index, item, client_ip, is_valid):
+        attempt_time = item.attempt_time or now
+        if attempt_time.tzinfo is not None:
+            attempt_time = attempt_time.astimezone().replace(tzinfo=None)
+        # Часы сенсора могут немного спешить; дальше минуты - ошибка
+        if attempt_time > now + timedelta(minutes=1):
+            results[index] = {"success": False, "error": "attempt_time в будущем"}
+            return
+        attempt_time = min(attempt_time, now)
+        ts = attempt_time.timestamp()
+
+        if is_valid:
+            reason = "Успешная авторизация"
+            message = f"Добро пожаловать, {item.username}!"
+            attack_type, threat_level = classify_attempt(True, 0)
+        else:
+            reason = "Неверный пароль" if item.username in USERS else "Пользователь не найден"
+            message = "Неверный логин или пароль"
+            attack_type, threat_level = classify_attempt(False, failures_before(client_ip, ts))
+            batch_failures.setdefault(client_ip, []).append(ts)
+        record = AttemptRecord(
+            username=item.username,
+            ip_address=client_ip,
+            client_type=item.client_type,
+            success=is_valid,
+            reason=reason,
+            user_agent=item.user_agent,
+            attack_type=attack_type,
+            threat_level=threat_level,
+            attempt_time=attempt_time,
+        )
+        # Старые попытки из журнала правила учитывают, но не срабатывают на них
+        matches = rules_engine.evaluate(record, now=now.timestamp())
+        apply_rule_tags(record, matches)
+        block = first_rule_block(matches)
+        if block is not None:
+            batch_blocked[block.key] = message = block.rule.message
+        results[index] = {"success": is_valid, "message": message}
+        recorded.append((index, record, matches))
+
+    # Пароли - волнами (как в verify_many): попытки IP, заблокированного
+    # предыдущей волной, до scrypt не доходят. Места в очереди проверок
+    # заняты на всю пачку: VerifierBusy возможен только до первой волны,
+    # пока правила ещё ничего не учли (иначе повтор пачки клиентом
+    # посчитал бы попытки дважды)
+    wave = max(1, min(credential_verifier.workers * 2, credential_verifier.max_pending))
+    async with credential_verifier.reserve(min(wave, len(to_verify))):
+        for start in range(0, len(to_verify), wave):
+            chunk = [
+                (index, item, client_ip) for index, item, client_ip in to_verify[start:start + wave]
+                if not blocked_in_batch(index, client_ip)
+            ]
+            verdicts = await credential_verifier.verify_many(
+                [(item.username, item.password) for _, item, _ in chunk], reserved=True
+            )
+            for (index, item, client_ip), is_valid in zip(chunk, verdicts):
+                if not blocked_in_batch(index, client_ip):
+                    evaluate_item(index, item, client_ip, is_valid)
+
+    # Геолокация: из кэша; остальные IP - фоном после записи (или разом, без фона)
+    geo_by_ip = {}
+    for client_ip in {record.ip_address for _, record, _ in recorded}:
+        geo = peek_geo_by_ip(client_ip)
+        if geo is not None:
+            geo_by_ip[client_ip] = geo
+    missing = list(dict.fromkeys(
+        record.ip_address for _, record, _ in recorded if record.ip_address not in geo_by_ip
+    ))
+    if missing and not geo_enricher.running:
+        resolved = await asyncio.gather(*(asyncio.to_thread(get_geo_by_ip, ip) for ip in missing))
+        geo_by_ip.update(zip(missing, resolved))
+        missing = []
+    pending = set(missing)
+    records = []
+    for _, record, _ in recorded:
+        record.set_geo(geo_by_ip.get(record.ip_address), pending=record.ip_address in pending)
+        records.append(record)
+
+    # Без таймаута: повтор после таймаута записал бы пачку дважды
+    if records:
+        await adb.run(db.add_attempts, records, timeout=0)
+    for index, record, _ in recorded:
+        results[index]["id"] = record.id
+        if record.geo_pending and not geo_enricher.submit(record.id, record.ip_address):
+            log_event(logger, logging.INFO, "geo_queue_full", id=record.id, ip=record.ip_address)
+
+    # Блокировки и оповещения - одним событием вместе с попытками
+    blocked = []
+    alerts = []
+    for _, _, matches in recorded:
+        if matches:
+            _, events = await apply_rule_actions(matches, notify=False)
+            blocked.extend(event["data"] for event in events if event["type"] == "ip_blocked")
+            alerts.extend(event["data"] for event in events if event["type"] == "rule_alert")
+
+    successful = sum(1 for record in records if record.success)
+    log_event(logger, logging.INFO, "login_batch", items=len(raw_items), recorded=len(records),
+              successful=successful, blocked=len(blocked))
+    if records:
+        # Попытки - готовым JSON записей (to_json), остальные поля - рядом
+        attempts = ",".join(record.to_json() for record in records[-BATCH_BROADCAST_ATTEMPTS:])
+        summary = json.dumps({
+            "total": len(records),
+            "successful": successful,
+            "failed": len(records) - successful,
+            "blocked": blocked,
+            "alerts": alerts,
+        }, separators=(",", ":"), ensure_ascii=False)
+        await manager.broadcast_event("login_attempts_batch", f'{{"attempts":[{attempts}],{summary[1:]}')
+    return {
+        "success": True,
+        "data": {
+            "results": results,
+            "total": len(raw_items),
+            "recorded": len(records),
+            "blocked": len(blocked),
+        },
+        "timestamp": datetime.now().isoformat()
+    }
+
 @app.get("/api/stats")
-async def get_stats():
-    """Получить статистику"""
+async def get_stats(exact: bool = False):
+    """Получить статистику (exact=true - точный подсчёт по БД для сверки)"""
     return {
         "success": True,
-        "data": db.get_stats(),
+        "data": await adb.get_stats(exact=True) if exact else db.get_stats(),
         "timestamp": datetime.now().isoformat()
     }
 
-@app.get("/api/attempts")
-async def get_attempts(limit: int = 100):
-    """Получить историю попыток"""
-    attempts = db.get_recent_attempts(limit)
+@app.get("/api/auth/verifier")
+async def get_verifier_stats():
+    """Счётчики проверки паролей (очередь, объединённые и отклонённые проверки)"""
+    return {
+        "success": True,
+        "data": credential_verifier.stats(),
+        "timestamp": datetime.now().isoformat()
+    }
+
+@app.get("/api/rules")
+async def get_rules():
+    """Действующие правила обнаружения, их источник и счётчики окон"""
+    return {
+        "success": True,
+        "data": rules_engine.describe(),
+        "timestamp": datetime.now().isoformat()
+    }
+
+@app.get("/api/geo/cache")
+async def get_geo_cache_stats():
+    """Счётчики кэша геолокации (попадания, промахи, вытеснения) и клиента провайдера"""
+    return {
+        "success": True,
+        "data": {**geo_cache.stats(), "client": geo_client.stats()},
+        "timestamp": datetime.now().isoformat()
+    }
+
+# Фильтры и курсор для /api/attempts и /api/attack-map
+class AttemptQuery:
+    def __init__(
+        self,
+        username: Optional[str] = None,
+        ip_address: Optional[str] = None,
+        success: Optional[bool] = None,
+        attack_type: Optional[str] = None,
+        threat_level: Optional[str] = None,
+        country: Optional[str] = None,
+        from_: Optional[datetime] = Query(None, alias="from"),
+        to: Optional[datetime] = None,
+        cursor: Optional[str] = None,
+    ):
+        self.filters = {
+            "username": username,
+            "ip_address": ip_address,
+            "success": success,
+            "attack_type": attack_type,
+            "threat_level": threat_level,
+            "country": country,
+            "start": from_,
+            "end": to,
+        }
+        self.cursor = cursor
+
+def encode_cursor(key) -> str:
+    """Непрозрачный курсор на ключ (attempt_ts, id) последней строки страницы (last_key)"""
+    raw = json.dumps([int(key[0]), int(key[1])]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor: Optional[str]):
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        attempt_ts, attempt_id = json.loads(raw)
+        if not isinstance(attempt_ts, int) or not isinstance(attempt_id, int):
+            raise ValueError
+        return attempt_ts, attempt_id
+    except (ValueError, TypeError):
+        raise ValueError("Некорректный cursor")
+
+async def attempts_page(fetch, limit, include_archive, query: AttemptQuery):
+    """Страница попыток с курсором на следующую"""
+    try:
+        before = decode_cursor(query.cursor)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={
+            "success": False,
+            "error": str(e),
+            "timestamp": datetime.now().isoformat()
+        })
+    attempts = await fetch(limit, include_archive=include_archive, before=before, **query.filters)
     
     return {
         "success": True,
         "data": attempts,
         "count": len(attempts),
+        "next_cursor": encode_cursor(attempts.last_key) if attempts and len(attempts) >= limit else None,
         "timestamp": datetime.now().isoformat()
     }
 
+@app.get("/api/attempts")
+async def get_attempts(
+    limit: int = Query(100, ge=1, le=5000),
+    include_archive: bool = False,
+    query: AttemptQuery = Depends(),
+):
+    """Получить историю попыток (фильтры + пагинация курсором next_cursor)"""
+    return await attempts_page(adb.get_recent_attempts, limit, include_archive, query)
+
+# Колонки CSV-выгрузки попыток (порядок как в таблице login_attempts)
+EXPORT_COLUMNS = ATTEMPT_COLUMNS
+EXPORT_CHUNK_SIZE = 2000
+
+async def iter_export(start, end, export_format):
+    """Выгрузка порциями по ключу (attempt_ts, id) - память не растёт с объёмом"""
+    if export_format == "csv":
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(EXPORT_COLUMNS)
+        yield buffer.getvalue().encode("utf-8")
+    after = None
+    while True:
+        chunk = await adb.get_attempts_chunk(start, end, after, EXPORT_CHUNK_SIZE)
+        if not chunk:
+            return
+        if export_format == "csv":
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerows([attempt.get(column) for column in EXPORT_COLUMNS] for attempt in chunk)
+            yield buffer.getvalue().encode("utf-8")
+        else:
+            yield "".join(
+                json.dumps(attempt, ensure_ascii=False) + "\n" for attempt in chunk
+            ).encode("utf-8")
+        if len(chunk) < EXPORT_CHUNK_SIZE:
+            return
+        after = chunk.last_key
+
+@app.get("/api/attempts/export")
+async def export_attempts(
+    from_: Optional[datetime] = Query(None, alias="from"),
+    to: Optional[datetime] = None,
+    format: str = "ndjson",
+):
+    """Потоковая выгрузка попыток за период в NDJSON или CSV"""
+    if format not in ("ndjson", "csv"):
+        return JSONResponse(status_code=400, content={
+            "success": False,
+            "error": "format должен быть ndjson или csv",
+            "timestamp": datetime.now().isoformat()
+        })
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    filename = f"attempts-{datetime.now():%Y%m%d-%H%M%S}.{format}"
+    return StreamingResponse(
+        iter_export(from_, to, format),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
 @app.get("/api/attack-map")
-async def get_attack_map(limit: int = 200):
+async def get_attack_map(
+    limit: int = Query(200, ge=1, le=5000),
+    include_archive: bool = False,
+    query: AttemptQuery = Depends(),
+):
     """Получить попытки с координатами для карты атак"""
-    attempts = db.get_geo_attempts(limit)
+    return await attempts_page(adb.get_geo_attempts, limit, include_archive, query)
 
+@app.get("/api/top-attackers")
+async def get_top_attackers(
+    dimension: str = "ip",
+    window: str = "1h",
+    limit: int = Query(10, ge=1, le=100),
+):
+    """Топ источников неудачных попыток: ip / username / subnet / country"""
+    try:
+        data = db.get_top_attackers(dimension, window, limit)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={
+            "success": False,
+            "error": str(e),
+            "timestamp": datetime.now().isoformat()
+        })
+    
     return {
         "success": True,
-        "data": attempts,
-        "count": len(attempts),
+        "data": data,
         "timestamp": datetime.now().isoformat()
     }
 
@@ -441,47 +999,189 @@ async def get_blocked_ips():
         "timestamp": datetime.now().isoformat()
     }
 
+async def iter_body(request: Request, max_bytes=None):
+    """Тело запроса порциями по мере поступления.
+
+    OverflowError - тело больше max_bytes: по Content-Length ещё до чтения,
+    иначе как только прочитано больше.
+    """
+    too_large = f"Тело запроса больше {max_bytes} байт"
+    if max_bytes:
+        length = request.headers.get("content-length", "")
+        if length.isdigit() and int(length) > max_bytes:
+            raise OverflowError(too_large)
+    size = 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if max_bytes and size > max_bytes:
+            raise OverflowError(too_large)
+        yield chunk
+
+async def iter_body_lines(request: Request, max_bytes=None):
+    """Строки тела запроса по мере поступления (UTF-8, без BOM и CR в конце строки)"""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")(errors="replace")
+    tail = ""
+    async for chunk in iter_body(request, max_bytes):
+        lines = (tail + decoder.decode(chunk)).split("\n")
+        tail = lines.pop()
+        for line in lines:
+            yield line.rstrip("\r")
+    tail += decoder.decode(b"", final=True)
+    if tail:
+        yield tail.rstrip("\r")
+
+@app.post("/api/blocked-ips/import")
+async def import_blocked_ips(
+    request: Request,
+    format: Optional[str] = None,
+    reason: str = "Импорт списка блокировок",
+    duration_minutes: Optional[int] = Query(None, ge=1),
+):
+    """Импорт списка IP и подсетей (текст или CSV) одной транзакцией.
+
+    Без duration_minutes блокировки постоянные; в CSV колонки reason,
+    blocked_until и is_permanent переопределяют значения по умолчанию.
+    """
+    if format is None:
+        format = "csv" if "csv" in request.headers.get("content-type", "") else "text"
+    if format not in ("text", "csv"):
+        return JSONResponse(status_code=400, content={
+            "success": False,
+            "error": "format должен быть text или csv",
+            "timestamp": datetime.now().isoformat()
+        })
+    blocked_until = None
+    if duration_minutes:
+        blocked_until = (datetime.now() + timedelta(minutes=duration_minutes)).isoformat()
+    parser = BlocklistParser(format, reason=reason, blocked_until=blocked_until,
+                             is_permanent=duration_minutes is None)
+    try:
+        async for line in iter_body_lines(request):
+            parser.feed(line)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={
+            "success": False,
+            "error": str(e),
+            "timestamp": datetime.now().isoformat()
+        })
+    
+    imported = await adb.import_ip_blocks(list(parser.entries.values()))
+    log_event(logger, logging.INFO, "blocklist_imported", imported=imported, invalid=parser.invalid)
+    return {
+        "success": True,
+        "data": {
+            "imported": imported,
+            "invalid": parser.invalid,
+            "errors": parser.errors,
+        },
+        "timestamp": datetime.now().isoformat()
+    }
+
+def iter_blocklist(blocks, export_format):
+    """Выгрузка активных блокировок порциями по EXPORT_CHUNK_SIZE строк"""
+    if export_format == "csv":
+        yield (",".join(BLOCKLIST_COLUMNS) + "\r\n").encode("utf-8")
+    for start in range(0, len(blocks), EXPORT_CHUNK_SIZE):
+        chunk = blocks[start:start + EXPORT_CHUNK_SIZE]
+        if export_format == "csv":
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerows([block.get(column) for column in BLOCKLIST_COLUMNS] for block in chunk)
+            yield buffer.getvalue().encode("utf-8")
+        else:
+            yield "".join(block["ip_address"] + "\n" for block in chunk).encode("utf-8")
+
+@app.get("/api/blocked-ips/export")
+async def export_blocked_ips(format: str = "text"):
+    """Потоковая выгрузка активных блокировок: text (адрес на строку) или csv"""
+    if format not in ("text", "csv"):
+        return JSONResponse(status_code=400, content={
+            "success": False,
+            "error": "format должен быть text или csv",
+            "timestamp": datetime.now().isoformat()
+        })
+    media_type = "text/csv" if format == "csv" else "text/plain"
+    extension = "csv" if format == "csv" else "txt"
+    filename = f"blocked-ips-{datetime.now():%Y%m%d-%H%M%S}.{extension}"
+    return StreamingResponse(
+        iter_blocklist(db.get_blocked_ips(), format),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
 @app.get("/api/chart_data")
 async def get_chart_data():
     """Получить данные для графика - только успешные и неудачные попытки"""
-    # ИСПРАВЛЕНО: используем новое соединение вместо db.conn
-    with sqlite3.connect(db.db_path) as conn:
-        cursor = conn.cursor()
+    try:
+        # Получаем общее количество успешных и неудачных попыток
+        successful, failed = db.get_chart_totals()
         
-        try:
-            # Получаем общее количество успешных и неудачных попыток
-            cursor.execute('''
-                SELECT 
-                    COUNT(CASE WHEN success = 1 THEN 1 END) as successful,
-                    COUNT(CASE WHEN success = 0 THEN 1 END) as failed
-                FROM login_attempts
-            ''')
-            
-            row = cursor.fetchone()
-            successful = row[0] or 0
-            failed = row[1] or 0
-            
-            chart_data = {
-                "total": {
-                    "successful": successful,
-                    "failed": failed,
-                    "total": successful + failed
-                }
-            }
-            
-            return {
-                "success": True,
-                "data": chart_data,
-                "timestamp": datetime.now().isoformat()
-            }
-            
-        except Exception as e:
-            print(f"❌ Ошибка получения данных графика: {e}")
-            return {
-                "success": False,
-                "error": str(e),
-                "timestamp": datetime.now().isoformat()
+        chart_data = {
+            "total": {
+                "successful": successful,
+                "failed": failed,
+                "total": successful + failed
             }
+        }
+        
+        return {
+            "success": True,
+            "data": chart_data,
+            "timestamp": datetime.now().isoformat()
+        }
+        
+    except Exception as e:
+        log_event(logger, logging.ERROR, "chart_data_failed", error=e)
+        return {
+            "success": False,
+            "error": str(e),
+            "timestamp": datetime.now().isoformat()
+        }
+
+# Максимум точек в одном ответе /api/chart_data/timeseries
+MAX_TIMESERIES_POINTS = 5000
+
+@app.get("/api/chart_data/timeseries")
+async def get_chart_timeseries(
+    from_: Optional[datetime] = Query(None, alias="from"),
+    to: Optional[datetime] = None,
+    resolution: str = "hour",
+    split: str = "success",
+):
+    """Временной ряд попыток из агрегатов (success / attack_type / threat_level / country)"""
+    try:
+        step = TIMESERIES_RESOLUTIONS.get(resolution)
+        if step is None:
+            raise ValueError(
+                f"resolution должен быть одним из: {', '.join(TIMESERIES_RESOLUTIONS)}"
+            )
+        end = to or datetime.now()
+        start = from_ or end - timedelta(days=1)
+        if start >= end:
+            raise ValueError("from должен быть раньше to")
+        if (end - start).total_seconds() / step > MAX_TIMESERIES_POINTS:
+            raise ValueError(
+                f"Слишком много точек, увеличьте resolution (максимум {MAX_TIMESERIES_POINTS})"
+            )
+        points = await adb.get_timeseries(start, end, resolution=step, split=split)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={
+            "success": False,
+            "error": str(e),
+            "timestamp": datetime.now().isoformat()
+        })
+    
+    return {
+        "success": True,
+        "data": {
+            "resolution": resolution,
+            "split": split,
+            "from": start.isoformat(),
+            "to": end.isoformat(),
+            "points": points
+        },
+        "timestamp": datetime.now().isoformat()
+    }
 
 @app.websocket("/ws/monitor")
 async def websocket_monitor(websocket: WebSocket):
@@ -490,16 +1190,17 @@ async def websocket_monitor(websocket: WebSocket):
     
     try:
         # Отправляем начальные данные
+        stats = db.get_stats()
         await manager.send_personal_message({
             "type": "init",
             "data": {
-                "stats": db.get_stats(),
-                "recent_attempts": db.get_recent_attempts(20),
+                "stats": stats,
+                "recent_attempts": await adb.get_recent_attempts(20),
                 "chart_data": {
                     "total": {
-                        "successful": db.get_stats()["successful"],
-                        "failed": db.get_stats()["failed"],
-                        "total": db.get_stats()["total_attempts"]
+                        "successful": stats["successful"],
+                        "failed": stats["failed"],
+                        "total": stats["total_attempts"]
                     }
                 }
             },
@@ -551,10 +1252,19 @@ async def root():
         "version": "1.0",
         "endpoints": {
             "login": "POST /api/auth/login",
-            "stats": "GET /api/stats",
+            "stats": "GET /api/stats?exact=false",
             "attempts": "GET /api/attempts",
+            "attempts_export": "GET /api/attempts/export?from=&to=&format=ndjson|csv",
             "attack_map": "GET /api/attack-map",
+            "blocked_ips_import": "POST /api/blocked-ips/import?format=text|csv&duration_minutes=",
+            "blocked_ips_export": "GET /api/blocked-ips/export?format=text|csv",
+            "geo_cache": "GET /api/geo/cache",
+            "auth_verifier": "GET /api/auth/verifier",
+            "rules": "GET /api/rules",
+            "login_batch": "POST /api/auth/login/batch (JSON array or NDJSON)",
+            "top_attackers": "GET /api/top-attackers?dimension=ip|username|subnet|country&window=10m|1h|24h|all",
             "chart_data": "GET /api/chart_data",
+            "chart_timeseries": "GET /api/chart_data/timeseries?from=&to=&resolution=&split=",
             "websocket": "WS /ws/monitor"
         },
         "demo_users": list(RAW_USERS.keys())
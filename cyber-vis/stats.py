@@ -0,0 +1,190 @@
+"""
+Инкрементальная статистика попыток входа
+"""
+import threading
+import time
+from datetime import datetime
+
+from hll import CardinalityTracker
+
+
+class StatsEngine:
+    """Счётчики, обновляемые на каждой записи попытки.
+
+    Держит общие итоги, HyperLogLog-оценки уникальных пользователей и IP
+    и кольцо поминутных корзин на последний час - get_stats() не обращается
+    к БД и не зависит от размера таблицы. Скетчи уникальных периодически
+    сохраняются в cardinality_sketches (см. checkpoint.py), last_id - ID
+    последней учтённой попытки.
+    """
+
+    WINDOWS = (10, 30, 60)
+
+    def __init__(self, ring_minutes=60, precision=12):
+        self.ring_minutes = ring_minutes
+        self.precision = precision
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.total = 0
+            self.successful = 0
+            self.failed = 0
+            self.unique = CardinalityTracker(self.precision)
+            self.last_id = 0
+            self._bucket_minute = [-1] * self.ring_minutes
+            self._bucket_count = [0] * self.ring_minutes
+
+    @staticmethod
+    def _minute(ts=None) -> int:
+        return int((time.time() if ts is None else ts) // 60)
+
+    def _add_to_bucket(self, minute, count=1):
+        idx = minute % self.ring_minutes
+        if self._bucket_minute[idx] > minute:
+            return  # Корзина уже занята более поздней минутой
+        if self._bucket_minute[idx] != minute:
+            self._bucket_minute[idx] = minute
+            self._bucket_count[idx] = 0
+        self._bucket_count[idx] += count
+
+    def record(self, username, ip_address, success, ts=None):
+        """Учесть одну записанную попытку"""
+        ts = time.time() if ts is None else ts
+        minute = self._minute(ts)
+        with self._lock:
+            self.total += 1
+            if success:
+                self.successful += 1
+            else:
+                self.failed += 1
+            self.unique.record(username, ip_address, ts)
+            self._add_to_bucket(minute)
+
+    def record_many(self, attempts, ts=None, last_id=None):
+        """Учесть пачку попыток (AttemptRecord)"""
+        for attempt in attempts:
+            attempt_time = attempt.attempt_time
+            self.record(
+                attempt.username, attempt.ip_address, attempt.success,
+                ts if ts is not None or attempt_time is None else attempt_time.timestamp(),
+            )
+        if last_id is not None:
+            with self._lock:
+                self.last_id = max(self.last_id, last_id)
+
+    def window_count(self, minutes, now=None) -> int:
+        """Попытки за последние N минут (с точностью до минуты)"""
+        current = self._minute(now)
+        oldest = current - min(minutes, self.ring_minutes) + 1
+        with self._lock:
+            return sum(
+                count
+                for minute, count in zip(self._bucket_minute, self._bucket_count)
+                if oldest <= minute <= current
+            )
+
+    def snapshot(self) -> dict:
+        """Статистика в формате LoginDatabase.get_stats()"""
+        now = time.time()
+        with self._lock:
+            stats = {
+                'total_attempts': self.total,
+                'successful': self.successful,
+                'failed': self.failed,
+                'unique_users': self.unique.estimate("username", "all", now),
+                'unique_ips': self.unique.estimate("ip", "all", now),
+                'unique_users_last_hour': self.unique.estimate("username", "hour", now),
+                'unique_ips_last_hour': self.unique.estimate("ip", "hour", now),
+                'unique_users_last_day': self.unique.estimate("username", "day", now),
+                'unique_ips_last_day': self.unique.estimate("ip", "day", now),
+                'unique_error': round(self.unique.error, 4),
+            }
+        stats['last_hour'] = self.window_count(60, now)
+        stats['last_30_min'] = self.window_count(30, now)
+        stats['last_10_min'] = self.window_count(10, now)
+        stats['timestamp'] = datetime.now().isoformat()
+        return stats
+
+    def sketch_rows(self):
+        """Скетчи уникальных для сохранения и ID последней учтённой попытки"""
+        with self._lock:
+            return self.unique.rows(), self.last_id
+
+    def seed(self, conn, archive=None):
+        """Однократно заполнить счётчики из БД (при старте).
+
+        archive - AttemptArchive: при первом заполнении уникальные за всё
+        время учитывают и перенесённые в архив попытки
+        """
+        cursor = conn.cursor()
+        # Итоги берём из часовых агрегатов: они переживают архивацию строк
+        cursor.execute('''
+            SELECT
+                SUM(attempts),
+                SUM(CASE WHEN success = 1 THEN attempts ELSE 0 END),
+                SUM(CASE WHEN success = 0 THEN attempts ELSE 0 END)
+            FROM attempt_rollups
+            WHERE resolution = 3600
+        ''')
+        total, successful, failed = cursor.fetchone()
+
+        # Поминутные корзины последнего часа (attempt_ts - микросекунды Unix-времени)
+        since_us = int((time.time() - self.ring_minutes * 60) * 1_000_000)
+        cursor.execute('''
+            SELECT attempt_ts / 60000000 AS minute, COUNT(*)
+            FROM login_attempts
+            WHERE attempt_ts > ?
+            GROUP BY minute
+        ''', (since_us,))
+        buckets = cursor.fetchall()
+
+        self.reset()
+        with self._lock:
+            self.total = total or 0
+            self.successful = successful or 0
+            self.failed = failed or 0
+            for minute, count in buckets:
+                self._add_to_bucket(minute, count)
+            self._seed_unique(cursor, archive)
+
+    def _seed_unique(self, cursor, archive=None):
+        """Скетчи уникальных: сохранённые + попытки после них, иначе - проход по таблице"""
+        cursor.execute('''
+            SELECT dimension, span, slot, precision, registers, last_id
+            FROM cardinality_sketches
+        ''')
+        saved = cursor.fetchall()
+        if saved and self.unique.load([row[:5] for row in saved]):
+            # HLL идемпотентен: повторно учтённая попытка оценку не меняет
+            self.last_id = min(row[5] for row in saved)
+            cursor.execute('''
+                SELECT username, ip_address, attempt_ts FROM login_attempts WHERE id > ?
+            ''', (self.last_id,))
+            for username, ip_address, attempt_ts in cursor:
+                self.unique.record(username, ip_address, attempt_ts / 1_000_000)
+        else:
+            # Первый запуск (или сменилась точность): за всё время - по DISTINCT
+            # таблицы и архива, окна - по попыткам последних суток
+            self.unique.reset()
+            if archive is not None:
+                archived = archive.totals()
+                for username in archived["usernames"]:
+                    self.unique.record_all_time(username, None)
+                for ip_address in archived["ips"]:
+                    self.unique.record_all_time(None, ip_address)
+            cursor.execute('SELECT DISTINCT username FROM login_attempts')
+            for (username,) in cursor:
+                self.unique.record_all_time(username, None)
+            cursor.execute('SELECT DISTINCT ip_address FROM login_attempts WHERE ip_address IS NOT NULL')
+            for (ip_address,) in cursor:
+                self.unique.record_all_time(None, ip_address)
+            since_us = int((time.time() - 86400) * 1_000_000)
+            cursor.execute('''
+                SELECT username, ip_address, attempt_ts FROM login_attempts WHERE attempt_ts > ?
+            ''', (since_us,))
+            for username, ip_address, attempt_ts in cursor:
+                self.unique.record(username, ip_address, attempt_ts / 1_000_000)
+        cursor.execute('SELECT COALESCE(MAX(id), 0) FROM login_attempts')
+        self.last_id = max(self.last_id, cursor.fetchone()[0])
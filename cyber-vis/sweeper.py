@@ -0,0 +1,56 @@
+"""
+Фоновое снятие истёкших блокировок IP
+"""
+import asyncio
+import logging
+from datetime import datetime
+
+from database import db, env_int
+from logs import log_event
+
+logger = logging.getLogger("cyber_vis.sweeper")
+
+
+class BlockSweeper:
+    """Ждёт ближайшего срока из кучи блокировок и удаляет истёкшие пачкой.
+
+    Спит не дольше max_sleep секунд, чтобы подхватывать новые блокировки
+    с более ранним сроком.
+    """
+
+    def __init__(self, database, max_sleep=None):
+        self.db = database
+        self.max_sleep = max_sleep or env_int("CYBER_VIS_BLOCK_SWEEP_S", 5)
+        self._task = None
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="block-sweeper")
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self):
+        while True:
+            delay = self.max_sleep
+            next_expiry = self.db.blocks.next_expiry()
+            if next_expiry is not None:
+                delay = min(delay, max(0.0, (next_expiry - datetime.now()).total_seconds()))
+            await asyncio.sleep(delay)
+            try:
+                removed = await asyncio.to_thread(self.db.sweep_expired_blocks)
+                if removed:
+                    log_event(logger, logging.INFO, "blocks_expired", removed=removed)
+            except Exception as e:
+                log_event(logger, logging.ERROR, "blocks_sweep_failed", error=e)
+
+
+# Глобальный обработчик истёкших блокировок
+block_sweeper = BlockSweeper(db)
@@ -0,0 +1,39 @@
+import os
+import time
+
+import pytest
+
+# server создаёт LoginDatabase() при импорте - не трогаем рабочую БД
+os.environ.setdefault("CYBER_VIS_DB_PATH", ":memory:")
+os.environ.setdefault("CYBER_VIS_KDF_WORKERS", "1")
+
+from database import LoginDatabase
+
+
+@pytest.fixture
+def db(tmp_path):
+    """Открытая БД во временном каталоге"""
+    database = LoginDatabase(str(tmp_path / "login_attempts.db"), readers=1)
+    database.open()
+    yield database
+    database.close()
+
+
+@pytest.fixture
+def client():
+    """Запущенный сервер (startup/shutdown); БД в памяти - новая на каждый тест"""
+    from fastapi.testclient import TestClient
+
+    import server
+    with TestClient(server.app) as test_client:
+        yield test_client
+
+
+@pytest.fixture
+def berlin_tz(monkeypatch):
+    """Локальное время с переводом часов (Europe/Berlin)"""
+    monkeypatch.setenv("TZ", "Europe/Berlin")
+    time.tzset()
+    yield
+    monkeypatch.undo()
+    time.tzset()
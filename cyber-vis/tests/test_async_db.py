@@ -0,0 +1,68 @@
+import asyncio
+import threading
+
+import pytest
+
+from async_db import AsyncLoginDatabase, DatabaseTimeout
+
+
+class _Database:
+    reader_count = 1
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.calls = 0
+
+    def slow(self):
+        self.release.wait(5)
+        self.calls += 1
+        return "done"
+
+    def add(self, a, b=0):
+        return a + b
+
+
+def test_methods_run_in_pool_with_timeout():
+    database = _Database()
+    adb = AsyncLoginDatabase(database, max_workers=2, max_pending=4, timeout=0.05)
+
+    async def scenario():
+        assert await adb.add(2, b=3) == 5
+        assert threading.current_thread() is threading.main_thread()
+        with pytest.raises(DatabaseTimeout):
+            await adb.slow()
+        # Поток продолжает работу после таймаута, слот занят до его конца
+        database.release.set()
+        assert await adb.slow(timeout=1) == "done"
+        assert await adb.run(database.add, 1, timeout=0) == 1
+
+    try:
+        asyncio.run(scenario())
+    finally:
+        adb.close()
+    assert database.calls == 2
+
+
+def test_pending_calls_are_bounded():
+    database = _Database()
+    adb = AsyncLoginDatabase(database, max_workers=1, max_pending=2, timeout=5)
+
+    async def scenario():
+        calls = [asyncio.ensure_future(adb.slow()) for _ in range(3)]
+        await asyncio.sleep(0.05)
+        # Третий вызов ждёт слота, а не попадает в очередь пула
+        assert adb._executor._work_queue.qsize() == 1
+        database.release.set()
+        return await asyncio.gather(*calls)
+
+    try:
+        assert asyncio.run(scenario()) == ["done"] * 3
+    finally:
+        adb.close()
+
+
+def test_restart_after_close():
+    adb = AsyncLoginDatabase(_Database(), max_workers=1, max_pending=1)
+    for _ in range(2):
+        assert asyncio.run(adb.add(1, 1)) == 2
+        adb.close()
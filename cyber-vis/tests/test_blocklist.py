@@ -0,0 +1,45 @@
+import csv
+import io
+
+import pytest
+
+import server
+from blocks import BlocklistParser
+
+
+def test_parser_collapses_duplicates_and_counts_errors():
+    parser = BlocklistParser("text", reason="list", is_permanent=True)
+    for line in ["10.0.0.1  # сканер", "# комментарий", "", "10.0.0.0/24", "not-an-ip", "10.0.0.1"]:
+        parser.feed(line)
+    assert sorted(parser.entries) == ["10.0.0.0/24", "10.0.0.1"]
+    assert parser.invalid == 1 and parser.errors[0]["line"] == 5
+
+
+def test_csv_parser_requires_ip_column():
+    with pytest.raises(ValueError):
+        BlocklistParser("csv").feed("address,reason")
+
+
+def test_import_then_export_round_trip(client):
+    body = "10.30.0.1\n10.30.1.0/24 # подсеть\nbad\n"
+    response = client.post("/api/blocked-ips/import", content=body.encode(),
+                           params={"duration_minutes": 30})
+    data = response.json()["data"]
+    assert (data["imported"], data["invalid"]) == (2, 1)
+    assert server.db.is_ip_blocked("10.30.1.77")[0]
+
+    csv_body = "ip_address,reason,is_permanent\n10.31.0.1,вручную,1\n"
+    response = client.post("/api/blocked-ips/import", content=csv_body.encode("utf-8"),
+                           headers={"Content-Type": "text/csv"})
+    assert response.json()["data"]["imported"] == 1
+
+    exported = client.get("/api/blocked-ips/export").text.split()
+    assert {"10.30.0.1", "10.30.1.0/24", "10.31.0.1"} <= set(exported)
+    rows = list(csv.DictReader(io.StringIO(client.get("/api/blocked-ips/export", params={"format": "csv"}).text)))
+    by_ip = {row["ip_address"]: row for row in rows}
+    assert by_ip["10.31.0.1"]["reason"] == "вручную" and by_ip["10.31.0.1"]["is_permanent"] == "1"
+    assert by_ip["10.30.0.1"]["blocked_until"]
+
+
+def test_import_rejects_unknown_format(client):
+    assert client.post("/api/blocked-ips/import", content=b"10.0.0.1", params={"format": "xml"}).status_code == 400
@@ -0,0 +1,109 @@
+import ipaddress
+import random
+from datetime import datetime, timedelta
+
+from blocks import BlockRegistry, PrefixTrie
+
+
+def _covering(networks, address):
+    """Эталон: все сети, содержащие адрес, от самой узкой"""
+    found = [network for network in networks if address in network]
+    return [str(network) for network in sorted(found, key=lambda network: -network.prefixlen)]
+
+
+def test_trie_lookup_returns_all_covering_prefixes_longest_first():
+    trie = PrefixTrie(32)
+    networks = [ipaddress.ip_network(value) for value in (
+        "0.0.0.0/0", "10.0.0.0/8", "10.1.0.0/16", "10.1.2.0/24", "10.1.2.128/25",
+        "10.1.2.200/32", "192.168.0.0/16", "192.168.1.0/24",
+    )]
+    for network in networks:
+        trie.insert(int(network.network_address), network.prefixlen, str(network))
+    assert trie.size == len(networks)
+
+    for value in ("10.1.2.200", "10.1.2.5", "10.9.9.9", "192.168.1.1", "8.8.8.8"):
+        address = ipaddress.ip_address(value)
+        assert trie.lookup(int(address)) == _covering(networks, address)
+
+
+def test_trie_matches_brute_force_after_removals():
+    rng = random.Random(7)
+    trie = PrefixTrie(32)
+    networks = set()
+    for _ in range(300):
+        length = rng.randint(8, 32)
+        network = ipaddress.ip_network((rng.getrandbits(32), length), strict=False)
+        networks.add(network)
+        trie.insert(int(network.network_address), network.prefixlen, str(network))
+    removed = set(rng.sample(sorted(networks, key=str), 100))
+    for network in removed:
+        trie.remove(int(network.network_address), network.prefixlen)
+    networks -= removed
+    assert trie.size == len(networks)
+
+    probes = [network.network_address for network in networks]
+    probes += [ipaddress.ip_address(rng.getrandbits(32)) for _ in range(300)]
+    for address in probes:
+        assert trie.lookup(int(address)) == _covering(networks, address)
+
+
+def test_trie_insert_replaces_key_and_remove_is_idempotent():
+    trie = PrefixTrie(128)
+    network = ipaddress.ip_network("2001:db8::/32")
+    trie.insert(int(network.network_address), 32, "old")
+    trie.insert(int(network.network_address), 32, "new")
+    assert trie.size == 1
+    assert trie.lookup(int(ipaddress.ip_address("2001:db8::1"))) == ["new"]
+
+    trie.remove(int(network.network_address), 32)
+    trie.remove(int(network.network_address), 32)
+    assert trie.size == 0
+    assert trie.lookup(int(ipaddress.ip_address("2001:db8::1"))) == []
+
+
+def test_registry_checks_ip_and_subnet_blocks():
+    now = datetime(2025, 1, 1, 12, 0)
+    registry = BlockRegistry()
+    registry.load([
+        {"ip_address": "10.0.0.0/8", "reason": "сеть", "blocked_until": None, "is_permanent": True},
+        {"ip_address": "192.168.1.0/24", "reason": "скан", "is_permanent": False,
+         "blocked_until": (now + timedelta(minutes=30)).isoformat()},
+    ])
+    registry.add({"ip_address": "1.2.3.4", "reason": "перебор", "is_permanent": False,
+                  "blocked_until": now + timedelta(minutes=10)})
+
+    assert registry.check("10.20.30.40", now)[0]
+    assert registry.check("192.168.1.77", now)[0]
+    assert registry.check("1.2.3.4", now)[0]
+    assert registry.check("1.2.3.5", now) == (False, None)
+    assert registry.blocked_in_subnet("1.2.3.99", now) == 1
+
+    later = now + timedelta(minutes=20)
+    assert registry.pop_expired(later) == [("1.2.3.4", now + timedelta(minutes=10))]
+    assert registry.check("1.2.3.4", later) == (False, None)
+    assert registry.check("192.168.1.77", later)[0]
+    assert registry.check("192.168.1.77", now + timedelta(minutes=31)) == (False, None)
+
+
+def test_extended_block_outlives_its_stale_heap_entry():
+    now = datetime(2025, 1, 1, 12, 0)
+    registry = BlockRegistry()
+    registry.add({"ip_address": "1.2.3.4", "reason": "перебор", "is_permanent": False,
+                  "blocked_until": now + timedelta(minutes=5)})
+    registry.add({"ip_address": "1.2.3.4", "reason": "снова", "is_permanent": False,
+                  "blocked_until": now + timedelta(minutes=60)})
+    assert registry.next_expiry() == now + timedelta(minutes=5)
+    assert registry.pop_expired(now + timedelta(minutes=10)) == []
+    blocked, reason = registry.check("1.2.3.4", now + timedelta(minutes=10))
+    assert blocked and reason.endswith("снова")
+    assert registry.next_expiry() == now + timedelta(minutes=60)
+
+
+def test_sweep_removes_expired_rows(db):
+    db.add_ip_block("1.2.3.4", "перебор", duration_minutes=1)
+    db.add_ip_block("1.2.3.5", "навсегда", is_permanent=True)
+    assert db.sweep_expired_blocks(now=datetime.now()) == 0
+    assert db.sweep_expired_blocks(now=datetime.now() + timedelta(minutes=2)) == 1
+    rows = [row[0] for row in db._writer.execute("SELECT ip_address FROM ip_blocks")]
+    assert rows == ["1.2.3.5"]
+    assert [block["ip_address"] for block in db.get_blocked_ips()] == ["1.2.3.5"]
@@ -0,0 +1,88 @@
+import asyncio
+
+import pytest
+
+from credentials import CredentialVerifier, VerifierBusy, hash_password, verify_password
+
+
+def test_hash_and_verify():
+    encoded = hash_password("secret")
+    assert encoded.startswith("scrypt$")
+    assert encoded != hash_password("secret")  # соль случайная
+    assert verify_password("secret", encoded)
+    assert not verify_password("Secret", encoded)
+    assert not verify_password("secret", "md5$abc")
+    assert not verify_password("secret", "garbage")
+
+
+def test_pool_verifies_coalesces_and_caches_failures():
+    users = {"admin": hash_password("admin123")}
+
+    async def scenario():
+        verifier = CredentialVerifier(users, workers=1, max_pending=8, negative_ttl=60)
+        try:
+            results = await verifier.verify_many([
+                ("admin", "admin123"), ("admin", "wrong"), ("ghost", "admin123"),
+                ("admin", "admin123"), ("admin", "wrong"),
+            ])
+            # Одинаковые пары в пачке проверяются один раз
+            assert verifier.verified == 3
+            # Повтор неверной пары - из кэша, без scrypt
+            assert not await verifier.verify("admin", "wrong")
+            assert not await verifier.verify("ghost", "admin123")
+            # Одновременные одинаковые проверки делят одну
+            same = await asyncio.gather(*(verifier.verify("admin", "admin123") for _ in range(3)))
+            return results, same, verifier.stats()
+        finally:
+            await verifier.stop()
+
+    results, same, stats = asyncio.run(scenario())
+    assert results == [True, False, False, True, False]
+    assert same == [True, True, True]
+    assert stats["negative_hits"] == 2
+    assert stats["coalesced"] == 2
+    assert stats["verified"] == 4
+    assert stats["pending"] == 0
+
+
+def test_pool_rejects_over_max_pending():
+    users = {"admin": hash_password("admin123")}
+
+    async def scenario():
+        verifier = CredentialVerifier(users, workers=1, max_pending=1)
+        try:
+            await verifier.start()
+            first = asyncio.ensure_future(verifier.verify("admin", "one"))
+            await asyncio.sleep(0)
+            with pytest.raises(VerifierBusy):
+                await verifier.verify("admin", "two")
+            assert not await first
+            return verifier.stats()
+        finally:
+            await verifier.stop()
+
+    stats = asyncio.run(scenario())
+    assert stats["rejected"] == 1
+
+
+def test_reserved_slots_are_not_taken_by_others():
+    users = {"admin": hash_password("admin123")}
+
+    async def scenario():
+        verifier = CredentialVerifier(users, workers=1, max_pending=2)
+        try:
+            async with verifier.reserve(2):
+                with pytest.raises(VerifierBusy):
+                    async with verifier.reserve(1):
+                        pass
+                with pytest.raises(VerifierBusy):
+                    await verifier.verify("admin", "other")
+                assert await verifier.verify_many([("admin", "admin123"), ("admin", "x")], reserved=True) == [
+                    True, False,
+                ]
+            assert verifier.stats()["reserved"] == 0
+            assert await verifier.verify("admin", "admin123")
+        finally:
+            await verifier.stop()
+
+    asyncio.run(scenario())
@@ -0,0 +1,83 @@
+import random
+from datetime import datetime
+
+import pytest
+
+from records import AttemptRecord
+from server import decode_cursor, encode_cursor
+
+# 2025-10-26 01:00 UTC: в Берлине 03:00 CEST -> 02:00 CET, час 02:xx повторяется
+FALL_BACK = 1761440400
+
+
+def test_cursor_round_trip():
+    for key in [(0, 1), (1761440400123456, 42), (2 ** 62, 2 ** 40)]:
+        cursor = encode_cursor(key)
+        assert "=" not in cursor
+        assert decode_cursor(cursor) == key
+    assert decode_cursor(None) is None
+    assert decode_cursor("") is None
+
+
+@pytest.mark.parametrize("cursor", ["!!!", "bm90IGpzb24", encode_cursor((1, 2))[:-2], "WyJhIiwgMV0"])
+def test_cursor_rejects_garbage(cursor):
+    with pytest.raises(ValueError):
+        decode_cursor(cursor)
+
+
+def _dst_attempts():
+    """Попытки каждые 5 минут вокруг перевода часов, вставленные вперемешку,
+    плюс по две попытки на некоторые моменты времени"""
+    moments = [FALL_BACK + offset for offset in range(-3600, 3600, 300)]
+    moments += moments[::4]
+    random.Random(3).shuffle(moments)
+    return [
+        AttemptRecord(f"user-{index}", "10.0.0.1", "web", False, attempt_time=datetime.fromtimestamp(ts))
+        for index, ts in enumerate(moments)
+    ]
+
+
+def test_keyset_pages_across_dst(db, berlin_tz):
+    attempts = _dst_attempts()
+    db.add_attempts(attempts)
+    # Одно и то же локальное время до и после перевода часов
+    moments = {attempt.attempt_time.timestamp() for attempt in attempts}
+    assert len({datetime.fromtimestamp(ts).replace(fold=0) for ts in moments}) < len(moments)
+    expected = sorted(attempts, key=lambda attempt: (attempt.attempt_time.timestamp(), attempt.id))
+
+    seen = []
+    before = None
+    while True:
+        page = db.get_recent_attempts(limit=7, before=before)
+        if not page:
+            assert page.last_key is None
+            break
+        seen.extend(attempt["id"] for attempt in page)
+        before = decode_cursor(encode_cursor(page.last_key))
+    assert seen == [attempt.id for attempt in reversed(expected)]
+
+    seen = []
+    after = None
+    while True:
+        chunk = db.get_attempts_chunk(after=after, chunk_size=5)
+        if not chunk:
+            break
+        seen.extend(attempt["id"] for attempt in chunk)
+        after = decode_cursor(encode_cursor(chunk.last_key))
+    assert seen == [attempt.id for attempt in expected]
+
+
+def test_time_range_across_dst(db, berlin_tz):
+    attempts = _dst_attempts()
+    db.add_attempts(attempts)
+    # Второй проход часа 02:xx (fold=1) - после перевода часов
+    start = datetime.fromtimestamp(FALL_BACK)
+    assert start.fold == 1
+    end = datetime.fromtimestamp(FALL_BACK + 1800)
+
+    page = db.get_recent_attempts(limit=100, start=start, end=end)
+    expected = [attempt for attempt in attempts if FALL_BACK <= attempt.attempt_time.timestamp() < FALL_BACK + 1800]
+    assert sorted(attempt["id"] for attempt in page) == sorted(attempt.id for attempt in expected)
+
+    chunk = db.get_attempts_chunk(start=start, end=end, chunk_size=100)
+    assert [attempt["id"] for attempt in chunk] == [attempt["id"] for attempt in reversed(page)]
@@ -0,0 +1,62 @@
+import threading
+
+from database import LoginDatabase
+from records import AttemptRecord
+
+
+def test_connections_use_wal_and_read_only_readers(db):
+    assert db._writer.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    with db._read() as conn:
+        assert conn.execute("PRAGMA query_only").fetchone()[0] == 1
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+
+def test_readers_are_reused_and_not_blocked_by_writer(tmp_path):
+    database = LoginDatabase(str(tmp_path / "pool.db"), readers=2)
+    database.open()
+    try:
+        database.add_attempts([AttemptRecord("admin", "10.0.0.1", "web", False)])
+        with database._read() as first:
+            pass
+        with database._read() as second:
+            assert second is first  # соединение вернулось в пул
+        # Открытая транзакция писателя не мешает читателям (WAL)
+        with database._write() as conn:
+            conn.execute("DELETE FROM login_attempts")
+            seen = []
+            reader = threading.Thread(target=lambda: seen.append(len(database.get_recent_attempts())))
+            reader.start()
+            reader.join(5)
+        assert seen == [1]
+        assert database.get_recent_attempts() == []
+    finally:
+        database.close()
+
+
+def test_open_close_and_reopen(tmp_path):
+    database = LoginDatabase(str(tmp_path / "reopen.db"), readers=1)
+    assert not database.is_open
+    database.open()
+    database.open()  # повторный open ничего не делает
+    assert database._readers.qsize() == 1
+    database.add_attempts([AttemptRecord("admin", "10.0.0.1", "web", True)])
+    database.close()
+    assert not database.is_open and database._readers.empty()
+
+    database.open()
+    try:
+        assert [attempt["username"] for attempt in database.get_recent_attempts()] == ["admin"]
+        assert database.get_stats()["successful"] == 1
+    finally:
+        database.close()
+
+
+def test_memory_database_shares_the_writer():
+    database = LoginDatabase(":memory:")
+    database.open()
+    try:
+        database.add_attempts([AttemptRecord("admin", "10.0.0.1", "web", False)])
+        assert len(database.get_recent_attempts()) == 1
+        assert database._readers.empty()
+    finally:
+        database.close()
@@ -0,0 +1,73 @@
+import asyncio
+import threading
+
+from enrich import GeoEnricher
+from geo import GeoUnavailable
+from records import AttemptRecord
+
+BERLIN = {"country": "Germany", "city": "Berlin", "latitude": 52.52, "longitude": 13.4}
+
+
+def _add(db, ip, count):
+    return db.add_attempts([AttemptRecord("admin", ip, "web", False) for _ in range(count)])
+
+
+def test_attempts_of_one_ip_share_a_lookup(db):
+    first, second = _add(db, "5.0.0.1", 2), _add(db, "5.0.0.2", 1)
+    release = threading.Event()
+    calls = []
+
+    def resolve(ip_address):
+        calls.append(ip_address)
+        release.wait(5)
+        return BERLIN if ip_address == "5.0.0.1" else None
+
+    async def scenario():
+        events = []
+
+        async def on_enriched(ids, geo):
+            events.append((sorted(ids), geo["country"]))
+
+        enricher = GeoEnricher(db, resolve, on_enriched, workers=1, max_queue=10)
+        await enricher.start()
+        for attempt_id in first:
+            assert enricher.submit(attempt_id, "5.0.0.1")
+        enricher.submit(second[0], "5.0.0.2")
+        # Пока идёт запрос, новые попытки того же IP дописываются к ожидающим
+        late = _add(db, "5.0.0.1", 1)
+        await asyncio.sleep(0.05)
+        enricher.submit(late[0], "5.0.0.1")
+        release.set()
+        await enricher.stop()
+        return events, first + late
+
+    events, ids = asyncio.run(scenario())
+    assert calls.count("5.0.0.1") == 1
+    assert events == [(sorted(ids), "Germany")]
+    countries = {attempt["ip_address"]: attempt["country"] for attempt in db.get_recent_attempts()}
+    assert countries == {"5.0.0.1": "Germany", "5.0.0.2": None}
+
+
+def test_outage_is_retried_then_given_up(db):
+    ids = _add(db, "5.0.0.3", 1)
+    answers = [GeoUnavailable("timeout"), BERLIN]
+
+    def resolve(ip_address):
+        answer = answers.pop(0) if answers else GeoUnavailable("down")
+        if isinstance(answer, Exception):
+            raise answer
+        return answer
+
+    async def scenario(max_retries):
+        enricher = GeoEnricher(db, resolve, workers=1, retry_delay=0, max_retries=max_retries)
+        await enricher.start()
+        enricher.submit(ids[0], "5.0.0.3")
+        for _ in range(20):
+            await asyncio.sleep(0.01)
+        await enricher.stop()
+
+    asyncio.run(scenario(max_retries=0))
+    assert db.get_recent_attempts()[0]["country"] is None
+    answers[:] = [GeoUnavailable("timeout"), BERLIN]
+    asyncio.run(scenario(max_retries=1))
+    assert db.get_recent_attempts()[0]["country"] == "Germany"
@@ -0,0 +1,47 @@
+import csv
+import io
+import json
+from datetime import datetime, timedelta
+
+import server
+from records import AttemptRecord
+
+BASE = datetime(2024, 3, 1, 10, 0)
+
+
+def _seed(count=5):
+    # Две попытки на одно время: ключ порции - (attempt_ts, id)
+    server.db.add_attempts([
+        AttemptRecord(f"user{index}", "10.0.0.1", "web", index % 2 == 0,
+                      attempt_time=BASE + timedelta(minutes=index // 2))
+        for index in range(count)
+    ])
+
+
+def test_ndjson_export_walks_all_chunks(client, monkeypatch):
+    monkeypatch.setattr(server, "EXPORT_CHUNK_SIZE", 2)
+    _seed()
+    response = client.get("/api/attempts/export")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    attempts = [json.loads(line) for line in response.text.splitlines()]
+    assert [attempt["username"] for attempt in attempts] == [f"user{index}" for index in range(5)]
+
+    response = client.get("/api/attempts/export", params={
+        "from": (BASE + timedelta(minutes=1)).isoformat(), "to": (BASE + timedelta(minutes=2)).isoformat(),
+    })
+    assert [json.loads(line)["username"] for line in response.text.splitlines()] == ["user2", "user3"]
+
+
+def test_csv_export_has_header_and_columns(client):
+    _seed(3)
+    response = client.get("/api/attempts/export", params={"format": "csv"})
+    assert response.status_code == 200
+    assert "attachment" in response.headers["content-disposition"]
+    rows = list(csv.reader(io.StringIO(response.text)))
+    assert rows[0] == list(server.EXPORT_COLUMNS)
+    assert [row[rows[0].index("username")] for row in rows[1:]] == ["user0", "user1", "user2"]
+
+
+def test_export_rejects_unknown_format(client):
+    assert client.get("/api/attempts/export", params={"format": "xml"}).status_code == 400
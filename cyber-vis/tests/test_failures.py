@@ -0,0 +1,57 @@
+from datetime import datetime, timedelta
+
+from database import LoginDatabase
+from failures import FailureCounter
+from records import AttemptRecord
+
+NOW = 1_700_000_000
+
+
+def test_sliding_window_counts(monkeypatch):
+    monkeypatch.setattr("failures.time.time", lambda: NOW)
+    counter = FailureCounter(max_window=60, bucket_seconds=10)
+    for seconds_ago in (5, 30, 14 * 60, 16 * 60, 59 * 60):
+        counter.record("10.0.0.1", NOW - seconds_ago)
+    # Попытка "из прошлого" встаёт в свою корзину
+    counter.record("10.0.0.1", NOW - 2 * 60)
+    counter.record("10.0.0.2", NOW)
+    counter.record(None, NOW)
+    assert counter.count("10.0.0.1", 1, NOW) == 2
+    assert counter.count("10.0.0.1", 15, NOW) == 4
+    assert counter.count("10.0.0.1", 60, NOW) == 6
+    assert counter.count("10.0.0.3", 60, NOW) == 0
+    # Корзины старше max_window отбрасываются
+    assert counter.count("10.0.0.1", 60, NOW + 30 * 60) == 5
+    assert counter.count("10.0.0.2", 60, NOW + 61 * 60) == 0
+    assert len(counter) == 1
+
+
+def test_least_recent_ip_is_evicted(monkeypatch):
+    monkeypatch.setattr("failures.time.time", lambda: NOW)
+    counter = FailureCounter(max_ips=2)
+    counter.record("10.0.0.1", NOW)
+    counter.record("10.0.0.2", NOW)
+    counter.record("10.0.0.1", NOW)
+    counter.record("10.0.0.3", NOW)
+    assert (counter.count("10.0.0.1", 5, NOW), counter.count("10.0.0.2", 5, NOW)) == (2, 0)
+
+
+def test_database_counts_survive_restart(tmp_path):
+    path = str(tmp_path / "failures.db")
+    now = datetime.now()
+    database = LoginDatabase(path, readers=1)
+    database.open()
+    database.add_attempts([
+        AttemptRecord("admin", "10.0.0.1", "web", success, attempt_time=now - timedelta(minutes=minutes))
+        for success, minutes in ((False, 1), (False, 10), (True, 2), (False, 40), (False, 120))
+    ])
+    database.close()
+
+    # Окна памяти заполняются из БД при открытии, длинные считаются по таблице
+    database = LoginDatabase(path, readers=1)
+    database.open()
+    try:
+        counts = [database.get_failed_attempts_count("10.0.0.1", minutes) for minutes in (5, 15, 60, 180)]
+    finally:
+        database.close()
+    assert counts == [1, 2, 3, 4]
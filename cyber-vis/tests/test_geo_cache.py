@@ -0,0 +1,85 @@
+import pytest
+
+from geo import GeoCache, GeoUnavailable
+
+MOSCOW = {"country": "Russia", "city": "Moscow", "latitude": 55.75, "longitude": 37.61}
+
+
+class _Resolver:
+    def __init__(self, answers):
+        self.answers = answers
+        self.calls = []
+
+    def __call__(self, ip_address):
+        self.calls.append(ip_address)
+        answer = self.answers.get(ip_address)
+        if isinstance(answer, Exception):
+            raise answer
+        return answer
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1_700_000_000.0]
+    monkeypatch.setattr("geo.time.time", lambda: now[0])
+    return now
+
+
+def test_hits_negative_ttl_and_expiry(clock):
+    resolver = _Resolver({"1.1.1.1": MOSCOW})
+    cache = GeoCache(resolver, positive_ttl=100, negative_ttl=10)
+    assert cache.get("1.1.1.1") == MOSCOW
+    cache.get("1.1.1.1")["city"] = "изменён"  # наружу отдаётся копия
+    assert cache.get("1.1.1.1") == MOSCOW
+    assert cache.get("2.2.2.2") is None
+    assert cache.get("2.2.2.2") is None
+    assert resolver.calls == ["1.1.1.1", "2.2.2.2"]
+
+    # Ненайденный адрес переспрашивается раньше найденного
+    clock[0] += 11
+    cache.get("2.2.2.2")
+    cache.get("1.1.1.1")
+    assert resolver.calls == ["1.1.1.1", "2.2.2.2", "2.2.2.2"]
+    clock[0] += 100
+    cache.get("1.1.1.1")
+    assert resolver.calls[-1] == "1.1.1.1"
+    stats = cache.stats()
+    assert (stats["hits"], stats["negative_hits"], stats["misses"], stats["expired"]) == (3, 1, 4, 2)
+
+
+def test_lru_eviction(clock):
+    resolver = _Resolver({})
+    cache = GeoCache(resolver, max_entries=2)
+    cache.get("10.0.0.1")
+    cache.get("10.0.0.2")
+    cache.get("10.0.0.1")  # 10.0.0.2 становится самым старым
+    cache.get("10.0.0.3")
+    assert cache.peek("10.0.0.1")[0] and not cache.peek("10.0.0.2")[0]
+    assert cache.stats()["evictions"] == 1
+
+
+def test_outage_is_not_cached(clock):
+    resolver = _Resolver({"1.1.1.1": GeoUnavailable("timeout")})
+    cache = GeoCache(resolver)
+    for _ in range(2):
+        with pytest.raises(GeoUnavailable):
+            cache.get("1.1.1.1")
+    assert resolver.calls == ["1.1.1.1", "1.1.1.1"]
+    assert cache.stats()["unavailable"] == 2 and not cache.peek("1.1.1.1")[0]
+
+
+def test_dirty_rows_round_trip(clock):
+    cache = GeoCache(_Resolver({"1.1.1.1": MOSCOW}), positive_ttl=100, negative_ttl=10)
+    cache.get("1.1.1.1")
+    cache.get("2.2.2.2")
+    rows = sorted(cache.take_dirty())
+    assert rows == [
+        ("1.1.1.1", 1, "Russia", "Moscow", 55.75, 37.61, clock[0] + 100),
+        ("2.2.2.2", 0, None, None, None, None, clock[0] + 10),
+    ]
+    assert cache.take_dirty() == []
+
+    restored = GeoCache(_Resolver({}))
+    restored.load(rows, now=clock[0] + 50)  # ненайденный уже истёк
+    assert restored.peek("1.1.1.1") == (True, MOSCOW)
+    assert not restored.peek("2.2.2.2")[0]
@@ -0,0 +1,91 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from geo import GeoClient, GeoUnavailable
+
+
+class _Response:
+    def __init__(self, status_code=200, data=None):
+        self.status_code = status_code
+        self.ok = status_code < 400
+        self._data = data or {}
+
+    def json(self):
+        return self._data
+
+
+class _Session:
+    """Подмена requests.Session: ответы по очереди, исключения пробрасываются"""
+
+    def __init__(self, *answers, gate=None):
+        self.answers = list(answers)
+        self.gate = gate
+        self.calls = 0
+
+    def get(self, url, timeout):
+        self.calls += 1
+        if self.gate is not None:
+            self.gate.wait(5)
+        answer = self.answers.pop(0) if len(self.answers) > 1 else self.answers[0]
+        if isinstance(answer, Exception):
+            raise answer
+        return answer
+
+
+def _client(session, **kwargs):
+    client = GeoClient(**kwargs)
+    client.session = session
+    return client
+
+
+def test_parses_answer_and_not_found():
+    client = _client(_Session(
+        _Response(data={"success": True, "country": "Germany", "city": "Berlin",
+                        "latitude": "52.52", "longitude": ""}),
+        _Response(data={"success": False}),
+        _Response(404),
+    ))
+    assert client("5.0.0.1") == {"country": "Germany", "city": "Berlin", "latitude": 52.52, "longitude": None}
+    assert client("5.0.0.2") is None
+    assert client("5.0.0.3") is None
+    assert client.state == "closed"
+
+
+def test_concurrent_lookups_of_one_ip_are_coalesced():
+    gate = threading.Event()
+    session = _Session(_Response(data={"country": "Germany"}), gate=gate)
+    client = _client(session, max_concurrency=2)
+    with ThreadPoolExecutor(4) as pool:
+        futures = [pool.submit(client, "5.0.0.1") for _ in range(4)]
+        deadline = time.monotonic() + 5
+        while client.stats()["coalesced"] < 3 and time.monotonic() < deadline:
+            time.sleep(0.001)
+        gate.set()
+        results = [future.result() for future in futures]
+    assert session.calls == 1
+    assert all(result["country"] == "Germany" for result in results)
+    results[0]["country"] = "изменён"  # каждому вызывающему - своя копия
+    assert results[1]["country"] == "Germany"
+
+
+def test_breaker_opens_and_probes_after_cooldown(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("geo.time.monotonic", lambda: now[0])
+    session = _Session(_Response(503), _Response(429), OSError("reset"), _Response(data={"country": "Germany"}))
+    client = _client(session, failure_threshold=3, cooldown=30)
+    for ip in ("5.0.0.1", "5.0.0.2", "5.0.0.3"):
+        with pytest.raises(GeoUnavailable):
+            client(ip)
+    assert client.state == "open"
+    with pytest.raises(GeoUnavailable):
+        client("5.0.0.4")
+    assert session.calls == 3 and client.stats()["rejected"] == 1
+
+    # После паузы пробный запрос; удачный закрывает breaker
+    now[0] += 31
+    assert client.state == "half-open"
+    assert client("5.0.0.4") == {"country": "Germany", "city": None, "latitude": None, "longitude": None}
+    assert client.state == "closed"
@@ -0,0 +1,57 @@
+import pytest
+
+from geo import build_resolver, resolve_nothing
+from geodb import GeoRangeDB, build
+
+RANGES = """network,start_ip,end_ip,country,city,latitude,longitude
+5.0.0.0/16,,,Russia,Moscow,55.7558,37.6173
+,5.1.0.0,5.1.0.255,Germany,,,
+5.0.128.0/24,,,Ukraine,Kyiv,50.45,30.52
+,5.2.0.9,5.2.0.1,Spain,,,
+2a00:1450::/32,,,Ireland,Dublin,53.35,-6.26
+"""
+
+
+@pytest.fixture
+def geo_file(tmp_path):
+    source = tmp_path / "ranges.csv"
+    source.write_text(RANGES, encoding="utf-8")
+    output = str(tmp_path / "geoip.bin")
+    result = build(str(source), output)
+    assert result == {"ipv4": 2, "ipv6": 1, "strings": 7, "invalid": 1, "overlapping": 1}
+    return output
+
+
+def test_lookup_ranges(geo_file):
+    geodb = GeoRangeDB(geo_file)
+    try:
+        assert len(geodb) == 3
+        assert geodb.lookup("5.0.0.0") == {
+            "country": "Russia", "city": "Moscow", "latitude": 55.7558, "longitude": 37.6173,
+        }
+        assert geodb.lookup("5.0.255.255")["country"] == "Russia"
+        # Город и координаты необязательны
+        assert geodb.lookup("5.1.0.7") == {"country": "Germany", "city": None, "latitude": None, "longitude": None}
+        assert geodb.lookup("2a00:1450:4001::1")["city"] == "Dublin"
+        for missing in ("4.255.255.255", "5.1.1.0", "2a01::1", "not-an-ip"):
+            assert geodb.lookup(missing) is None
+    finally:
+        geodb.close()
+
+
+def test_rejects_foreign_file(tmp_path):
+    path = tmp_path / "other.bin"
+    path.write_bytes(b"\0" * 64)
+    with pytest.raises(ValueError):
+        GeoRangeDB(str(path))
+
+
+def test_resolver_modes(geo_file):
+    online = lambda ip: {"country": "online"}
+    assert build_resolver("offline", geo_file, online=online)("5.1.0.1")["country"] == "Germany"
+    hybrid = build_resolver("hybrid", geo_file, online=online)
+    assert hybrid("5.1.0.1")["country"] == "Germany"
+    assert hybrid("8.8.8.8") == {"country": "online"}
+    assert build_resolver("offline", None, online=online) is resolve_nothing
+    with pytest.raises(ValueError):
+        build_resolver("psychic")
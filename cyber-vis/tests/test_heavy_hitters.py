@@ -0,0 +1,90 @@
+import random
+from collections import Counter
+from datetime import datetime, timedelta
+
+import pytest
+
+from heavy_hitters import CountMinSketch, HeavyHitters, SpaceSaving, WindowedTopK
+from records import AttemptRecord
+
+
+def _stream(seed=1):
+    """Несколько тяжёлых ключей на фоне длинного хвоста"""
+    rng = random.Random(seed)
+    keys = [f"heavy-{index}" for index in range(5) for _ in range(300 - 50 * index)]
+    keys += [f"tail-{rng.randrange(5000)}" for _ in range(5000)]
+    rng.shuffle(keys)
+    return keys
+
+
+def test_cms_never_underestimates():
+    keys = _stream()
+    sketch = CountMinSketch(width=256, depth=4)
+    for key in keys:
+        sketch.add(key)
+    exact = Counter(keys)
+    assert sketch.total == len(keys)
+    errors = [sketch.estimate(key) - count for key, count in exact.items()]
+    assert min(errors) >= 0
+    # Завышение больше e/width * total - с вероятностью не больше e^-depth на ключ
+    over = sum(error > 2.72 / 256 * len(keys) for error in errors)
+    assert over <= 0.05 * len(exact)
+
+
+def test_space_saving_keeps_heavy_keys():
+    sketch = CountMinSketch(width=1024, depth=4)
+    candidates = SpaceSaving(capacity=20)
+    for key in _stream():
+        candidates.offer(key, sketch.add(key))
+    assert len(candidates.counts) <= 20
+    assert {f"heavy-{index}" for index in range(5)} <= set(candidates.counts)
+
+
+def test_windowed_top_forgets_old_slots():
+    top = WindowedTopK(600, slots=6, width=256)
+    now = 1_700_000_000
+    for _ in range(50):
+        top.add("old", now - 900)
+    for _ in range(5):
+        top.add("fresh", now - 30)
+    # Попытка старше кольца не перезаписывает живой слот
+    top.add("ancient", now - 10 * 600)
+
+    scored, total = top.top(10, now)
+    assert scored == [(5, "fresh")]
+    assert total == 5
+
+
+def test_top_by_dimension():
+    now = 1_700_000_000
+    hitters = HeavyHitters(width=512)
+    for index in range(30):
+        hitters.record("10.0.0.1", f"user-{index % 3}", "RU", now - 60)
+    for index in range(10):
+        hitters.record(f"10.0.0.{index + 2}", "admin", "DE", now - 60)
+
+    top = hitters.top("ip", "10m", limit=1, now=now)
+    assert top["items"] == [{"key": "10.0.0.1", "count": 30}]
+    assert top["total"] == 40
+    assert hitters.top("subnet", "1h", now=now)["items"][0] == {"key": "10.0.0.0/24", "count": 40}
+    assert hitters.top("username", "all", now=now)["items"][0] == {"key": "admin", "count": 10}
+
+    with pytest.raises(ValueError):
+        hitters.top("asn", "10m", now=now)
+
+
+def test_seed_groups_failures_from_database(db):
+    now = datetime.now()
+    db.add_attempts([
+        AttemptRecord("root", "10.0.0.1", "web", False, country="RU",
+                      attempt_time=now - timedelta(minutes=1 + index % 3))
+        for index in range(12)
+    ] + [
+        AttemptRecord("root", "10.0.0.2", "web", True, attempt_time=now - timedelta(minutes=1)),
+        AttemptRecord("root", "10.0.0.3", "web", False, attempt_time=now - timedelta(days=2)),
+    ])
+
+    hitters = HeavyHitters(width=512)
+    assert hitters.seed(db._writer) <= 3
+    assert hitters.top("ip", "10m")["items"] == [{"key": "10.0.0.1", "count": 12}]
+    assert hitters.top("country", "24h")["items"] == [{"key": "RU", "count": 12}]
@@ -0,0 +1,67 @@
+import pytest
+
+from hll import CardinalityTracker, HyperLogLog, precision_for_error
+
+
+@pytest.mark.parametrize("cardinality", [10, 1000, 50000])
+def test_count_within_error_bound(cardinality):
+    sketch = HyperLogLog(precision=12)
+    for value in range(cardinality):
+        sketch.add(f"user-{value}")
+        sketch.add(f"user-{value}")  # повторы не меняют оценку
+    # 4 стандартные ошибки: тест не должен мигать
+    assert abs(sketch.count() - cardinality) <= max(2, 4 * sketch.error * cardinality)
+
+
+def test_merge_equals_union():
+    left, right, union = HyperLogLog(10), HyperLogLog(10), HyperLogLog(10)
+    for value in range(3000):
+        left.add(value)
+        union.add(value)
+    for value in range(2000, 6000):
+        right.add(value)
+        union.add(value)
+    assert left.merge(right).registers == union.registers
+
+    with pytest.raises(ValueError):
+        left.merge(HyperLogLog(11))
+
+
+def test_precision_for_error():
+    assert precision_for_error(0.01625) == 12
+    assert HyperLogLog(precision_for_error(0.01)).error <= 0.01
+    assert precision_for_error(0.5) == 4
+    assert precision_for_error(0.0001) == 18
+    assert precision_for_error(0) == precision_for_error(float("nan")) == 18
+
+
+def test_bad_error_setting_falls_back_to_default(monkeypatch, tmp_path):
+    from database import LoginDatabase
+
+    monkeypatch.setenv("CYBER_VIS_UNIQUE_ERROR_PCT", "1,6")
+    assert LoginDatabase(str(tmp_path / "x.db")).stats.precision == 12
+
+
+def test_tracker_windows_and_rows_round_trip():
+    now = 1_700_000_000
+    tracker = CardinalityTracker(precision=10)
+    for index in range(200):
+        tracker.record(f"user-{index}", f"10.0.0.{index}", ts=now - 2 * 3600, now=now)
+    for index in range(50):
+        tracker.record(f"user-{index}", f"10.0.1.{index}", ts=now - 60, now=now)
+
+    estimates = {
+        (dimension, window): tracker.estimate(dimension, window, now)
+        for dimension in CardinalityTracker.DIMENSIONS
+        for window in CardinalityTracker.WINDOWS
+    }
+    assert abs(estimates[("username", "hour")] - 50) <= 5
+    assert abs(estimates[("username", "day")] - 200) <= 20
+    assert abs(estimates[("ip", "day")] - 250) <= 25
+
+    restored = CardinalityTracker(precision=10)
+    assert restored.load(tracker.rows(now), now)
+    for key, estimate in estimates.items():
+        assert restored.estimate(*key, now) == estimate
+
+    assert not CardinalityTracker(precision=12).load(tracker.rows(now), now)
@@ -0,0 +1,83 @@
+import asyncio
+
+import pytest
+
+from ingest import AttemptWriter
+from records import AttemptRecord
+
+
+class _RecordingDatabase:
+    """add_attempts запоминает размеры пачек и выдаёт ID подряд"""
+
+    def __init__(self, fail=False):
+        self.batches = []
+        self.fail = fail
+
+    def add_attempts(self, attempts):
+        if self.fail:
+            raise RuntimeError("disk full")
+        first = sum(self.batches) + 1
+        self.batches.append(len(attempts))
+        return list(range(first, first + len(attempts)))
+
+
+def _record(index=0):
+    return AttemptRecord(f"user{index}", "10.0.0.1", "web", False)
+
+
+def test_concurrent_attempts_share_one_commit():
+    database = _RecordingDatabase()
+
+    async def scenario():
+        writer = AttemptWriter(database, max_batch=100, max_delay=0.05)
+        await writer.start()
+        try:
+            return await asyncio.gather(*(writer.add_record(_record(index)) for index in range(10)))
+        finally:
+            await writer.stop()
+
+    assert asyncio.run(scenario()) == list(range(1, 11))
+    assert database.batches == [10]
+
+
+def test_batch_is_capped_and_stop_drains_queue():
+    database = _RecordingDatabase()
+
+    async def scenario():
+        writer = AttemptWriter(database, max_batch=3, max_delay=1)
+        await writer.start()
+        futures = [await writer.submit(_record(index)) for index in range(7)]
+        await writer.stop()
+        return [future.result() for future in futures], writer.running
+
+    ids, running = asyncio.run(scenario())
+    assert ids == list(range(1, 8))
+    assert not running
+    assert max(database.batches) <= 3 and sum(database.batches) == 7
+
+
+def test_write_error_reaches_every_caller():
+    database = _RecordingDatabase(fail=True)
+
+    async def scenario():
+        writer = AttemptWriter(database, max_batch=10, max_delay=0.01)
+        await writer.start()
+        try:
+            return await asyncio.gather(*(writer.add_record(_record()) for _ in range(3)),
+                                        return_exceptions=True)
+        finally:
+            await writer.stop()
+
+    errors = asyncio.run(scenario())
+    assert [str(error) for error in errors] == ["disk full"] * 3
+
+
+def test_without_running_writer_records_are_written_directly(db):
+    async def scenario():
+        writer = AttemptWriter(db)
+        with pytest.raises(RuntimeError):
+            await writer.submit(_record())
+        return await writer.add_record(_record())
+
+    assert asyncio.run(scenario()) == 1
+    assert db.get_recent_attempts()[0]["username"] == "user0"
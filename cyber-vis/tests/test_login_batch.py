@@ -0,0 +1,71 @@
+import json
+
+import server
+
+
+def _batch(client, items, **kwargs):
+    return client.post("/api/auth/login/batch", json=items, **kwargs)
+
+
+def test_batch_records_in_order_and_stops_at_block(client):
+    items = [{"username": "admin", "password": "admin123", "ip_address": "10.23.0.1"}]
+    items += [{"username": "admin", "password": "wrong", "ip_address": "10.23.1.1"} for _ in range(4)]
+    items.append({"username": "admin"})
+    response = _batch(client, items)
+    assert response.status_code == 200
+    data = response.json()["data"]
+    results = data["results"]
+
+    assert results[0]["success"] and results[0]["id"]
+    # Третья ошибка срабатывает правилом ip_failures_15m, четвёртая уже не записывается
+    assert [result.get("id") is not None for result in results[1:5]] == [True, True, True, False]
+    assert results[3]["message"] == results[4]["message"]
+    assert "password" in results[5]["error"]
+    assert (data["total"], data["recorded"], data["blocked"]) == (6, 4, 1)
+
+    attempts = client.get("/api/attempts", params={"ip_address": "10.23.1.1"}).json()["data"]
+    # Классификация видит ошибки, учтённые раньше в той же пачке
+    assert [attempt["attack_type"] for attempt in attempts] == ["brute_force", "failed_login", "failed_login"]
+    assert server.db.is_ip_blocked("10.23.1.1")[0]
+
+
+def test_ndjson_batch_reports_bad_lines(client):
+    body = "\n".join([
+        json.dumps({"username": "test", "password": "test123", "ip_address": "10.23.2.1"}),
+        "{not json",
+        "",
+        json.dumps([1, 2]),
+    ])
+    response = client.post("/api/auth/login/batch", content=body.encode(),
+                           headers={"Content-Type": "application/x-ndjson"})
+    results = response.json()["data"]["results"]
+    assert results[0]["success"]
+    assert results[1]["error"].startswith("Некорректный JSON")
+    assert "объектом" in results[2]["error"]
+
+
+def test_batch_limits(client, monkeypatch):
+    monkeypatch.setattr(server, "LOGIN_BATCH_MAX", 2)
+    items = [{"username": "admin", "password": "x", "ip_address": "10.23.3.1"}] * 3
+    assert _batch(client, items).status_code == 413
+
+    # Размер тела проверяется до разбора JSON
+    monkeypatch.setattr(server, "LOGIN_BATCH_MAX_BYTES", 64)
+    response = client.post("/api/auth/login/batch", content=b"[" + b" " * 100 + b"]",
+                           headers={"Content-Type": "application/json"})
+    assert response.status_code == 413
+    response = client.post("/api/auth/login/batch", content=b"\n" * 100,
+                           headers={"Content-Type": "application/x-ndjson"})
+    assert response.status_code == 413
+    assert _batch(client, {"username": "admin"}).status_code == 400
+
+
+def test_busy_verifier_rejects_before_rules(client, monkeypatch):
+    verifier = server.credential_verifier
+    monkeypatch.setattr(verifier, "_reserved", verifier.max_pending)
+    items = [{"username": "admin", "password": "wrong", "ip_address": "10.23.4.1"}] * 3
+    response = _batch(client, items)
+    assert response.status_code == 503
+    # Ни попыток, ни учтённых правилами ошибок: повтор пачки не посчитает их дважды
+    assert server.db.get_failed_attempts_count("10.23.4.1") == 0
+    assert client.get("/api/attempts", params={"ip_address": "10.23.4.1"}).json()["data"] == []
@@ -0,0 +1,59 @@
+import atexit
+import json
+import logging
+
+from logs import (
+    REDACTED, LogPipeline, RateLimitFilter, RedactFilter, StructuredFormatter, log_event,
+)
+
+
+def _record(event, level=logging.INFO, **fields):
+    record = logging.LogRecord("cyber_vis", level, __file__, 1, event, None, None)
+    record.event = event
+    record.fields = fields
+    return record
+
+
+def test_secret_fields_are_redacted():
+    record = _record("login_failed", username="admin", password="hunter2", token="abc")
+    assert RedactFilter().filter(record)
+    assert record.fields == {"username": "admin", "password": REDACTED, "token": REDACTED}
+
+    line = json.loads(StructuredFormatter("json").format(record))
+    assert line["message"] == "login_failed"
+    assert line["password"] == REDACTED
+    assert StructuredFormatter().format(record).endswith("username=admin password=*** token=***")
+
+
+def test_rate_limit_per_event(monkeypatch):
+    clock = [100.0]
+    monkeypatch.setattr("logs.time.monotonic", lambda: clock[0])
+    limit = RateLimitFilter(burst=2, interval=10)
+
+    passed = [limit.filter(_record("login_attempt")) for _ in range(5)]
+    assert passed == [True, True, False, False, False]
+    # Другие события и ошибки не ограничиваются
+    assert limit.filter(_record("block_added"))
+    assert limit.filter(_record("login_attempt", level=logging.ERROR))
+    assert limit.suppressed == 3
+
+    # В следующем интервале первая запись сообщает об отброшенных
+    clock[0] += 10
+    record = _record("login_attempt", ip="10.0.0.1")
+    assert limit.filter(record)
+    assert record.fields == {"ip": "10.0.0.1", "suppressed": 3}
+
+
+def test_pipeline_registers_atexit_once(monkeypatch, capsys):
+    registered = []
+    monkeypatch.setattr(atexit, "register", registered.append)
+    pipeline = LogPipeline()
+    try:
+        for _ in range(3):
+            logger = pipeline.setup(level="DEBUG", burst=0)
+        log_event(logger, logging.INFO, "pipeline_ready", password="x")
+    finally:
+        pipeline.stop()
+        logging.getLogger("cyber_vis").handlers = []
+    assert registered == [pipeline.stop]
+    assert "pipeline_ready password=***" in capsys.readouterr().err
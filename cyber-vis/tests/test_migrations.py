@@ -0,0 +1,117 @@
+import json
+import sqlite3
+
+from database import MIGRATIONS, LoginDatabase
+from records import to_epoch_us
+
+# Схема первой версии (до PRAGMA user_version)
+BASELINE_SCHEMA = '''
+    CREATE TABLE login_attempts (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username TEXT NOT NULL,
+        ip_address TEXT,
+        country TEXT,
+        city TEXT,
+        latitude REAL,
+        longitude REAL,
+        attack_type TEXT,
+        threat_level TEXT,
+        client_type TEXT,
+        success BOOLEAN NOT NULL,
+        reason TEXT,
+        attempt_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        user_agent TEXT,
+        metadata TEXT
+    );
+    CREATE TABLE ip_blocks (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        ip_address TEXT UNIQUE NOT NULL,
+        reason TEXT,
+        blocked_until TIMESTAMP,
+        is_permanent BOOLEAN DEFAULT 0,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+'''
+
+BASELINE_ROWS = [
+    ("admin", "10.0.0.1", "Russia", "Moscow", 55.75, 37.61, "brute_force", "high", "web", 0,
+     "Неверный пароль", "2024-03-01 10:00:00", "curl/8.0",
+     json.dumps({"timestamp": "2024-03-01T10:00:00", "attempt": 3})),
+    ("alice", "10.0.0.2", None, None, None, None, "login_attempt", "low", "desktop", 1,
+     "Успешный вход", "2024-03-01T10:00:05.250000", None, None),
+    ("admin", "10.0.0.1", "Russia", "Moscow", 55.75, 37.61, "brute_force", "high", "web", 0,
+     "Неверный пароль", "2024-03-01 10:01:00", "curl/8.0", json.dumps({"geo": {"country": "Russia"}})),
+]
+
+
+def _baseline(path):
+    conn = sqlite3.connect(path)
+    conn.executescript(BASELINE_SCHEMA)
+    conn.executemany('''
+        INSERT INTO login_attempts
+        (username, ip_address, country, city, latitude, longitude, attack_type, threat_level,
+         client_type, success, reason, attempt_time, user_agent, metadata)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', BASELINE_ROWS)
+    conn.execute("INSERT INTO ip_blocks (ip_address, reason, is_permanent) VALUES ('10.9.9.9', 'вручную', 1)")
+    conn.commit()
+    conn.close()
+
+
+def test_baseline_database_migrates_to_latest(tmp_path):
+    path = str(tmp_path / "old.db")
+    _baseline(path)
+
+    db = LoginDatabase(path, readers=1)
+    db.open()
+    try:
+        pragma = lambda name: db._writer.execute(f"PRAGMA {name}").fetchone()[0]
+        assert pragma("user_version") == MIGRATIONS[-1][0]
+        # Перепаковка после миграции 5 включает инкрементальный auto_vacuum
+        assert pragma("auto_vacuum") == 2
+
+        attempts = db.get_recent_attempts(limit=10)
+        assert [attempt["id"] for attempt in attempts] == [3, 2, 1]
+        first = attempts[-1]
+        assert first["username"] == "admin"
+        assert first["country"] == "Russia"
+        assert first["client_type"] == "web"
+        assert first["user_agent"] == "curl/8.0"
+        assert first["attempt_time"] == "2024-03-01T10:00:00"
+        # Поля, дублирующие колонки, из metadata убраны
+        assert json.loads(first["metadata"]) == {"attempt": 3}
+        assert attempts[0]["metadata"] is None
+        assert attempts[1]["attempt_time"] == "2024-03-01T10:00:05.250000"
+
+        ts = [row[0] for row in db._writer.execute("SELECT attempt_ts FROM login_attempts ORDER BY id")]
+        assert ts == [to_epoch_us(row[11]) for row in BASELINE_ROWS]
+
+        assert db.blocks.check("10.9.9.9")[0]
+        assert db.stats.snapshot()["failed"] == 2
+    finally:
+        db.close()
+
+
+def test_reopen_is_idempotent(tmp_path):
+    path = str(tmp_path / "old.db")
+    _baseline(path)
+    for _ in range(2):
+        db = LoginDatabase(path, readers=1)
+        db.open()
+        try:
+            assert db._writer.execute("PRAGMA user_version").fetchone()[0] == MIGRATIONS[-1][0]
+            assert len(db.get_recent_attempts(limit=10)) == len(BASELINE_ROWS)
+        finally:
+            db.close()
+
+
+def test_new_database_starts_at_latest_version(db):
+    assert db._writer.execute("PRAGMA user_version").fetchone()[0] == MIGRATIONS[-1][0]
+    assert db._writer.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+    indexes = {row[0] for row in db._writer.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'login_attempts'"
+    )}
+    assert indexes == {
+        "idx_attempts_time", "idx_attempts_geo_time", "idx_attempts_username_time",
+        "idx_attempts_ip_address_time", "idx_attempts_country_id_time",
+    }
@@ -0,0 +1,49 @@
+import json
+from datetime import datetime
+
+from records import AttemptRecord, from_epoch_us, to_epoch_us
+
+
+def test_epoch_round_trip():
+    when = datetime(2024, 3, 1, 10, 0, 5, 250000)
+    assert from_epoch_us(to_epoch_us(when)) == when.isoformat()
+    assert to_epoch_us(when.isoformat()) == to_epoch_us(when)
+
+
+def test_json_is_cached_until_a_setter_runs():
+    record = AttemptRecord("admin", "10.0.0.1", "web", 0, reason="Неверный пароль",
+                           attempt_time=datetime(2024, 3, 1, 10, 0))
+    first = record.to_json()
+    assert record.to_json() is first
+    data = json.loads(first)
+    assert data["success"] is False and data["reason"] == "Неверный пароль"
+    assert data["attempt_time"] == "2024-03-01T10:00:00"
+
+    record.set_id(7)
+    record.set_geo({"country": "Germany", "city": "Berlin"}, pending=True)
+    record.set_tag("brute_force", "high")
+    record.set_time(datetime(2024, 3, 1, 11, 0))
+    data = json.loads(record.to_json())
+    assert (data["id"], data["country"], data["geo_pending"]) == (7, "Germany", True)
+    assert (data["attack_type"], data["threat_level"]) == ("brute_force", "high")
+    assert data["attempt_time"] == "2024-03-01T11:00:00"
+
+    # Каждый set_* сбрасывает сохранённый JSON
+    for setter, args in [("set_id", (8,)), ("set_geo", (None,)), ("set_tag", ("spray", "medium")),
+                         ("set_time", (None,))]:
+        cached = record.to_json()
+        getattr(record, setter)(*args)
+        assert record.to_json() != cached, setter
+    assert json.loads(record.to_json())["country"] is None
+
+
+def test_event_matches_stored_row(db):
+    record = AttemptRecord("admin", "10.0.0.1", "web", True, reason="ok", user_agent="curl/8.0",
+                           metadata={"attempt": 2}, attempt_time=datetime(2024, 3, 1, 10, 0, 0, 5))
+    record.set_geo({"country": "Germany", "city": "Berlin", "latitude": 52.52, "longitude": 13.4})
+    db.add_attempts([record])
+    stored = db.get_recent_attempts(limit=1)[0]
+    event = json.loads(record.to_json())
+    assert event.pop("geo_pending") is False
+    assert event.pop("metadata") == json.loads(stored.pop("metadata"))
+    assert event == {**stored, "success": bool(stored["success"])}
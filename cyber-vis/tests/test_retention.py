@@ -0,0 +1,99 @@
+import asyncio
+import threading
+import time
+from datetime import datetime, timedelta
+
+from database import LoginDatabase
+from records import AttemptRecord
+from retention import RetentionWorker
+
+
+def _attempt(username, ip, when, success=False):
+    return AttemptRecord(username, ip, "web", success, attempt_time=when)
+
+
+def test_archive_round_trip(db):
+    old = datetime.now() - timedelta(days=10)
+    db.add_attempts([
+        _attempt("admin", "10.0.0.1", old),
+        _attempt("alice", "10.0.0.2", old + timedelta(minutes=1), success=True),
+        _attempt("admin", "10.0.0.3", datetime.now()),
+    ])
+    worker = RetentionWorker(db, hot_days=1, chunk_size=1, pause=0, rollup_days=0)
+    assert asyncio.run(worker.run_once()) == 2
+
+    assert [attempt["username"] for attempt in db.get_recent_attempts(limit=10)] == ["admin"]
+    attempts = db.get_recent_attempts(limit=10, include_archive=True)
+    assert [(attempt["username"], attempt["ip_address"]) for attempt in attempts] == [
+        ("admin", "10.0.0.3"), ("alice", "10.0.0.2"), ("admin", "10.0.0.1"),
+    ]
+    stats = db.get_stats(exact=True)
+    assert (stats["total_attempts"], stats["successful"], stats["archived_attempts"]) == (3, 1, 2)
+    assert (stats["unique_users"], stats["unique_ips"]) == (2, 3)
+
+
+def test_first_seed_counts_archived_uniques(db):
+    old = datetime.now() - timedelta(days=10)
+    db.add_attempts([_attempt(f"user{index}", f"10.0.0.{index}", old) for index in range(5)])
+    asyncio.run(RetentionWorker(db, hot_days=1, pause=0, rollup_days=0).run_once())
+
+    # Скетчи не сохранялись: уникальные за всё время берутся и из архива
+    reopened = LoginDatabase(db.db_path, readers=1)
+    reopened.open()
+    try:
+        snapshot = reopened.get_stats()
+    finally:
+        reopened.close()
+    assert snapshot["total_attempts"] == 5
+    assert (snapshot["unique_users"], snapshot["unique_ips"]) == (5, 5)
+
+
+class _SlowDatabase:
+    """Порция архивации, которая идёт дольше, чем ждёт остановка"""
+
+    minute_rollup_days = 0
+    archive = object()
+
+    def __init__(self):
+        self.started = threading.Event()
+        self.finished = False
+
+    def archive_chunk(self, cutoff, chunk_size):
+        self.started.set()
+        time.sleep(0.2)
+        self.finished = True
+        return 0
+
+
+def test_stop_waits_for_chunk_in_flight():
+    database = _SlowDatabase()
+
+    async def scenario():
+        worker = RetentionWorker(database, hot_days=1, interval=3600)
+        await worker.start()
+        await asyncio.to_thread(database.started.wait)
+        await worker.stop()
+        return database.finished
+
+    assert asyncio.run(scenario())
+
+
+def test_user_agent_is_normalized_and_unused_strings_pruned(db):
+    old = datetime.now() - timedelta(days=10)
+    long_agent = "bot/" + "x" * 1000
+    db.add_attempts([
+        AttemptRecord("admin", "10.0.0.1", "web", False, user_agent=long_agent + "1", attempt_time=old),
+        AttemptRecord("admin", "10.0.0.1", "web", False, user_agent=long_agent + "2", attempt_time=old),
+        AttemptRecord("admin", "10.0.0.2", "web", False, user_agent="curl/8.0\t ", attempt_time=datetime.now()),
+    ])
+    values = lambda: {row[0] for row in db._writer.execute('SELECT value FROM attempt_strings')}
+    # Варианты длинной строки сводятся к одной записи словаря
+    assert long_agent[:db.user_agent_max] in values() and "curl/8.0" in values()
+    assert len([value for value in values() if value.startswith("bot/")]) == 1
+
+    asyncio.run(RetentionWorker(db, hot_days=1, pause=0, rollup_days=0).run_once())
+    assert db.prune_strings() == 1
+    assert values() == {"web", "", "curl/8.0"}  # reason "" по умолчанию
+    # Удалённые ID не выдаются из кэша писателя
+    db.add_attempts([AttemptRecord("admin", "10.0.0.3", "web", False, user_agent=long_agent)])
+    assert db.get_recent_attempts(limit=1)[0]["user_agent"] == long_agent[:db.user_agent_max]
@@ -0,0 +1,63 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from records import AttemptRecord
+
+
+def _attempt(when, success=False, country=None, attack_type="login_attempt"):
+    return AttemptRecord("admin", "10.0.0.1", "web", success, country=country,
+                         attack_type=attack_type, attempt_time=when)
+
+
+def test_timeseries_splits_and_fills_gaps(db):
+    base = datetime.now().replace(minute=0, second=0, microsecond=0) - timedelta(hours=3)
+    db.add_attempts([
+        _attempt(base + timedelta(minutes=2), country="RU"),
+        _attempt(base + timedelta(minutes=7), success=True, country="RU"),
+        _attempt(base + timedelta(hours=2, minutes=1), country="DE", attack_type="brute_force"),
+    ])
+
+    points = db.get_timeseries(base, base + timedelta(hours=3), resolution=3600)
+    assert [point["values"] for point in points] == [
+        {"failed": 1, "successful": 1}, {}, {"failed": 1},
+    ]
+    points = db.get_timeseries(base, base + timedelta(hours=3), resolution=3600, split="country")
+    assert points[0]["values"] == {"RU": 2} and points[2]["values"] == {"DE": 1}
+
+    # Шаг в 5 минут - из минутного уровня
+    points = db.get_timeseries(base, base + timedelta(minutes=15), resolution=300, split="attack_type")
+    assert [point["values"] for point in points] == [{"login_attempt": 1}, {"login_attempt": 1}, {}]
+
+    # update_attempts_geo переносит приращения в корзины найденной страны
+    ids = db.add_attempts([_attempt(base + timedelta(minutes=30))])
+    db.update_attempts_geo(ids, {"country": "FR"})
+    points = db.get_timeseries(base, base + timedelta(hours=1), resolution=3600, split="country")
+    assert points[0]["values"] == {"RU": 2, "FR": 1}
+
+
+def test_timeseries_rejects_bad_params(db):
+    now = datetime.now()
+    with pytest.raises(ValueError):
+        db.get_timeseries(now - timedelta(hours=1), now, resolution=90)
+    with pytest.raises(ValueError):
+        db.get_timeseries(now - timedelta(hours=1), now, split="user_agent")
+    # Минутные агрегаты старше minute_rollup_days удалены - мелкий шаг туда не достаёт
+    with pytest.raises(ValueError):
+        db.get_timeseries(now - timedelta(days=db.minute_rollup_days + 1), now, resolution=300)
+    assert len(db.get_timeseries(now - timedelta(days=db.minute_rollup_days + 1), now, resolution=3600))
+
+
+def test_day_points_start_at_local_midnight(db, berlin_tz):
+    # 26.10.2025 в Берлине длится 25 часов (перевод часов назад)
+    db.add_attempts([
+        _attempt(datetime(2025, 10, day, hour, 30))
+        for day in (25, 26, 27)
+        for hour in (0, 23)
+    ])
+    points = db.get_timeseries(datetime(2025, 10, 25, 12), datetime(2025, 10, 28), resolution=86400)
+    assert [(point["time"], point["values"]) for point in points] == [
+        ("2025-10-25T00:00:00", {"failed": 2}),
+        ("2025-10-26T00:00:00", {"failed": 2}),
+        ("2025-10-27T00:00:00", {"failed": 2}),
+    ]
@@ -0,0 +1,146 @@
+import json
+import time
+from datetime import datetime
+
+import pytest
+
+from failures import FailureCounters
+from records import AttemptRecord
+from rules import RulesEngine, parse_rules
+
+# Счётчики отбрасывают корзины старше окна по текущим часам
+NOW = int(time.time())
+
+
+def _attempt(ip="10.0.0.1", username="admin", success=False, ts=NOW):
+    return AttemptRecord(username, ip, "web", success, attempt_time=datetime.fromtimestamp(ts))
+
+
+def _engine(tmp_path, rules, **kwargs):
+    path = tmp_path / "rules.json"
+    path.write_text(json.dumps({"rules": rules}), encoding="utf-8")
+    engine = RulesEngine(str(path), reload_interval=3600, **kwargs)
+    assert engine.reload(), engine.error
+    return engine
+
+
+@pytest.mark.parametrize("rules", [
+    {"rules": [{"name": "x", "dimension": "asn", "window_minutes": 5, "threshold": 1, "action": "alert"}]},
+    [{"name": "x", "dimension": "ip", "window_minutes": 0, "threshold": 1, "action": "alert"}],
+    [{"name": "x", "dimension": "ip", "window_minutes": 5, "threshold": True, "action": "alert"}],
+    [{"name": "x", "dimension": "username", "window_minutes": 5, "threshold": 1, "action": "block"}],
+    [{"name": "x", "dimension": "ip", "window_minutes": 5, "threshold": 1, "action": "tag"}],
+    [{"name": "x", "dimension": "ip", "window_minutes": 5, "threshold": 1, "action": "alert"}] * 2,
+    {"rule": []},
+])
+def test_parse_rules_rejects_invalid(rules):
+    with pytest.raises(ValueError):
+        parse_rules(rules)
+
+
+def test_parse_rules_skips_disabled():
+    rules = parse_rules([
+        {"name": "on", "dimension": "subnet", "window_minutes": 5, "threshold": 2, "action": "block"},
+        {"name": "off", "enabled": False},
+    ])
+    assert [rule.name for rule in rules] == ["on"]
+    assert rules[0].block_minutes is None  # постоянная блокировка
+
+
+def test_rules_fire_at_threshold_in_file_order(tmp_path):
+    engine = _engine(tmp_path, [
+        {"name": "subnet_scan", "dimension": "subnet", "count": "attempts", "window_minutes": 5,
+         "threshold": 4, "action": "tag", "tag": "scan"},
+        {"name": "ip_brute", "dimension": "ip", "window_minutes": 15, "threshold": 3,
+         "action": "block", "block_minutes": 10},
+    ])
+    assert engine.evaluate(_attempt(ts=NOW - 60), NOW) == []
+    assert engine.evaluate(_attempt(ip="10.0.0.2", success=True, ts=NOW - 50), NOW) == []
+    assert engine.evaluate(_attempt(ts=NOW - 40), NOW) == []
+
+    matches = engine.evaluate(_attempt(ts=NOW - 30), NOW)
+    assert [(match.rule.name, match.key, match.count) for match in matches] == [
+        ("subnet_scan", "10.0.0.0/24", 4),
+        ("ip_brute", "10.0.0.1", 3),
+    ]
+    # Успешный вход не считается ошибкой, но считается попыткой
+    matches = engine.evaluate(_attempt(success=True, ts=NOW - 20), NOW)
+    assert [match.rule.name for match in matches] == ["subnet_scan"]
+
+
+def test_old_attempts_do_not_fire(tmp_path):
+    engine = _engine(tmp_path, [
+        {"name": "ip_brute", "dimension": "ip", "window_minutes": 15, "threshold": 1, "action": "block"},
+    ])
+    assert engine.evaluate(_attempt(ts=NOW - 16 * 60), NOW) == []
+    assert len(engine.evaluate(_attempt(ts=NOW), NOW)) == 1
+
+
+def test_alert_is_suppressed_for_window(tmp_path):
+    engine = _engine(tmp_path, [
+        {"name": "spray", "dimension": "username", "window_minutes": 10, "threshold": 2, "action": "alert"},
+    ])
+    fired = [bool(engine.evaluate(_attempt(ip=f"10.0.{index}.1", ts=NOW + index), NOW + index))
+             for index in range(5)]
+    assert fired == [False, True, False, False, False]
+    # Окно прошло: порог набирается заново, alert снова отправляется
+    later = NOW + 11 * 60
+    assert not engine.evaluate(_attempt(ts=later), later)
+    assert engine.evaluate(_attempt(ts=later + 1), later + 1)
+
+
+def test_invalid_file_keeps_previous_rules(tmp_path):
+    engine = _engine(tmp_path, [
+        {"name": "subnet_brute", "dimension": "subnet", "window_minutes": 15, "threshold": 3, "action": "block"},
+    ])
+    (tmp_path / "rules.json").write_text("{not json", encoding="utf-8")
+    assert not engine.reload()
+    assert engine.error
+    assert [rule.name for rule in engine.rules] == ["subnet_brute"]
+    assert engine.describe()["counters"]["subnet:failures"]["window_minutes"] == 15
+
+
+def test_counters_are_shared_and_new_ones_are_seeded(tmp_path):
+    history = [("10.0.0.1", "admin", False, NOW - 120), ("10.0.0.2", "admin", False, NOW - 60),
+               ("10.0.0.3", "admin", True, NOW - 30)]
+    counters = FailureCounters(loader=lambda minutes: history)
+    pinned = counters.pin(("ip", "failures"), 60)
+    engine = _engine(tmp_path, [
+        {"name": "ip_brute", "dimension": "ip", "window_minutes": 15, "threshold": 3, "action": "block"},
+    ], counters=counters)
+    assert engine.describe()["counters"]["ip:failures"]["window_minutes"] == 60
+
+    # Попытки, оценённые правилами, видит и закреплённый счётчик БД
+    engine.evaluate(_attempt(ip="10.0.0.9", ts=NOW), NOW)
+    assert pinned.count("10.0.0.9", 15, NOW) == 1
+
+    # Счётчик нового правила после seed() заполняется историей из loader
+    counters.seed()
+    (tmp_path / "rules.json").write_text(json.dumps({"rules": [
+        {"name": "spray", "dimension": "username", "window_minutes": 10, "threshold": 3, "action": "alert"},
+    ]}), encoding="utf-8")
+    assert engine.reload()
+    matches = engine.evaluate(_attempt(ip="10.0.0.4", ts=NOW), NOW)
+    assert [(match.rule.name, match.key, match.count) for match in matches] == [("spray", "admin", 3)]
+    # Закреплённый счётчик пережил смену правил
+    assert engine.describe()["counters"].keys() == {"username:failures"}
+    assert pinned.count("10.0.0.9", 15, NOW) == 1
+
+
+def test_widened_counter_is_backfilled(tmp_path):
+    history = [("10.0.0.1", "admin", False, NOW - 20 * 60), ("10.0.0.2", "admin", False, NOW - 12 * 60)]
+    counters = FailureCounters(loader=lambda minutes: history)
+    engine = _engine(tmp_path, [
+        {"name": "spray", "dimension": "username", "window_minutes": 15, "threshold": 9, "action": "alert"},
+    ], counters=counters)
+    counters.seed()
+    engine.evaluate(_attempt(ip="10.0.0.3", ts=NOW - 60), NOW)
+
+    # Окно выросло: дописываются только попытки старше прежнего окна,
+    # уже учтённые не дублируются
+    (tmp_path / "rules.json").write_text(json.dumps({"rules": [
+        {"name": "spray", "dimension": "username", "window_minutes": 90, "threshold": 4, "action": "alert"},
+    ]}), encoding="utf-8")
+    assert engine.reload()
+    matches = engine.evaluate(_attempt(ip="10.0.0.4", ts=NOW), NOW)
+    assert [(match.rule.name, match.count) for match in matches] == [("spray", 4)]
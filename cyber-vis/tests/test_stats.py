@@ -0,0 +1,55 @@
+from datetime import datetime, timedelta
+
+from database import LoginDatabase
+from records import AttemptRecord
+from stats import StatsEngine
+
+NOW = 1_700_000_000
+
+
+def test_windows_count_by_minute():
+    stats = StatsEngine(ring_minutes=60, precision=10)
+    for minutes_ago in (0, 5, 15, 45, 90):
+        stats.record("admin", "10.0.0.1", False, NOW - minutes_ago * 60)
+    stats.record("alice", "10.0.0.2", True, NOW)
+    assert (stats.total, stats.successful, stats.failed) == (6, 1, 5)
+    assert stats.window_count(10, NOW) == 3
+    assert stats.window_count(30, NOW) == 4
+    # Попытка 90 минут назад вне кольца
+    assert stats.window_count(60, NOW) == 5
+
+
+def test_snapshot_matches_exact_stats(db):
+    now = datetime.now()
+    db.add_attempts([
+        AttemptRecord(f"user{index % 3}", f"10.0.0.{index % 4}", "web", index % 5 == 0,
+                      attempt_time=now - timedelta(minutes=index * 7))
+        for index in range(20)
+    ])
+    fast, exact = db.get_stats(), db.get_stats(exact=True)
+    for key in ("total_attempts", "successful", "failed", "unique_users", "unique_ips",
+                "last_hour", "last_30_min", "last_10_min"):
+        assert fast[key] == exact[key], key
+
+
+def test_reopen_seeds_totals_and_windows(tmp_path):
+    path = str(tmp_path / "stats.db")
+    database = LoginDatabase(path, readers=1)
+    database.open()
+    now = datetime.now()
+    database.add_attempts([
+        AttemptRecord("admin", "10.0.0.1", "web", False, attempt_time=now - timedelta(minutes=2)),
+        AttemptRecord("admin", "10.0.0.2", "web", True, attempt_time=now - timedelta(days=3)),
+    ])
+    database.close()
+
+    database = LoginDatabase(path, readers=1)
+    database.open()
+    try:
+        stats = database.get_stats()
+    finally:
+        database.close()
+    assert (stats["total_attempts"], stats["successful"], stats["failed"]) == (2, 1, 1)
+    assert stats["last_10_min"] == 1
+    assert (stats["unique_users"], stats["unique_ips"]) == (1, 2)
+    assert stats["unique_ips_last_day"] == 1